@@ -1,71 +1,45 @@
-from flask import Flask, render_template, request, jsonify, url_for, session, send_from_directory, Response
-from ce3 import Assistant
+from flask import Flask, render_template, request, jsonify, url_for, session, send_from_directory, Response, stream_with_context
 import os
-from werkzeug.utils import secure_filename
-import base64
 from config import Config
 from dotenv import load_dotenv
 load_dotenv()
 # Import the factory
 from providers.provider_factory import ProviderFactory
+from session_store import SessionConflictError
+from image_preprocessing import store_upload
 import logging # Add logging
 # Import the NeuroSwitch classifier function and default provider
-from neuroswitch_classifier import get_neuroswitch_provider, DEFAULT_PROVIDER
+from neuroswitch_classifier import start_warmup, classifier_status, DEFAULT_PROVIDER
+# Routing, sessions and payloads shared with asgi_app.py
+import chat_service
+from chat_service import (
+    assistant,
+    ALL_PROVIDERS_WITH_NEUROSWITCH,
+    resolve_provider_choice,
+    build_message_content,
+    chat_data_from_form,
+    resolve_image_input,
+    route_provider,
+    select_api_key,
+    build_chat_response_payload,
+    build_session_conflict_payload,
+    save_session_data,
+    select_server_history,
+    sanitize_cache_key,
+)
 import uuid # For generating unique IDs
 import json # Added for json.dumps in reset route
 from functools import wraps # Added wraps
 
 app = Flask(__name__, static_folder='static')
-app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 # Add a secret key for session management
 # You should set FLASK_SECRET_KEY in your .env file for production
 app.secret_key = os.getenv('FLASK_SECRET_KEY', os.urandom(24))
 
-# Ensure upload directory exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-# Assistant is instantiated once, its methods will operate on passed-in history & tokens
-assistant = Assistant()
-
-# Define the static list of providers + NeuroSwitch
-# Define the constant here, where it's used
-NEUROSWITCH_PROVIDER_NAME = "NeuroSwitch"
-ALL_PROVIDERS_WITH_NEUROSWITCH = [NEUROSWITCH_PROVIDER_NAME] + list(ProviderFactory._providers.keys())
-
-# --- Provider Aliases and Normalization ---
-# Direct provider names (lowercase) that the factory supports
-DIRECT_PROVIDER_KEYS = {key.lower() for key in ProviderFactory._providers.keys()}
-
-# Aliases that map to a direct provider (e.g., common model names or shorthand)
-# This can be expanded as needed.
-DIRECT_PROVIDER_ALIASES = {
-    "gpt-4": "openai",
-    "gpt-3.5-turbo": "openai",
-    "gpt-4-turbo": "openai",
-    "gpt-4o": "openai",
-    "claude-3-opus": "claude",
-    "claude-3-sonnet": "claude",
-    "claude-3-haiku": "claude",
-    "gemini-1.5-pro": "gemini",
-    "gemini-1.0-pro": "gemini",
-    # Add other common model name aliases here
-}
-
-# Aliases that explicitly mean to use the NeuroSwitch router
-NEUROSWITCH_ROUTER_ALIASES = {
-    "neuroswitch", # Canonical name
-    "auto",
-    "router",
-    "smart",
-    "intelligentrouter"
-}
-# --- End Provider Aliases ---
-
-# Server-side storage for API client session data
-# Key: Client-provided session ID (from X-Session-ID or Authorization header)
-# Value: {'conversation_history': [], 'total_tokens_used': 0}
-api_client_session_store = {}
+# The NeuroSwitch model loads in the background (or on first use), so the server binds immediately
+if Config.NEUROSWITCH_WARMUP != 'lazy':
+    start_warmup(background=Config.NEUROSWITCH_WARMUP != 'blocking')
 
 # --- Basic Auth Definition ---
 EXPECTED_USERNAME = os.getenv("FLASK_BASIC_AUTH_USERNAME")
@@ -121,34 +95,39 @@ def get_session_data(identifier: str, session_type: str) -> dict:
     """
     Retrieves conversation history and token count for the given identifier and type.
     Initializes if not present.
+
+    Browser (flask_session) conversations are kept in the server-side session store under the
+    opaque ID held in the cookie; the cookie itself never carries the history, so its size and
+    per-request signing cost stay constant as the conversation grows.
     """
-    if session_type == "api":
-        if identifier not in api_client_session_store:
-            api_client_session_store[identifier] = {'conversation_history': [], 'total_tokens_used': 0}
-            logging.info(f"Initialized new history for API client ID: {identifier}")
-        return api_client_session_store[identifier]
-    else: # flask_session
-        if 'conversation_history' not in session:
-            session['conversation_history'] = []
-            session['total_tokens_used'] = 0
-            logging.info(f"Initialized new history for Flask session ID: {identifier}")
-        return {'conversation_history': session['conversation_history'], 'total_tokens_used': session['total_tokens_used']}
+    if session_type == "flask_session":
+        migrate_cookie_history(identifier)
+    return chat_service.api_client_session_store.get(identifier)
 
-def save_session_data(identifier: str, session_type: str, history: list, tokens: int):
+def migrate_cookie_history(identifier: str):
     """
-    Saves conversation history and token count for the given identifier and type.
+    Moves history left in the cookie by older versions (which signed the whole conversation
+    into the Flask session) into the server-side store, and drops it from the cookie.
     """
-    if session_type == "api":
-        if identifier in api_client_session_store: # Should always be true if get_session_data was called
-             api_client_session_store[identifier]['conversation_history'] = history
-             api_client_session_store[identifier]['total_tokens_used'] = tokens
-        else: # Should not happen if logic is correct
-            logging.error(f"Attempted to save session data for uninitialized API client ID: {identifier}")
-            api_client_session_store[identifier] = {'conversation_history': history, 'total_tokens_used': tokens}
-    else: # flask_session
-        session['conversation_history'] = history
-        session['total_tokens_used'] = tokens
-        session.modified = True # Important for Flask to save session changes
+    if 'conversation_history' not in session and 'total_tokens_used' not in session:
+        return
+    history = session.pop('conversation_history', [])
+    tokens = session.pop('total_tokens_used', 0)
+    session.pop('history_server_side', None)
+    if history and not chat_service.api_client_session_store.exists(identifier):
+        chat_service.api_client_session_store.save(identifier, history, tokens)
+    session.modified = True
+    logging.info(f"Moved cookie-stored history ({len(history)} messages) server-side for Flask session ID: {identifier}")
+
+def wants_streaming_response(data: dict) -> bool:
+    """A /chat request is streamed if the JSON body sets "stream": true or the client accepts text/event-stream."""
+    if data.get('stream') is True:
+        return True
+    return request.accept_mimetypes.best == 'text/event-stream'
+
+def sse_event(event: str, payload: dict) -> str:
+    """Format one Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
 
 @app.route('/')
 @requires_basic_auth # Apply the decorator
@@ -179,151 +158,68 @@ def set_provider():
 def chat():
     req_id, req_type = get_request_identifier_and_type()
     
-    # Extract provider-specific API keys from headers
-    openai_user_key = request.headers.get("X-OpenAI-API-Key")
-    claude_user_key = request.headers.get("X-Claude-API-Key")
-    gemini_user_key = request.headers.get("X-Gemini-API-Key")
-
     logging.critical(f"----- NEW /chat REQUEST -----")
     logging.critical(f"Incoming req_id: {req_id}, req_type: {req_type}")
 
     session_data = get_session_data(req_id, req_type)
     server_stored_history = session_data['conversation_history']
     current_total_tokens_used = session_data['total_tokens_used']
+    session_version = session_data['version'] # Checked again when the turn is saved (optimistic concurrency)
 
-    data = request.json
-    logging.debug(f"API Chat ID: {req_id}. Full request JSON data: {data}")
+    try:
+        if request.mimetype == 'multipart/form-data':
+            data, image = chat_data_from_form(request.form, request.files)
+        else:
+            data = request.json
+            image = resolve_image_input(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    logging.debug(f"API Chat ID: {req_id}. Full request data: {data}")
 
     # --- Get client-provided history if available ---
     client_provided_history = data.get('history')
     history_to_use = server_stored_history # Default to server-side history
     history_source_for_logging = "server_store"
+    client_history_for_save = None # Set when the client's history replaces the stored one
 
     if client_provided_history is not None and isinstance(client_provided_history, list):
         logging.info(f"Chat ID: {req_id}. Client provided a history with {len(client_provided_history)} messages. PRIORITIZING client history.")
         history_to_use = client_provided_history
+        client_history_for_save = client_provided_history
         history_source_for_logging = "client_payload"
     else:
         logging.info(f"Chat ID: {req_id}. No valid client-provided history found, or not provided. Using history from {history_source_for_logging} with {len(history_to_use)} messages.")
 
     message = data.get('message')
-    image_data = data.get('image_data') 
     mode = data.get('mode')
     client_specified_model = data.get('model')
 
     # --- Refined Provider Selection Logic for API and Flask UI ---
-    is_direct_provider_request = False 
-    provider_to_use_for_routing_or_direct_call = None
-
     if req_type == "api":
-        model_from_payload = data.get('requested_provider')
-        normalized_model_payload = str(model_from_payload).lower() if model_from_payload else None
-
-        logging.info(f"API Chat ID: {req_id}. Provider determination based on JSON payload 'requested_provider': '{model_from_payload}'")
-
-        if normalized_model_payload:
-            if normalized_model_payload in DIRECT_PROVIDER_KEYS:
-                provider_to_use_for_routing_or_direct_call = normalized_model_payload
-                is_direct_provider_request = True 
-            elif DIRECT_PROVIDER_ALIASES.get(normalized_model_payload) in DIRECT_PROVIDER_KEYS:
-                provider_to_use_for_routing_or_direct_call = DIRECT_PROVIDER_ALIASES[normalized_model_payload]
-                is_direct_provider_request = True
-                logging.info(f"API Chat ID: {req_id}. 'requested_provider' field '{model_from_payload}' mapped to direct provider '{provider_to_use_for_routing_or_direct_call}' via alias.")
-            elif normalized_model_payload in NEUROSWITCH_ROUTER_ALIASES:
-                provider_to_use_for_routing_or_direct_call = NEUROSWITCH_PROVIDER_NAME
-            else:
-                logging.warning(f"API Chat ID: {req_id}. 'requested_provider' field '{model_from_payload}' not recognized. Defaulting to NeuroSwitch router.")
-                provider_to_use_for_routing_or_direct_call = NEUROSWITCH_PROVIDER_NAME
-        else:
-            logging.warning(f"API Chat ID: {req_id}. 'requested_provider' field missing in JSON payload. Defaulting to NeuroSwitch router.")
-            provider_to_use_for_routing_or_direct_call = NEUROSWITCH_PROVIDER_NAME
-
+        logging.info(f"API Chat ID: {req_id}. Provider determination based on JSON payload 'requested_provider': '{data.get('requested_provider')}'")
+        provider_to_use_for_routing_or_direct_call, is_direct_provider_request = resolve_provider_choice(data.get('requested_provider'), req_id, "'requested_provider' field")
     else: # req_type == "flask_session"
         provider_from_session = session.get('provider', DEFAULT_PROVIDER)
-        normalized_session_provider = provider_from_session.lower()
         logging.info(f"Flask Session Chat ID: {req_id}. Provider from session: '{provider_from_session}'")
-
-        if normalized_session_provider in DIRECT_PROVIDER_KEYS:
-            provider_to_use_for_routing_or_direct_call = normalized_session_provider
-            is_direct_provider_request = True
-        elif DIRECT_PROVIDER_ALIASES.get(normalized_session_provider) in DIRECT_PROVIDER_KEYS:
-            provider_to_use_for_routing_or_direct_call = DIRECT_PROVIDER_ALIASES[normalized_session_provider]
-            is_direct_provider_request = True
-        elif normalized_session_provider in NEUROSWITCH_ROUTER_ALIASES: 
-            provider_to_use_for_routing_or_direct_call = NEUROSWITCH_PROVIDER_NAME
-        else: 
-            logging.warning(f"Flask Session Chat ID: {req_id}. Provider '{provider_from_session}' from session not recognized. Defaulting to NeuroSwitch router.")
-            provider_to_use_for_routing_or_direct_call = NEUROSWITCH_PROVIDER_NAME
+        provider_to_use_for_routing_or_direct_call, is_direct_provider_request = resolve_provider_choice(provider_from_session, req_id, "Session provider")
     
     logging.info(f"Chat ID: {req_id}. Initial Provider Decision: '{provider_to_use_for_routing_or_direct_call}', Is Direct Request Flag: {is_direct_provider_request}")
 
-    # --- NeuroSwitch Logic ---
-    actual_provider_name_to_instantiate = provider_to_use_for_routing_or_direct_call 
-    neuroswitch_active = False
-    fallback_reason = None
-
     # Prepare message content and extract text for classification
-    if image_data:
-        message_content = [
-            {
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/jpeg", # TODO: Detect media_type
-                    "data": image_data.split(',')[1] if ',' in image_data else image_data
-                }
-            }
-        ]
-        if message.strip():
-            text_part = {"type": "text", "text": message}
-            message_content.append(text_part)
-            text_input_for_classification = message
-        else:
-             text_input_for_classification = "Image uploaded"
-    else:
-        message_content = message
-        text_input_for_classification = message
-
-    # Classifier runs if it was NOT a direct request AND the chosen path was NeuroSwitch
-    if not is_direct_provider_request and provider_to_use_for_routing_or_direct_call == NEUROSWITCH_PROVIDER_NAME:
-        logging.info(f"NeuroSwitch classifier activated for ID: {req_id}. Classifying input: '{text_input_for_classification[:100]}...' ")
-        neuroswitch_status = get_neuroswitch_provider(text_input_for_classification)
-        actual_provider_name_to_instantiate = neuroswitch_status["provider"] 
-        neuroswitch_active = neuroswitch_status["neuroswitch_active"] 
-        fallback_reason = neuroswitch_status["fallback_reason"]
-        logging.info(f"NeuroSwitch classifier for ID: {req_id} result: Provider='{actual_provider_name_to_instantiate}', Classifier Active Flag={neuroswitch_active}, Reason='{fallback_reason}'")
-    elif is_direct_provider_request:
-        logging.info(f"Chat ID: {req_id}. Using DIRECTLY specified provider: {actual_provider_name_to_instantiate}. NeuroSwitch classifier bypassed.")
-    else:
-        logging.error(f"Chat ID: {req_id}. Unexpected provider routing state. Provider for routing was '{provider_to_use_for_routing_or_direct_call}' but not NeuroSwitch, and not flagged as a direct request. Attempting to use it directly. NeuroSwitch classifier bypassed.")
-        actual_provider_name_to_instantiate = provider_to_use_for_routing_or_direct_call 
+    message_content, text_input_for_classification = build_message_content(message, image)
+    if client_history_for_save is None:
+        history_to_use = select_server_history(req_id, session_data, text_input_for_classification)
 
-    # API Key Selection Logic
-    selected_key_to_pass_to_factory = None
-    key_source_for_logging = "Unknown" 
+    # --- NeuroSwitch Logic ---
+    actual_provider_name_to_instantiate, neuroswitch_active, fallback_reason, affinity_override = route_provider(
+        provider_to_use_for_routing_or_direct_call, is_direct_provider_request, text_input_for_classification, req_id,
+        session_provider=session_data['last_provider'] if client_history_for_save is None else None,
+        history_length=len(client_history_for_save if client_history_for_save is not None else server_stored_history)
+    )
 
-    if actual_provider_name_to_instantiate == "openai":
-        if openai_user_key:
-            selected_key_to_pass_to_factory = openai_user_key
-            key_source_for_logging = "X-OpenAI-API-Key header"
-        else:
-            selected_key_to_pass_to_factory = Config.OPENAI_API_KEY
-            key_source_for_logging = ".env (OPENAI_API_KEY)"
-    elif actual_provider_name_to_instantiate == "claude":
-        if claude_user_key:
-            selected_key_to_pass_to_factory = claude_user_key
-            key_source_for_logging = "X-Claude-API-Key header"
-        else:
-            selected_key_to_pass_to_factory = Config.ANTHROPIC_API_KEY
-            key_source_for_logging = ".env (ANTHROPIC_API_KEY)"
-    elif actual_provider_name_to_instantiate == "gemini":
-        if gemini_user_key:
-            selected_key_to_pass_to_factory = gemini_user_key
-            key_source_for_logging = "X-Gemini-API-Key header"
-        else:
-            selected_key_to_pass_to_factory = Config.GEMINI_API_KEY
-            key_source_for_logging = ".env (GEMINI_API_KEY)"
-    else:
+    # API Key Selection Logic
+    selected_key_to_pass_to_factory, key_source_for_logging = select_api_key(actual_provider_name_to_instantiate, request.headers)
+    if key_source_for_logging is None:
         logging.error(f"[Chat ID: {req_id}] Unknown provider '{actual_provider_name_to_instantiate}' determined. Cannot select API key.")
         return jsonify({
             'response': f"Error: Unknown provider '{actual_provider_name_to_instantiate}' specified.",
@@ -339,10 +235,10 @@ def chat():
     else:
         logging.warning(f"[Chat ID: {req_id}] No API key found for provider '{actual_provider_name_to_instantiate}' from header or .env. Provider initialization will likely fail or use a non-functional default.")
 
-    # Instantiate the provider
+    # Borrow the provider (and its warm SDK client) from the shared pool
     logging.info(f"API Chat ID: {req_id}. Attempting to instantiate provider: '{actual_provider_name_to_instantiate}' with key from '{key_source_for_logging}'. Client-specified model: '{client_specified_model}'.")
     try:
-        provider = ProviderFactory.create_provider(
+        provider = ProviderFactory.get_provider(
             actual_provider_name_to_instantiate, 
             api_key=selected_key_to_pass_to_factory,
             client_model=client_specified_model
@@ -368,6 +264,64 @@ def chat():
              'token_usage': {'total_tokens': current_total_tokens_used, 'max_tokens': Config.MAX_CONVERSATION_TOKENS}
          }), 500
     
+    if wants_streaming_response(data):
+        def generate_stream():
+            yield sse_event('meta', {
+                'provider_used': actual_provider_name_to_instantiate,
+                'neuroswitch_active': neuroswitch_active,
+                'fallback_reason': fallback_reason,
+                'affinity_override': affinity_override
+            })
+            result_data = None
+            for event in assistant.stream_chat(
+                user_input=message_content,
+                provider=provider,
+                conversation_history=history_to_use,
+                total_tokens_used=current_total_tokens_used,
+                mode=mode,
+                request_id=req_id,
+                history_key=sanitize_cache_key(req_id, client_history_for_save)
+            ):
+                if event['type'] == 'text_delta':
+                    yield sse_event('delta', {'text': event['text']})
+                elif event['type'] == 'final':
+                    result_data = event['result']
+
+            if result_data.get('error'):
+                # The provider failed; its partial reply is not a turn, so nothing is saved
+                logging.warning(f"Streamed chat for ID: {req_id} failed: {result_data['error']}")
+                payload = build_chat_response_payload(result_data, actual_provider_name_to_instantiate, neuroswitch_active, fallback_reason, affinity_override)
+                payload['error'] = 'provider_error'
+                yield sse_event('error', payload)
+                return
+
+            try:
+                save_session_data(req_id, result_data, client_history_for_save, session_version)
+            except SessionConflictError as e:
+                logging.warning(f"Streamed chat for ID: {req_id} not saved: {e}")
+                yield sse_event('error', build_session_conflict_payload(result_data, actual_provider_name_to_instantiate, neuroswitch_active, fallback_reason, affinity_override))
+                return
+            except Exception as e:
+                # The reply was streamed but not stored; tell the client instead of ending the stream silently
+                logging.exception(f"Error saving streamed chat for ID: {req_id}")
+                yield sse_event('error', {
+                    'response': f"Error processing chat: {str(e)}",
+                    'provider_used': actual_provider_name_to_instantiate,
+                    'model_used': 'unknown',
+                    'neuroswitch_active': neuroswitch_active,
+                    'fallback_reason': fallback_reason,
+                    'token_usage': {'total_tokens': current_total_tokens_used, 'max_tokens': Config.MAX_CONVERSATION_TOKENS}
+                })
+                return
+            logging.info(f"Streamed chat finished for ID: {req_id}. Added {len(result_data['new_messages'])} messages. New Tokens: {result_data['total_tokens']}")
+            yield sse_event('done', build_chat_response_payload(result_data, actual_provider_name_to_instantiate, neuroswitch_active, fallback_reason, affinity_override))
+
+        return Response(
+            stream_with_context(generate_stream()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
     try:
         # Call assistant.chat (simplified without tool support)
         result_data = assistant.chat(
@@ -376,36 +330,21 @@ def chat():
             conversation_history=history_to_use,
             total_tokens_used=current_total_tokens_used,       
             mode=mode,
-            request_id=req_id
+            request_id=req_id,
+            history_key=sanitize_cache_key(req_id, client_history_for_save)
         )
 
         logging.debug(f"App.py: Data received from assistant.chat: {json.dumps(result_data, default=str)}")
 
         # Save the updated history and tokens back to the correct session store
-        save_session_data(req_id, req_type, result_data['updated_history'], result_data['total_tokens'])
-        logging.info(f"Chat successful for ID: {req_id}. New history length: {len(result_data['updated_history'])}. New Tokens: {result_data['total_tokens']}")
+        save_session_data(req_id, result_data, client_history_for_save, session_version)
+        logging.info(f"Chat successful for ID: {req_id}. Added {len(result_data['new_messages'])} messages. New Tokens: {result_data['total_tokens']}")
 
-        response_text = result_data.get('assistant_response', "[No response text received]")
-        provider_used = result_data.get('provider_used', actual_provider_name_to_instantiate)
-        model_used = result_data.get('model_used', 'unknown')
-        usage_from_assistant = result_data.get('usage', {})
-        
-        token_usage_response = {
-            'input_tokens': usage_from_assistant.get('input_tokens', 0),
-            'output_tokens': usage_from_assistant.get('output_tokens', 0),
-            'runtime': usage_from_assistant.get('runtime', 0.0),
-            'total_tokens': result_data['total_tokens'],
-            'max_tokens': Config.MAX_CONVERSATION_TOKENS,
-        }
-        
-        return jsonify({
-            'response': response_text,
-            'provider_used': provider_used,
-            'model_used': model_used,
-            'neuroswitch_active': neuroswitch_active, 
-            'fallback_reason': fallback_reason,
-            'token_usage': token_usage_response
-        })
+        return jsonify(build_chat_response_payload(result_data, actual_provider_name_to_instantiate, neuroswitch_active, fallback_reason, affinity_override))
+
+    except SessionConflictError as e:
+        logging.warning(f"Chat for ID: {req_id} not saved: {e}")
+        return jsonify(build_session_conflict_payload(result_data, actual_provider_name_to_instantiate, neuroswitch_active, fallback_reason, affinity_override)), 409
         
     except Exception as e:
         logging.exception(f"Error during assistant.chat call for ID: {req_id}")
@@ -430,28 +369,25 @@ def upload_file():
         return jsonify({'error': 'No selected file'}), 400
     
     if file and file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Get the actual media type
-        media_type = file.content_type or 'image/jpeg'  # Default to jpeg if not detected
-        
-        # Convert image to base64
-        with open(filepath, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        
-        # Clean up the file
-        os.remove(filepath)
-        
+        # Validated by its magic bytes, downscaled and stored once by content hash;
+        # /chat and the history refer to it by this id
+        try:
+            image_id, media_type = store_upload(file.read())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         return jsonify({
             'success': True,
-            'image_data': encoded_string,
+            'image_id': image_id,
             'media_type': media_type
         })
     
     return jsonify({'error': 'Invalid file type'}), 400
 
+@app.route('/health', methods=['GET'])
+def health():
+    # Always 200 once the server is up; 'neuroswitch.state' tells a readiness probe whether routing uses the model yet
+    return jsonify({'status': 'ok', 'neuroswitch': classifier_status()})
+
 @app.route('/reset', methods=['POST'])
 def reset():
     req_id, req_type = get_request_identifier_and_type()
@@ -460,19 +396,17 @@ def reset():
     logging.critical(f"Incoming req_id for reset: {req_id}, req_type: {req_type}")
     
     if req_type == "api":
-        if req_id in api_client_session_store:
-            api_client_session_store[req_id]['conversation_history'] = []
-            api_client_session_store[req_id]['total_tokens_used'] = 0
+        if chat_service.api_client_session_store.exists(req_id):
+            chat_service.api_client_session_store.reset(req_id)
             logging.critical(f"Conversation RESET for API client ID: {req_id}")
             status_message = f"Conversation reset for API client ID: {req_id}"
         else:
-            api_client_session_store[req_id] = {'conversation_history': [], 'total_tokens_used': 0}
+            chat_service.api_client_session_store.reset(req_id)
             logging.critical(f"No active session found for API client ID '{req_id}' to reset, but INITIALIZED it as empty.")
             status_message = f"No active session found for API client ID '{req_id}' to reset; initialized as new empty session."
     else: # flask_session
-        session['conversation_history'] = []
-        session['total_tokens_used'] = 0
-        session.modified = True
+        migrate_cookie_history(req_id)
+        chat_service.api_client_session_store.reset(req_id)
         logging.info(f"Conversation reset for Flask session ID: {req_id}")
         status_message = f"Conversation reset for Flask session ID: {req_id}"
         
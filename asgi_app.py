@@ -0,0 +1,215 @@
+"""
+Asyncio-native (ASGI) serving mode for the Fusion API.
+
+Exposes the same /chat, /upload, /reset, /set_provider and /health routes as app.py, but awaits
+provider.achat() (AsyncAnthropic, AsyncOpenAI, Gemini generate_content_async) instead of
+holding a worker thread for the whole vendor call, so one process can keep thousands of
+conversations in flight. Routing, API key selection and session storage come from
+chat_service.py, shared with app.py; the Flask app remains the serving path for the web UI.
+
+Run with an ASGI server, e.g.:
+    hypercorn asgi_app:app --bind 0.0.0.0:5001
+"""
+import asyncio
+import logging
+import os
+import uuid
+
+try:
+    from quart import Quart, request, jsonify, session
+except ImportError:
+    raise ImportError("The 'quart' library is required for the ASGI app. Please install it using: pip install quart")
+
+from config import Config
+from providers.provider_factory import ProviderFactory
+from neuroswitch_classifier import DEFAULT_PROVIDER, classifier_status, start_warmup
+import chat_service
+from chat_service import (
+    assistant,
+    ALL_PROVIDERS_WITH_NEUROSWITCH,
+    resolve_provider_choice,
+    build_message_content,
+    chat_data_from_form,
+    resolve_image_input,
+    route_provider,
+    select_api_key,
+    build_chat_response_payload,
+    build_session_conflict_payload,
+    save_session_data,
+    select_server_history,
+    sanitize_cache_key,
+)
+from session_store import SessionConflictError
+from image_preprocessing import store_upload_stream
+
+app = Quart(__name__)
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size, same as app.py
+app.secret_key = os.getenv('FLASK_SECRET_KEY', os.urandom(24))
+
+ALLOWED_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+
+@app.before_serving
+async def warm_up_classifier():
+    # Same NEUROSWITCH_WARMUP handling as app.py; 'blocking' delays serving until the model is loaded
+    if Config.NEUROSWITCH_WARMUP != 'lazy':
+        await asyncio.to_thread(start_warmup, background=Config.NEUROSWITCH_WARMUP != 'blocking')
+
+def get_request_identifier_and_type() -> tuple[str, str]:
+    """
+    Same contract as app.get_request_identifier_and_type(): 'X-Session-ID' or
+    'Authorization: Bearer <token>' identify API clients, otherwise a cookie session is used.
+    Cookie sessions here always keep their history server-side.
+    """
+    session_id_header = request.headers.get('X-Session-ID')
+    auth_header = request.headers.get('Authorization')
+
+    if session_id_header:
+        return session_id_header, "api"
+    elif auth_header and auth_header.startswith('Bearer '):
+        return auth_header.split('Bearer ')[1].strip(), "api"
+    if 'neuroswitch_flask_session_id' not in session:
+        session['neuroswitch_flask_session_id'] = str(uuid.uuid4())
+    return session['neuroswitch_flask_session_id'], "flask_session"
+
+def get_session_data(identifier: str) -> dict:
+    return chat_service.api_client_session_store.get(identifier)
+
+def error_payload(message: str, provider_name: str, neuroswitch_active: bool, fallback_reason, total_tokens: int) -> dict:
+    return {
+        'response': message,
+        'provider_used': provider_name,
+        'model_used': 'unknown',
+        'neuroswitch_active': neuroswitch_active,
+        'fallback_reason': fallback_reason,
+        'token_usage': {'total_tokens': total_tokens, 'max_tokens': Config.MAX_CONVERSATION_TOKENS}
+    }
+
+@app.route('/set_provider', methods=['POST'])
+async def set_provider():
+    req_id, _ = get_request_identifier_and_type()
+    data = await request.get_json()
+    provider_name = data.get('provider')
+    if provider_name and provider_name in ALL_PROVIDERS_WITH_NEUROSWITCH:
+        session['provider'] = provider_name
+        logging.info(f"[ASGI] Set provider selection to: {provider_name} (ID: {req_id})")
+        return jsonify({'status': 'success', 'provider': provider_name})
+    logging.warning(f"[ASGI] Invalid provider requested: {provider_name} by ID: {req_id}")
+    return jsonify({'status': 'error', 'message': 'Invalid provider'}), 400
+
+@app.route('/chat', methods=['POST'])
+async def chat():
+    req_id, req_type = get_request_identifier_and_type()
+    try:
+        if request.mimetype == 'multipart/form-data':
+            # Werkzeug's parser spools the image part to a temporary file; storing it is blocking
+            form, files = await request.form, await request.files
+            data, image = await asyncio.to_thread(chat_data_from_form, form, files)
+        else:
+            data = await request.get_json()
+            # Reading the blob, or decoding, resizing and storing base64 image_data, is blocking
+            image = await asyncio.to_thread(resolve_image_input, data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # The SQLite store can wait up to its busy timeout for a write lock; keep store I/O off the event loop
+    session_data = await asyncio.to_thread(get_session_data, req_id)
+    current_total_tokens_used = session_data['total_tokens_used']
+    session_version = session_data['version']
+    client_provided_history = data.get('history')
+    if not isinstance(client_provided_history, list):
+        client_provided_history = None
+
+    if req_type == "api":
+        provider_for_routing, is_direct = resolve_provider_choice(data.get('requested_provider'), req_id, "'requested_provider' field")
+    else:
+        provider_for_routing, is_direct = resolve_provider_choice(session.get('provider', DEFAULT_PROVIDER), req_id, "Session provider")
+
+    message_content, text_input_for_classification = build_message_content(data.get('message'), image)
+    if client_provided_history is not None:
+        history_to_use = client_provided_history
+    else:
+        # Embedding the query for retrieval memory is CPU-bound; keep it off the event loop
+        history_to_use = await asyncio.to_thread(select_server_history, req_id, session_data, text_input_for_classification)
+
+    # The classifier is CPU-bound; keep it off the event loop
+    provider_name, neuroswitch_active, fallback_reason, affinity_override = await asyncio.to_thread(
+        route_provider, provider_for_routing, is_direct, text_input_for_classification, req_id,
+        session_data['last_provider'] if client_provided_history is None else None,
+        len(client_provided_history if client_provided_history is not None else session_data['conversation_history'])
+    )
+
+    api_key, key_source = select_api_key(provider_name, request.headers)
+    if key_source is None:
+        logging.error(f"[ASGI Chat ID: {req_id}] Unknown provider '{provider_name}' determined. Cannot select API key.")
+        return jsonify(error_payload(f"Error: Unknown provider '{provider_name}' specified.", provider_name, neuroswitch_active, fallback_reason, current_total_tokens_used)), 500
+
+    try:
+        provider = ProviderFactory.get_provider(provider_name, api_key=api_key, client_model=data.get('model'))
+    except ValueError as e:
+        logging.error(f"[ASGI Chat ID: {req_id}] Failed to create provider instance '{provider_name}': {e}")
+        return jsonify(error_payload(f"Error: Could not initialize AI provider '{provider_name}'. Please select a valid provider or check configuration.", provider_name, neuroswitch_active, fallback_reason, current_total_tokens_used)), 400
+    except Exception:
+        logging.exception(f"[ASGI] Unexpected error creating provider '{provider_name}' for ID: {req_id}")
+        return jsonify(error_payload("Error: An unexpected error occurred while setting up the AI provider.", provider_name, neuroswitch_active, fallback_reason, current_total_tokens_used)), 500
+
+    try:
+        result_data = await assistant.achat(
+            user_input=message_content,
+            provider=provider,
+            conversation_history=history_to_use,
+            total_tokens_used=current_total_tokens_used,
+            mode=data.get('mode'),
+            request_id=req_id,
+            history_key=sanitize_cache_key(req_id, client_provided_history)
+        )
+        await asyncio.to_thread(save_session_data, req_id, result_data, client_provided_history, session_version)
+        logging.info(f"[ASGI] Chat successful for ID: {req_id}. Added {len(result_data['new_messages'])} messages. New Tokens: {result_data['total_tokens']}")
+        return jsonify(build_chat_response_payload(result_data, provider_name, neuroswitch_active, fallback_reason, affinity_override))
+    except SessionConflictError as e:
+        logging.warning(f"[ASGI] Chat for ID: {req_id} not saved: {e}")
+        return jsonify(build_session_conflict_payload(result_data, provider_name, neuroswitch_active, fallback_reason, affinity_override)), 409
+    except Exception as e:
+        logging.exception(f"[ASGI] Error during assistant.achat call for ID: {req_id}")
+        return jsonify(error_payload(f"Error processing chat: {str(e)}", provider_name, neuroswitch_active, fallback_reason, current_total_tokens_used)), 500
+
+@app.route('/upload', methods=['POST'])
+async def upload_file():
+    req_id, _ = get_request_identifier_and_type()
+    logging.info(f"[ASGI] Upload attempt by ID: {req_id}")
+    files = await request.files
+    if 'file' not in files:
+        return jsonify({'error': 'No file part'}), 400
+
+    file = files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+
+    if file.filename.lower().endswith(ALLOWED_IMAGE_EXTENSIONS):
+        # Sniffed, downscaled and stored once by content hash. Reading the spooled part, decoding
+        # and resizing all block, so they run off the event loop. /chat refers to the image by id
+        try:
+            image_id, media_type = await asyncio.to_thread(store_upload_stream, file.stream)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({
+            'success': True,
+            'image_id': image_id,
+            'media_type': media_type
+        })
+
+    return jsonify({'error': 'Invalid file type'}), 400
+
+@app.route('/health', methods=['GET'])
+async def health():
+    return jsonify({'status': 'ok', 'neuroswitch': classifier_status()})
+
+@app.route('/reset', methods=['POST'])
+async def reset():
+    req_id, req_type = get_request_identifier_and_type()
+    await asyncio.to_thread(chat_service.api_client_session_store.reset, req_id)
+    logging.info(f"[ASGI] Conversation reset for {req_type} ID: {req_id}")
+    return jsonify({'status': 'success', 'message': f"Conversation reset for ID: {req_id}"})
+
+if __name__ == '__main__':
+    # Development only; use hypercorn/uvicorn in production
+    app.run(host='0.0.0.0', port=5001)
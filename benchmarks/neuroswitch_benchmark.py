@@ -0,0 +1,110 @@
+"""
+Benchmark for the NeuroSwitch classifier engines: time per routed message and routing agreement.
+
+For each engine it reports:
+  load   - building the classifier (model load plus label embeddings for the embedding engine)
+  p50/p95 - milliseconds per classification over the sample prompts
+  agree  - share of prompts routed to the same provider as the first engine listed (with the
+           defaults, parity of the int8 ONNX and embedding engines with PyTorch zero-shot)
+
+With --threads N it also reports classifications/sec for N concurrent callers, each calling the
+classifier directly and through the micro-batcher (neuroswitch_classifier._classify_batch).
+
+Usage:
+    python benchmarks/neuroswitch_benchmark.py [--engines zero-shot onnx embedding] [--repeat 5]
+    python benchmarks/neuroswitch_benchmark.py --embedding-model hashing   # no model download
+    python benchmarks/neuroswitch_benchmark.py --engines zero-shot --threads 8 --batch-size 8 --batch-wait-ms 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import neuroswitch_classifier
+from config import Config
+from micro_batcher import MicroBatcher
+from neuroswitch_classifier import CANDIDATE_LABELS, LABEL_PROVIDER_MAP, DEFAULT_PROVIDER
+
+PROMPTS = [
+    "Can you write a Python script that renames all files in a folder?",
+    "What's the weather going to be like in Berlin this weekend?",
+    "Summarize the key points of this quarterly earnings call transcript.",
+    "Translate 'where is the train station' into Italian.",
+    "Is this clause in my employment contract enforceable?",
+    "Give me a recipe for a quick weeknight pasta.",
+    "Which noise-cancelling headphones are worth buying?",
+    "Help me plan a week in Iceland in October.",
+    "Why does my React component re-render on every keystroke?",
+    "What year did the Berlin Wall fall?",
+    "Solve for x: 2x^2 - 8 = 0",
+    "Write a catchy product description for handmade candles.",
+    "Image uploaded",
+    "hi",
+]
+
+def build(engine: str):
+    Config.NEUROSWITCH_ENGINE = engine
+    started = time.perf_counter()
+    classifier = neuroswitch_classifier._build_pipeline()
+    return classifier, time.perf_counter() - started
+
+def throughput(classify, threads: int, total: int) -> float:
+    """Classifications per second with `threads` callers sharing `total` requests."""
+    texts = [PROMPTS[i % len(PROMPTS)] for i in range(total)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(classify, texts))
+    return total / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engines', nargs='+', default=['zero-shot', 'onnx', 'embedding'])
+    parser.add_argument('--embedding-model', default=Config.NEUROSWITCH_EMBEDDING_MODEL)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=0, help='Also measure throughput with this many concurrent callers')
+    parser.add_argument('--batch-size', type=int, default=Config.NEUROSWITCH_BATCH_MAX_SIZE)
+    parser.add_argument('--batch-wait-ms', type=float, default=Config.NEUROSWITCH_BATCH_MAX_WAIT_MS)
+    args = parser.parse_args()
+    Config.NEUROSWITCH_EMBEDDING_MODEL = args.embedding_model
+
+    print(f"{len(PROMPTS)} prompts x {args.repeat} repeats, {len(CANDIDATE_LABELS)} labels")
+    print(f"{'engine':>10} {'load s':>8} {'p50 ms':>8} {'p95 ms':>8} {'agree':>6}")
+    reference = None
+    for engine in args.engines:
+        try:
+            classifier, load_seconds = build(engine)
+        except ImportError as e:
+            print(f"{engine:>10} skipped: {e}")
+            continue
+        classifier(PROMPTS[0], CANDIDATE_LABELS, multi_label=False)  # Warm up outside the timings
+
+        timings, routes = [], []
+        for _ in range(args.repeat):
+            for prompt in PROMPTS:
+                started = time.perf_counter()
+                result = classifier(prompt, CANDIDATE_LABELS, multi_label=False)
+                timings.append((time.perf_counter() - started) * 1000)
+                routes.append(LABEL_PROVIDER_MAP.get(result['labels'][0], DEFAULT_PROVIDER))
+        routes = routes[:len(PROMPTS)]
+        if reference is None:
+            reference = routes
+        agreement = sum(a == b for a, b in zip(routes, reference)) / len(PROMPTS)
+        p95 = statistics.quantiles(timings, n=20)[-1]
+        print(f"{engine:>10} {load_seconds:>8.2f} {statistics.median(timings):>8.2f} {p95:>8.2f} {agreement:>6.0%}")
+
+        if args.threads:
+            total = len(PROMPTS) * args.repeat
+            direct = throughput(lambda text: classifier(text, CANDIDATE_LABELS, multi_label=False), args.threads, total)
+            neuroswitch_classifier.classifier_pipeline = classifier
+            batcher = MicroBatcher(neuroswitch_classifier._classify_batch, max_batch_size=args.batch_size,
+                                   max_wait_seconds=args.batch_wait_ms / 1000)
+            batched = throughput(batcher, args.threads, total)
+            print(f"{'':>10} {args.threads} threads: {direct:.1f}/s direct, {batched:.1f}/s batched "
+                  f"(average batch {batcher.stats()['average_batch']})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark for retrieval_memory: per-session index build and query time as sessions grow.
+
+For each session size (in turns) it reports:
+  build    - embedding and indexing every past turn from scratch (first request after a
+             restart or index eviction)
+  update   - indexing one new turn into an existing index (a normal request)
+  query    - embedding the new message and selecting the top-k turns
+  messages - messages sent with retrieval vs. the full history
+
+Usage:
+    python benchmarks/retrieval_benchmark.py [--embedder sentence-transformers/all-MiniLM-L6-v2] [--repeat 20]
+    python benchmarks/retrieval_benchmark.py --embedder hashing   # no model download
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import retrieval_memory
+from config import Config
+from retrieval_memory import RetrievalMemory, SessionVectorIndex
+
+SESSION_TURNS = [10, 50, 100, 250, 500]
+TOPICS = ['database migration', 'holiday in Lisbon', 'python packaging', 'sourdough bread',
+          'quarterly budget', 'guitar practice', 'kubernetes upgrade', 'marathon training']
+
+def build_history(turns: int):
+    history = []
+    for i in range(turns):
+        topic = TOPICS[i % len(TOPICS)]
+        history.append({'role': 'user', 'content': [{'type': 'text', 'text': f'Question {i} about {topic}: ' + 'what should I consider next? ' * 8}]})
+        history.append({'role': 'assistant', 'content': f'Answer {i} on {topic}. ' + 'Here are the details worth keeping in mind. ' * 20})
+    return history
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--embedder', default=Config.RETRIEVAL_EMBEDDING_MODEL)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--top-k', type=int, default=Config.RETRIEVAL_TOP_K)
+    args = parser.parse_args()
+
+    embedder = retrieval_memory.create_embedder(args.embedder)
+    if embedder is None:
+        print(f"transformers/torch not installed; falling back to the hashing embedder instead of {args.embedder}.")
+        embedder = retrieval_memory.HashingEmbedder()
+    embedder.embed(['warm up'])  # Load the model outside the timings
+
+    memory = RetrievalMemory(embedder, top_k=args.top_k, recent_messages=Config.RETRIEVAL_RECENT_MESSAGES)
+    print(f"retrieval memory, embedder={embedder.name}, top_k={args.top_k}, recent={memory.recent_messages} messages")
+    print(f"{'turns':>6} {'build ms':>10} {'update ms':>10} {'query ms':>9} {'messages sent':>14}")
+    for turns in SESSION_TURNS:
+        history = build_history(turns)
+        indexed_end = len(history) - 2
+
+        started = time.perf_counter()
+        index = SessionVectorIndex(generation=0)
+        index.update(history, indexed_end, embedder)
+        build = time.perf_counter() - started
+
+        update = 0.0
+        for _ in range(args.repeat):
+            fresh = SessionVectorIndex(generation=0)
+            fresh.turns, fresh.vectors = list(index.turns[:-1]), index.vectors[:-1]
+            started = time.perf_counter()
+            fresh.update(history, indexed_end, embedder)
+            update += time.perf_counter() - started
+
+        query = 0.0
+        for i in range(args.repeat):
+            started = time.perf_counter()
+            index.query(embedder.embed([f'What did we decide about {TOPICS[i % len(TOPICS)]}?'])[0], args.top_k)
+            query += time.perf_counter() - started
+
+        sent = memory.select_history(f'bench-{turns}', 0, history, 'What did we decide about sourdough bread?')
+        print(f"{turns:>6} {build * 1000:>10.2f} {update / args.repeat * 1000:>10.2f} {query / args.repeat * 1000:>9.2f} "
+              f"{len(sent):>6} / {len(history):<6}")
+
+if __name__ == '__main__':
+    main()
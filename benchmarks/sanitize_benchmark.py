@@ -0,0 +1,89 @@
+"""
+Microbenchmark for context_sanitizer.sanitize_history.
+
+Measures the cost of sanitizing one chat turn (stored history + the new user message) as
+the conversation grows: with the checkpoint cache disabled, with the cache on and history
+messages reused between turns (the in-memory session store), and with the cache on but the
+history re-read every turn, so every message is a new object and the checkpoint cannot match.
+The app avoids that last case by not caching SQLite or client-sent histories at all (see
+app.sanitize_cache_key).
+
+Usage:
+    python benchmarks/sanitize_benchmark.py [--provider openai] [--repeat 200]
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import context_sanitizer
+from context_sanitizer import SanitizationCache
+
+HISTORY_LENGTHS = [10, 50, 100, 200, 400]
+
+def build_history(length: int):
+    """A conversation of `length` messages with some tool sequences mixed in."""
+    history = []
+    i = 0
+    while len(history) < length:
+        if i % 10 == 9:
+            history.append({'role': 'assistant', 'content': [
+                {'type': 'text', 'text': 'Let me look that up.'},
+                {'type': 'tool_use', 'id': f'call_{i}', 'name': 'search', 'input': {'query': f'topic {i}'}},
+            ]})
+            history.append({'role': 'user', 'content': [
+                {'type': 'tool_result', 'tool_use_id': f'call_{i}', 'tool_name': 'search', 'content': 'result ' * 50},
+            ]})
+        else:
+            history.append({'role': 'user', 'content': [{'type': 'text', 'text': f'Question {i}: ' + 'lorem ipsum ' * 40}]})
+            history.append({'role': 'assistant', 'content': f'Answer {i}: ' + 'dolor sit amet ' * 100})
+        i += 1
+    return history[:length]
+
+def time_turns(history, provider: str, repeat: int, cache, reload_history: bool) -> float:
+    """Average seconds to sanitize history + one new user message."""
+    total = 0.0
+    serialized = json.dumps(history) if reload_history else None
+    for turn in range(repeat):
+        stored = json.loads(serialized) if reload_history else history
+        new_message = {'role': 'user', 'content': [{'type': 'text', 'text': f'follow-up {turn}'}]}
+        started = time.perf_counter()
+        context_sanitizer.sanitize_history(stored + [new_message], provider, cache, key='session')
+        total += time.perf_counter() - started
+    return total / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--provider', default='openai', choices=sorted(context_sanitizer.VALID_PROVIDERS))
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"sanitize_history per-turn cost, provider={args.provider}, {args.repeat} turns per row")
+    print(f"{'messages':>9} {'uncached ms':>12} {'cached ms':>10} {'reloaded ms':>12} {'speedup':>8}")
+    for length in HISTORY_LENGTHS:
+        history = build_history(length)
+
+        # Cached output must match the uncached reference exactly
+        reference = context_sanitizer.sanitize_history(copy.deepcopy(history), args.provider, None)
+        check_cache = SanitizationCache()
+        for _ in range(2):
+            assert context_sanitizer.sanitize_history(history, args.provider, check_cache, key='session') == reference
+
+        uncached = time_turns(history, args.provider, args.repeat, None, reload_history=False)
+
+        cache = SanitizationCache()
+        context_sanitizer.sanitize_history(history, args.provider, cache, key='session')  # Warm: earlier turns
+        cached = time_turns(history, args.provider, args.repeat, cache, reload_history=False)
+
+        reload_cache = SanitizationCache()
+        context_sanitizer.sanitize_history(history, args.provider, reload_cache, key='session')
+        reloaded = time_turns(history, args.provider, args.repeat, reload_cache, reload_history=True)
+
+        print(f"{length:>9} {uncached * 1000:>12.3f} {cached * 1000:>10.3f} {reloaded * 1000:>12.3f} {uncached / cached:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
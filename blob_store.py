@@ -0,0 +1,193 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, BinaryIO, Dict, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Blob ids are the hex SHA-256 of the content; anything else is rejected before touching the disk
+BLOB_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+def blob_id_for(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def is_blob_id(value: Any) -> bool:
+    return isinstance(value, str) and BLOB_ID_PATTERN.match(value) is not None
+
+class BlobStore(ABC):
+    """
+    Content-addressed storage for uploaded images.
+
+    A blob is stored once under the SHA-256 of its bytes and referenced from conversation
+    history by that id (an image part with source {'type': 'blob', 'blob_id': ...}), so
+    histories, session storage and every later turn carry a 64-character handle instead of
+    the base64 image. The bytes are only read back when a request is encoded for a provider
+    (see message_model). Uploading the same image twice stores it once.
+    """
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        """Store data and return its blob id."""
+        pass
+
+    @abstractmethod
+    def get(self, blob_id: str) -> Optional[bytes]:
+        """The blob's bytes, or None if it is unknown."""
+        pass
+
+    def put_stream(self, stream: BinaryIO) -> str:
+        """Store the rest of a binary file object and return its blob id."""
+        return self.put(stream.read())
+
+    def exists(self, blob_id: str) -> bool:
+        return self.get(blob_id) is not None
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        pass
+
+class _ByteBudgetLRU:
+    """Thread-safe LRU of blob bytes bounded by their total size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, blob_id: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(blob_id)
+            if data is not None:
+                self._entries.move_to_end(blob_id)
+            return data
+
+    def put(self, blob_id: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(blob_id, None)
+            if previous is not None:
+                self.total_bytes -= len(previous)
+            self._entries[blob_id] = data
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+class MemoryBlobStore(BlobStore):
+    """Blobs kept in this process only, least recently used evicted past max_bytes. For development and tests."""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self._blobs = _ByteBudgetLRU(max_bytes)
+
+    def put(self, data: bytes) -> str:
+        blob_id = blob_id_for(data)
+        self._blobs.put(blob_id, bytes(data))
+        return blob_id
+
+    def get(self, blob_id: str) -> Optional[bytes]:
+        if not is_blob_id(blob_id):
+            return None
+        return self._blobs.get(blob_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': 'memory', 'blobs': len(self._blobs), 'bytes': self._blobs.total_bytes}
+
+class FileBlobStore(BlobStore):
+    """
+    Blobs as files under `directory`, sharded by the first two hex digits of their id, with the
+    most recently read ones cached in memory (up to cache_bytes). Writes go to a temporary file
+    that is renamed into place, so concurrent uploads of the same image are safe.
+    """
+
+    def __init__(self, directory: str, cache_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self._cache = _ByteBudgetLRU(cache_bytes)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, blob_id: str) -> str:
+        return os.path.join(self.directory, blob_id[:2], blob_id)
+
+    def put(self, data: bytes) -> str:
+        blob_id = blob_id_for(data)
+        path = self._path(blob_id)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+            try:
+                with os.fdopen(fd, 'wb') as temp_file:
+                    temp_file.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        self._cache.put(blob_id, bytes(data))
+        return blob_id
+
+    def put_stream(self, stream: BinaryIO) -> str:
+        """Copies the stream to disk in chunks while hashing it, so large uploads are never held in memory whole."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.upload-')
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in iter(lambda: stream.read(STREAM_CHUNK_BYTES), b''):
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+            blob_id = digest.hexdigest()
+            path = self._path(blob_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)  # Same content, so replacing an existing blob is harmless
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return blob_id
+
+    def get(self, blob_id: str) -> Optional[bytes]:
+        if not is_blob_id(blob_id):
+            return None
+        data = self._cache.get(blob_id)
+        if data is not None:
+            return data
+        try:
+            with open(self._path(blob_id), 'rb') as blob_file:
+                data = blob_file.read()
+        except FileNotFoundError:
+            return None
+        self._cache.put(blob_id, data)
+        return data
+
+    def exists(self, blob_id: str) -> bool:
+        return is_blob_id(blob_id) and (self._cache.get(blob_id) is not None or os.path.exists(self._path(blob_id)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': 'file', 'directory': self.directory, 'cached_blobs': len(self._cache), 'cached_bytes': self._cache.total_bytes}
+
+def create_blob_store() -> BlobStore:
+    """Build the blob store selected by Config.BLOB_STORE_BACKEND ('file' or 'memory')."""
+    backend = Config.BLOB_STORE_BACKEND.lower()
+    if backend == 'file':
+        logger.info(f"Using file blob store at {Config.BLOB_STORE_DIR}")
+        return FileBlobStore(Config.BLOB_STORE_DIR, cache_bytes=Config.BLOB_CACHE_MAX_BYTES)
+    if backend != 'memory':
+        raise ValueError(f"Unknown BLOB_STORE_BACKEND '{Config.BLOB_STORE_BACKEND}'. Expected 'file' or 'memory'.")
+    return MemoryBlobStore(max_bytes=Config.BLOB_CACHE_MAX_BYTES)
+
+# Shared by the web app, the ASGI app and the provider encoders in this process
+blob_store = create_blob_store()
@@ -4,11 +4,13 @@ from rich.markdown import Markdown
 from rich.live import Live
 from rich.spinner import Spinner
 from rich.panel import Panel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+import asyncio
 import json
 import sys
 import logging
 import context_sanitizer  # Add this import at the top
+import context_window
 
 from config import Config
 # Remove tool-related imports
@@ -35,6 +37,25 @@ MODE_PROMPTS = {
   "image": "You are in Image mode. Describe the visual scene clearly, suitable for generating an illustration."
 }
 
+def response_text(response: Dict[str, Any]) -> str:
+    """Text of a provider response whose content is a string or a list of content parts."""
+    # Extract response content
+    if isinstance(response.get('content'), list):
+        # Handle structured response
+        text_parts = []
+        for part in response['content']:
+            if isinstance(part, dict):
+                if part.get('type') == 'text':
+                    text_parts.append(part.get('text', ''))
+                else:
+                    text_parts.append(str(part))
+            else:
+                text_parts.append(str(part))
+        return '\n'.join(text_parts)
+    else:
+        return str(response.get('content', ''))
+
+
 class Assistant:
     """
     The Assistant class manages:
@@ -65,6 +86,9 @@ class Assistant:
 
         # Display current call token usage
         self.console.print(f"[cyan]Tokens this call:[/cyan] {total_tokens_this_call} (in: {input_tokens}, out: {output_tokens})")
+        cache_read_tokens = usage_this_call.get('cache_read_tokens', 0)
+        if cache_read_tokens:
+            self.console.print(f"[cyan]Prompt cache:[/cyan] {cache_read_tokens} of {input_tokens} input tokens read from cache")
         
         # Display cumulative usage
         self.console.print(f"[cyan]Total tokens:[/cyan] {cumulative_total_tokens}")
@@ -74,143 +98,246 @@ class Assistant:
         percentage = (cumulative_total_tokens / max_tokens) * 100
         self.console.print(f"[cyan]Usage:[/cyan] {percentage:.1f}% of {max_tokens:,}")
 
+    def _handle_command(self, user_input: Any, provider: BaseProvider, conversation_history: list, total_tokens_used: int) -> Optional[Dict[str, Any]]:
+        """Return a complete result for special commands ('/reset', '/quit'), or None for normal input."""
+        if isinstance(user_input, str):
+            if user_input.lower() == '/reset':
+                return {
+                    'assistant_response': 'Conversation history cleared.',
+                    'new_messages': [],
+                    'history_reset': True,
+                    'total_tokens': 0,
+                    'provider_used': provider.name,
+                    'model_used': 'unknown',
+                    'usage': {'input_tokens': 0, 'output_tokens': 0, 'runtime': 0}
+                }
+            elif user_input.lower() == '/quit':
+                return {
+                    'assistant_response': 'Goodbye!',
+                    'new_messages': [],
+                    'total_tokens': total_tokens_used,
+                    'provider_used': provider.name,
+                    'model_used': 'unknown',
+                    'usage': {'input_tokens': 0, 'output_tokens': 0, 'runtime': 0}
+                }
+        return None
+
+    def _prepare_turn(self, user_input: Any, provider: BaseProvider, conversation_history: list, mode: str,
+                      history_key: Optional[str] = None) -> Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Build the user message for this turn and the provider-ready message list.
+
+        Returns:
+            (user_message, messages, window_report) where user_message is the message this turn
+            adds to the history, messages is the sanitized list (system prompt first) fitted to the
+            model's input token budget, and window_report describes what was trimmed to fit
+            (see context_window.fit_messages).
+        """
+        # Process user input
+        if isinstance(user_input, (dict, list)):
+            # Handle structured input (e.g., an image part plus a text part from app.build_message_content)
+            processed_input = user_input
+        else:
+            # Simple text input
+            processed_input = {"type": "text", "text": str(user_input)}
+
+        # Add mode prompt if specified
+        mode_prompt = MODE_PROMPTS.get(mode, "")
+        if mode_prompt and mode != "normal":
+            if isinstance(processed_input, dict) and processed_input.get("type") == "text":
+                processed_input["text"] = f"{mode_prompt}\n\n{processed_input['text']}"
+            elif isinstance(processed_input, list):
+                processed_input = [{"type": "text", "text": mode_prompt}] + processed_input
+
+        # Create user message
+        user_message = {
+            "role": "user", 
+            "content": [processed_input] if isinstance(processed_input, dict) else processed_input
+        }
+
+        # Sanitize history plus the new message for the target provider.
+        # The stored history itself is never copied or modified here.
+        sanitized_history = context_sanitizer.sanitize_history(conversation_history + [user_message], provider.name, key=history_key)
+
+        # Get system prompt
+        system_prompt = self.system_prompts.get_system_prompt(mode)
+        
+        # Prepare messages with system prompt
+        messages = [{"role": "system", "content": system_prompt}] + sanitized_history
+
+        # Fit to the model's input budget: keeps the system prompt and latest turns, drops the oldest
+        model = context_window.resolve_model(provider)
+        messages, window_report = context_window.fit_messages(messages, provider.name, model)
+        # Reject requests that cannot fit the model before paying for the call
+        context_window.ensure_fits_model(window_report, provider.name, model)
+        return user_message, messages, window_report
+
+    def _build_result(self, response: Dict[str, Any], provider: BaseProvider, user_message: Dict[str, Any], total_tokens_used: int, window_report: Dict[str, Any]) -> Dict[str, Any]:
+        """Turn a provider response into the result dictionary returned by chat() and stream_chat()."""
+        assistant_response = response_text(response)
+
+        # Add assistant response to history
+        assistant_message = {
+            "role": "assistant",
+            "content": assistant_response
+        }
+
+        # Update token usage
+        usage_this_call = response.get('usage', {})
+        input_tokens = usage_this_call.get('input_tokens', 0)
+        output_tokens = usage_this_call.get('output_tokens', 0)
+        tokens_this_call = input_tokens + output_tokens
+        updated_total_tokens = total_tokens_used + tokens_this_call
+
+        # Display token usage if enabled
+        self._display_token_usage(usage_this_call, updated_total_tokens)
+
+        return {
+            'assistant_response': assistant_response,
+            'new_messages': [user_message, assistant_message],
+            'total_tokens': updated_total_tokens,
+            'provider_used': provider.name,
+            'model_used': response.get('model_used', 'unknown'),
+            'usage': usage_this_call,
+            'context_window': window_report
+        }
+
+    def _error_result(self, error: Exception, provider: BaseProvider, conversation_history: list, total_tokens_used: int) -> Dict[str, Any]:
+        return {
+            'assistant_response': f'Error: {str(error)}',
+            'error': str(error), # Set only on failed turns, so callers can tell them from replies
+            'new_messages': [],
+            'total_tokens': total_tokens_used,
+            'provider_used': provider.name if provider else 'unknown',
+            'model_used': 'unknown',
+            'usage': {'input_tokens': 0, 'output_tokens': 0, 'runtime': 0}
+        }
+
     def chat(self, 
              user_input: any, 
              provider: BaseProvider, 
              conversation_history: list, 
              total_tokens_used: int, 
              mode: str, 
-             request_id: str # Added for consistent logging
+             request_id: str, # Added for consistent logging
+             history_key: Optional[str] = None
             ) -> Dict[str, Any]:
         """
         Process a chat interaction with the given provider.
         
         Args:
-            user_input: The user's input (string or dict with text/image)
+            user_input: The user's input (string, a content part dict, or a list of parts with text/image)
             provider: The AI provider instance to use
             conversation_history: List of previous messages
             total_tokens_used: Running total of tokens used
             mode: The conversation mode
             request_id: Unique identifier for this request
+            history_key: Set when conversation_history comes from the session store and reuses its
+                message objects (the session ID); the sanitized history is then cached between turns
             
         Returns:
             Dict containing:
                 - assistant_response: The AI's response text
-                - updated_history: Updated conversation history
+                - new_messages: Messages this turn adds to the history (append these to the
+                  stored history; the history passed in is never modified)
+                - history_reset: Present and True if the stored history should be cleared instead
                 - total_tokens: Updated token count
                 - provider_used: Name of the provider used
                 - model_used: Name of the specific model used
                 - usage: Detailed usage information
+                - context_window: What was trimmed to fit the input token budget
         """
         try:
             # Handle special commands
-            if isinstance(user_input, str):
-                if user_input.lower() == '/reset':
-                    return {
-                        'assistant_response': 'Conversation history cleared.',
-                        'updated_history': [],
-                        'total_tokens': 0,
-                        'provider_used': provider.name,
-                        'model_used': 'unknown',
-                        'usage': {'input_tokens': 0, 'output_tokens': 0, 'runtime': 0}
-                    }
-                elif user_input.lower() == '/quit':
-                    return {
-                        'assistant_response': 'Goodbye!',
-                        'updated_history': conversation_history,
-                        'total_tokens': total_tokens_used,
-                        'provider_used': provider.name,
-                        'model_used': 'unknown',
-                        'usage': {'input_tokens': 0, 'output_tokens': 0, 'runtime': 0}
-                    }
-
-            # Process user input
-            if isinstance(user_input, dict):
-                # Handle structured input (e.g., with images)
-                processed_input = user_input
-            else:
-                # Simple text input
-                processed_input = {"type": "text", "text": str(user_input)}
+            command_result = self._handle_command(user_input, provider, conversation_history, total_tokens_used)
+            if command_result is not None:
+                return command_result
 
-            # Add mode prompt if specified
-            mode_prompt = MODE_PROMPTS.get(mode, "")
-            if mode_prompt and mode != "normal":
-                if isinstance(processed_input, dict) and processed_input.get("type") == "text":
-                    processed_input["text"] = f"{mode_prompt}\n\n{processed_input['text']}"
+            user_message, messages, window_report = self._prepare_turn(user_input, provider, conversation_history, mode, history_key)
 
-            # Create user message
-            user_message = {
-                "role": "user", 
-                "content": [processed_input] if isinstance(processed_input, dict) else processed_input
-            }
+            # Make API call to provider (no tools passed)
+            response = provider.chat(messages, [], Config)
 
-            # Add to conversation history
-            updated_history = conversation_history + [user_message]
+            return self._build_result(response, provider, user_message, total_tokens_used, window_report)
 
-            # Sanitize history for the target provider
-            sanitized_history = context_sanitizer.sanitize_history(updated_history, provider.name)
+        except Exception as e:
+            logging.exception(f"Error in chat method for request {request_id}")
+            return self._error_result(e, provider, conversation_history, total_tokens_used)
 
-            # Get system prompt
-            system_prompt = self.system_prompts.get_system_prompt(mode)
-            
-            # Prepare messages with system prompt
-            messages = [{"role": "system", "content": system_prompt}] + sanitized_history
+    async def achat(self, 
+                    user_input: Any, 
+                    provider: BaseProvider, 
+                    conversation_history: list, 
+                    total_tokens_used: int, 
+                    mode: str, 
+                    request_id: str,
+                    history_key: Optional[str] = None
+                   ) -> Dict[str, Any]:
+        """
+        Async variant of chat() used by the ASGI app (asgi_app.py).
+        Awaits provider.achat() instead of blocking a thread; returns the same dictionary as chat().
+        """
+        try:
+            command_result = self._handle_command(user_input, provider, conversation_history, total_tokens_used)
+            if command_result is not None:
+                return command_result
 
-            # Make API call to provider (no tools passed)
-            response = provider.chat(messages, [], Config)
+            # Sanitizing, trimming and token counting are CPU-bound; keep them off the event loop
+            user_message, messages, window_report = await asyncio.to_thread(
+                self._prepare_turn, user_input, provider, conversation_history, mode, history_key)
 
-            # Extract response content
-            if isinstance(response.get('content'), list):
-                # Handle structured response
-                text_parts = []
-                for part in response['content']:
-                    if isinstance(part, dict):
-                        if part.get('type') == 'text':
-                            text_parts.append(part.get('text', ''))
-                        else:
-                            text_parts.append(str(part))
-                    else:
-                        text_parts.append(str(part))
-                assistant_response = '\n'.join(text_parts)
-            else:
-                assistant_response = str(response.get('content', ''))
-
-            # Add assistant response to history
-            assistant_message = {
-                "role": "assistant",
-                "content": assistant_response
-            }
-            final_history = updated_history + [assistant_message]
-
-            # Update token usage
-            usage_this_call = response.get('usage', {})
-            input_tokens = usage_this_call.get('input_tokens', 0)
-            output_tokens = usage_this_call.get('output_tokens', 0)
-            tokens_this_call = input_tokens + output_tokens
-            updated_total_tokens = total_tokens_used + tokens_this_call
-
-            # Display token usage if enabled
-            self._display_token_usage(usage_this_call, updated_total_tokens)
-
-            return {
-                'assistant_response': assistant_response,
-                'updated_history': final_history,
-                'total_tokens': updated_total_tokens,
-                'provider_used': provider.name,
-                'model_used': response.get('model_used', 'unknown'),
-                'usage': usage_this_call
-            }
+            response = await provider.achat(messages, [], Config)
+
+            return self._build_result(response, provider, user_message, total_tokens_used, window_report)
 
         except Exception as e:
-            logging.exception(f"Error in chat method for request {request_id}")
-            return {
-                'assistant_response': f'Error: {str(e)}',
-                'updated_history': conversation_history,
-                'total_tokens': total_tokens_used,
-                'provider_used': provider.name if provider else 'unknown',
-                'model_used': 'unknown',
-                'usage': {'input_tokens': 0, 'output_tokens': 0, 'runtime': 0}
-            }
+            logging.exception(f"Error in achat method for request {request_id}")
+            return self._error_result(e, provider, conversation_history, total_tokens_used)
+
+    def stream_chat(self, 
+                    user_input: Any, 
+                    provider: BaseProvider, 
+                    conversation_history: list, 
+                    total_tokens_used: int, 
+                    mode: str, 
+                    request_id: str,
+                    history_key: Optional[str] = None
+                   ) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of chat().
+
+        Yields {'type': 'text_delta', 'text': <str>} events as the provider generates text,
+        then exactly one {'type': 'final', 'result': <dict>} event whose 'result' has the
+        same structure as the return value of chat() (including new_messages and usage).
+        If the provider fails, possibly after some deltas were sent, the final result is an
+        error result whose 'error' key holds the message.
+        """
+        try:
+            command_result = self._handle_command(user_input, provider, conversation_history, total_tokens_used)
+            if command_result is not None:
+                yield {'type': 'text_delta', 'text': command_result['assistant_response']}
+                yield {'type': 'final', 'result': command_result}
+                return
+
+            user_message, messages, window_report = self._prepare_turn(user_input, provider, conversation_history, mode, history_key)
+
+            response = None
+            for event in provider.stream_chat(messages, [], Config):
+                if event.get('type') == 'text_delta':
+                    yield event
+                elif event.get('type') == 'final':
+                    response = event['response']
+
+            if response is None:
+                raise RuntimeError(f"Provider '{provider.name}' stream ended without a final response.")
+
+            result = self._build_result(response, provider, user_message, total_tokens_used, window_report)
+
+        except Exception as e:
+            logging.exception(f"Error in stream_chat method for request {request_id}")
+            result = self._error_result(e, provider, conversation_history, total_tokens_used)
+
+        yield {'type': 'final', 'result': result}
 
     def reset(self):
         """
@@ -0,0 +1,295 @@
+"""
+Chat request handling shared by the Flask app (app.py) and the ASGI app (asgi_app.py): provider
+routing, API key selection, image inputs, session saving and response payloads. Importing it has
+no side effects beyond creating the Assistant and the session store, so either app can use it
+without loading the other.
+"""
+import base64
+import binascii
+import json
+import logging
+
+from ce3 import Assistant
+from config import Config
+from providers.provider_factory import ProviderFactory
+from session_store import create_session_store
+from conversation_summarizer import summarizer, build_history_with_summary
+from retrieval_memory import retrieval_memory
+from blob_store import blob_store
+from image_preprocessing import sniff_media_type, store_upload, store_upload_stream
+from neuroswitch_classifier import get_neuroswitch_provider, apply_session_affinity
+
+# Assistant is instantiated once, its methods will operate on passed-in history & tokens
+assistant = Assistant()
+
+# Define the static list of providers + NeuroSwitch
+# Define the constant here, where it's used
+NEUROSWITCH_PROVIDER_NAME = "NeuroSwitch"
+ALL_PROVIDERS_WITH_NEUROSWITCH = [NEUROSWITCH_PROVIDER_NAME] + list(ProviderFactory._providers.keys())
+
+# --- Provider Aliases and Normalization ---
+# Direct provider names (lowercase) that the factory supports
+DIRECT_PROVIDER_KEYS = {key.lower() for key in ProviderFactory._providers.keys()}
+
+# Aliases that map to a direct provider (e.g., common model names or shorthand)
+# This can be expanded as needed.
+DIRECT_PROVIDER_ALIASES = {
+    "gpt-4": "openai",
+    "gpt-3.5-turbo": "openai",
+    "gpt-4-turbo": "openai",
+    "gpt-4o": "openai",
+    "claude-3-opus": "claude",
+    "claude-3-sonnet": "claude",
+    "claude-3-haiku": "claude",
+    "gemini-1.5-pro": "gemini",
+    "gemini-1.0-pro": "gemini",
+    # Add other common model name aliases here
+}
+
+# Aliases that explicitly mean to use the NeuroSwitch router
+NEUROSWITCH_ROUTER_ALIASES = {
+    "neuroswitch", # Canonical name
+    "auto",
+    "router",
+    "smart",
+    "intelligentrouter"
+}
+# --- End Provider Aliases ---
+
+# Server-side storage for session data (see session_store.py), shared by API clients and browsers
+# Key: Client-provided session ID (from X-Session-ID or Authorization header), or the opaque
+#      'neuroswitch_flask_session_id' kept in a browser's cookie
+# Value: {'conversation_history': [], 'total_tokens_used': 0}
+api_client_session_store = create_session_store()
+
+def save_session_data(identifier: str, result_data: dict, client_provided_history: list = None, expected_version: int = None):
+    """
+    Records a finished chat turn for the given identifier.
+
+    Normally only the turn's new messages are appended to the stored history. If the client
+    supplied its own history for this request, that history (plus the new messages) replaces
+    the stored one, and a '/reset' command clears it.
+
+    expected_version is the session version read at the start of the request; if another
+    request on the same session saved a turn in the meantime, SessionConflictError is raised
+    and nothing is written.
+
+    Once saved, long histories are queued for background summarization (see conversation_summarizer.py).
+    """
+    if result_data.get('history_reset'):
+        api_client_session_store.reset(identifier)
+        return
+    # Remembered for NeuroSwitch session affinity; only turns that produced messages count
+    provider = result_data.get('provider_used') if result_data['new_messages'] else None
+    if client_provided_history is not None:
+        api_client_session_store.save(identifier, list(client_provided_history) + result_data['new_messages'], result_data['total_tokens'], expected_version, provider)
+    else:
+        api_client_session_store.append(identifier, result_data['new_messages'], result_data['total_tokens'], expected_version, provider)
+    if not Config.RETRIEVAL_MEMORY_ENABLED:
+        summarizer.maybe_schedule(identifier, api_client_session_store)
+
+def select_server_history(identifier: str, session_data: dict, query_text: str) -> list:
+    """
+    The history to send for a turn that uses the server-side store: with retrieval memory on,
+    the past turns most relevant to query_text plus the recent window; otherwise turns already
+    folded into the session's rolling summary are sent as that summary.
+    """
+    history = session_data['conversation_history']
+    if Config.RETRIEVAL_MEMORY_ENABLED:
+        selected = retrieval_memory.select_history(identifier, session_data['generation'], history, query_text)
+        if selected is not None:
+            return selected
+    return build_history_with_summary(history, session_data['summary'])
+
+def sanitize_cache_key(identifier: str, client_provided_history) -> str | None:
+    """
+    Key under which the sanitized history is cached between turns (see
+    context_sanitizer.SanitizationCache), or None when reuse is impossible: histories sent by
+    the client, or re-read from SQLite, are new message objects every turn.
+    """
+    if client_provided_history is not None or not api_client_session_store.shares_message_objects:
+        return None
+    return identifier
+
+def build_chat_response_payload(result_data: dict, provider_fallback: str, neuroswitch_active: bool, fallback_reason, affinity_override: bool = False) -> dict:
+    """
+    Builds the /chat JSON body (also the final SSE 'done' event) from an Assistant result.
+    affinity_override is True when NeuroSwitch kept the session's provider instead of the classifier's pick.
+    """
+    usage_from_assistant = result_data.get('usage', {})
+    token_usage_response = {
+        'input_tokens': usage_from_assistant.get('input_tokens', 0),
+        'output_tokens': usage_from_assistant.get('output_tokens', 0),
+        # Prompt-cache hits (tokens included in input_tokens); cache writes are reported by Claude only
+        'cache_read_tokens': usage_from_assistant.get('cache_read_tokens', 0),
+        'cache_write_tokens': usage_from_assistant.get('cache_write_tokens', 0),
+        'runtime': usage_from_assistant.get('runtime', 0.0),
+        'total_tokens': result_data['total_tokens'],
+        'max_tokens': Config.MAX_CONVERSATION_TOKENS,
+    }
+    return {
+        'response': result_data.get('assistant_response', "[No response text received]"),
+        'provider_used': result_data.get('provider_used', provider_fallback),
+        'model_used': result_data.get('model_used', 'unknown'),
+        'neuroswitch_active': neuroswitch_active, 
+        'fallback_reason': fallback_reason,
+        'affinity_override': affinity_override,
+        'token_usage': token_usage_response,
+        'context_window': result_data.get('context_window')
+    }
+
+def build_session_conflict_payload(result_data: dict, provider_fallback: str, neuroswitch_active: bool, fallback_reason, affinity_override: bool = False) -> dict:
+    """Builds the 409 /chat body for a turn that was generated but not saved because the session changed meanwhile."""
+    payload = build_chat_response_payload(result_data, provider_fallback, neuroswitch_active, fallback_reason, affinity_override)
+    payload['error'] = 'session_conflict'
+    payload['discarded_response'] = payload['response']
+    payload['response'] = ("Error: This conversation was updated by another request while this reply was being generated, "
+                           "so the reply was not saved. Please send your message again.")
+    return payload
+
+def resolve_provider_choice(requested_provider, req_id: str, source_label: str) -> tuple[str, bool]:
+    """
+    Normalizes a requested provider (from the API payload or the browser session) into
+    (provider name or NEUROSWITCH_PROVIDER_NAME, is_direct_provider_request).
+    Unrecognized or missing values fall back to the NeuroSwitch router.
+    """
+    normalized = str(requested_provider).lower() if requested_provider else None
+    if not normalized:
+        logging.warning(f"Chat ID: {req_id}. {source_label} missing. Defaulting to NeuroSwitch router.")
+        return NEUROSWITCH_PROVIDER_NAME, False
+    if normalized in DIRECT_PROVIDER_KEYS:
+        return normalized, True
+    if DIRECT_PROVIDER_ALIASES.get(normalized) in DIRECT_PROVIDER_KEYS:
+        logging.info(f"Chat ID: {req_id}. {source_label} '{requested_provider}' mapped to direct provider '{DIRECT_PROVIDER_ALIASES[normalized]}' via alias.")
+        return DIRECT_PROVIDER_ALIASES[normalized], True
+    if normalized in NEUROSWITCH_ROUTER_ALIASES:
+        return NEUROSWITCH_PROVIDER_NAME, False
+    logging.warning(f"Chat ID: {req_id}. {source_label} '{requested_provider}' not recognized. Defaulting to NeuroSwitch router.")
+    return NEUROSWITCH_PROVIDER_NAME, False
+
+def resolve_image_input(data: dict) -> tuple:
+    """
+    The (blob_id, media_type) of the image attached to a /chat request, or None.
+    Accepts 'image_id' (a handle returned by /upload) or, for older API clients, base64
+    'image_data', which is stored in the blob store here so the history only keeps the handle.
+    The media type is always sniffed from the image bytes; a client-supplied one is ignored.
+    Raises ValueError for unknown handles or data that is not a supported image.
+    """
+    image_id = data.get('image_id')
+    if image_id:
+        image_bytes = blob_store.get(image_id)
+        if image_bytes is None:
+            raise ValueError(f"Unknown image_id '{image_id}'. Upload the image with /upload first.")
+        media_type = sniff_media_type(image_bytes)
+        if media_type is None:
+            raise ValueError(f"image_id '{image_id}' is not a PNG, JPEG, GIF or WebP image.")
+        return image_id, media_type
+
+    image_data = data.get('image_data')
+    if not image_data:
+        return None
+    if ',' in image_data:  # Data URL; its declared type is not trusted
+        image_data = image_data.split(',', 1)[1]
+    try:
+        image_bytes = base64.b64decode(image_data, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("image_data is not valid base64.")
+    return store_upload(image_bytes)
+
+def chat_data_from_form(form, files) -> tuple:
+    """
+    The /chat parameters and attached image, as (data, image), from a multipart/form-data request.
+    Fields are the same as in the JSON body, sent as form fields; 'history' is JSON-encoded, as a
+    field or, past the 500 KB form field limit, as a file part, and 'stream' is "true" or "false".
+    The image is a raw binary file part named 'image', which Werkzeug spools to a temporary file and
+    store_upload_stream copies to the blob store, so it is never base64-encoded on the way in.
+    Without one, 'image_id' works as in JSON requests. Raises ValueError for bad history or images.
+    """
+    data = form.to_dict()
+    history_file = files.get('history')
+    if history_file is not None:
+        data['history'] = history_file.read().decode('utf-8')
+    if 'history' in data:
+        try:
+            data['history'] = json.loads(data['history'])
+        except json.JSONDecodeError:
+            raise ValueError("'history' must be a JSON-encoded list of messages.")
+    if 'stream' in data:
+        data['stream'] = data['stream'].strip().lower() == 'true'
+
+    image_file = files.get('image')
+    if image_file is not None and image_file.filename != '':
+        image = store_upload_stream(image_file.stream)
+        data['image_id'] = image[0]
+        return data, image
+    return data, resolve_image_input(data)
+
+def build_message_content(message: str, image) -> tuple:
+    """
+    Builds the user message content for Assistant.chat and the text used for NeuroSwitch classification.
+    `image` is the (blob_id, media_type) from resolve_image_input, or None.
+    """
+    message = message or ""
+    if image:
+        blob_id, media_type = image
+        message_content = [
+            {
+                "type": "image",
+                "source": {
+                    "type": "blob", # Resolved to the provider's image format only when sent (see message_model)
+                    "media_type": media_type,
+                    "blob_id": blob_id
+                }
+            }
+        ]
+        if message.strip():
+            text_part = {"type": "text", "text": message}
+            message_content.append(text_part)
+            text_input_for_classification = message
+        else:
+             text_input_for_classification = "Image uploaded"
+    else:
+        message_content = message
+        text_input_for_classification = message
+    return message_content, text_input_for_classification
+
+def route_provider(provider_for_routing: str, is_direct_provider_request: bool, text_input_for_classification: str, req_id: str,
+                   session_provider: str = None, history_length: int = 0) -> tuple:
+    """
+    Runs the NeuroSwitch classifier when the request asked for the router, keeping the session on
+    session_provider (the provider of its previous turn) unless the classifier's pick wins clearly.
+    Returns (provider name to instantiate, neuroswitch_active, fallback_reason, affinity_override).
+    """
+    # Classifier runs if it was NOT a direct request AND the chosen path was NeuroSwitch
+    if not is_direct_provider_request and provider_for_routing == NEUROSWITCH_PROVIDER_NAME:
+        logging.info(f"NeuroSwitch classifier activated for ID: {req_id}. Classifying input: '{text_input_for_classification[:100]}...' ")
+        neuroswitch_status = get_neuroswitch_provider(text_input_for_classification)
+        logging.info(f"NeuroSwitch classifier for ID: {req_id} result: Provider='{neuroswitch_status['provider']}', Classifier Active Flag={neuroswitch_status['neuroswitch_active']}, Reason='{neuroswitch_status['fallback_reason']}'")
+        neuroswitch_status = apply_session_affinity(neuroswitch_status, session_provider, history_length)
+        return neuroswitch_status["provider"], neuroswitch_status["neuroswitch_active"], neuroswitch_status["fallback_reason"], neuroswitch_status["affinity_override"]
+    if is_direct_provider_request:
+        logging.info(f"Chat ID: {req_id}. Using DIRECTLY specified provider: {provider_for_routing}. NeuroSwitch classifier bypassed.")
+    else:
+        logging.error(f"Chat ID: {req_id}. Unexpected provider routing state. Provider for routing was '{provider_for_routing}' but not NeuroSwitch, and not flagged as a direct request. Attempting to use it directly. NeuroSwitch classifier bypassed.")
+    return provider_for_routing, False, None, False
+
+# Per-provider (request header carrying a user key, Config attribute with the server key)
+PROVIDER_API_KEY_SOURCES = {
+    "openai": ("X-OpenAI-API-Key", "OPENAI_API_KEY"),
+    "claude": ("X-Claude-API-Key", "ANTHROPIC_API_KEY"),
+    "gemini": ("X-Gemini-API-Key", "GEMINI_API_KEY"),
+}
+
+def select_api_key(provider_name: str, headers) -> tuple:
+    """
+    Picks the API key for a provider: the user's X-*-API-Key header if present, else the .env key.
+    Returns (api_key, source description), or (None, None) if the provider is unknown.
+    """
+    sources = PROVIDER_API_KEY_SOURCES.get(provider_name)
+    if not sources:
+        return None, None
+    header_name, config_attr = sources
+    user_key = headers.get(header_name)
+    if user_key:
+        return user_key, f"{header_name} header"
+    return getattr(Config, config_attr), f".env ({config_attr})"
@@ -16,6 +16,98 @@ class Config:
 
     MAX_TOKENS = 8000
     MAX_CONVERSATION_TOKENS = 200000  # Maximum tokens per conversation
+    # Cap on input tokens sent per request; older turns are dropped to fit (see context_window.py). 0 = model window only
+    CONTEXT_MAX_INPUT_TOKENS = int(os.getenv('CONTEXT_MAX_INPUT_TOKENS', 100000))
+    # Older turns are dropped in steps of this many messages, keeping the prompt prefix cacheable across turns
+    CONTEXT_TRIM_STEP = int(os.getenv('CONTEXT_TRIM_STEP', 16))
+
+    # Provider prompt caching (Claude cache breakpoints, Gemini cached contents; OpenAI caches automatically)
+    PROMPT_CACHE_ENABLED = os.getenv('PROMPT_CACHE_ENABLED', 'true').lower() == 'true'
+    GEMINI_CACHE_MIN_TOKENS = int(os.getenv('GEMINI_CACHE_MIN_TOKENS', 32768))  # Smallest history prefix worth a cached content
+    GEMINI_CACHE_TTL_SECONDS = int(os.getenv('GEMINI_CACHE_TTL_SECONDS', 600))
+
+    # Provider client pool (reuses SDK clients and their HTTP connections across requests)
+    PROVIDER_POOL_MAX_SIZE = int(os.getenv('PROVIDER_POOL_MAX_SIZE', 64))
+    PROVIDER_POOL_IDLE_SECONDS = float(os.getenv('PROVIDER_POOL_IDLE_SECONDS', 900))
+
+    # Server-side session store (see session_store.py)
+    # 'memory' keeps sessions in this process; 'sqlite' shares them across worker processes on one host
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')
+    SESSION_SQLITE_PATH = os.getenv('SESSION_SQLITE_PATH', str(Path(__file__).parent / 'data' / 'sessions.db'))
+    SESSION_MAX_SESSIONS = int(os.getenv('SESSION_MAX_SESSIONS', 10000))
+    SESSION_IDLE_TTL_SECONDS = float(os.getenv('SESSION_IDLE_TTL_SECONDS', 86400))  # 0 disables idle expiry
+    SESSION_MAX_BYTES = int(os.getenv('SESSION_MAX_BYTES', 512 * 1024 * 1024))  # 0 disables the byte budget
+    # Worker processes serving the app (gunicorn reads the same variable). Browser conversations are
+    # stored server-side, so with more than one worker they need SESSION_BACKEND=sqlite
+    SERVER_WORKERS = int(os.getenv('WEB_CONCURRENCY', 1))
+
+    # Uploaded images, stored once by content hash and referenced from history by id (see blob_store.py)
+    BLOB_STORE_BACKEND = os.getenv('BLOB_STORE_BACKEND', 'file')  # 'file' or 'memory'
+    BLOB_STORE_DIR = os.getenv('BLOB_STORE_DIR', str(Path(__file__).parent / 'data' / 'blobs'))
+    BLOB_CACHE_MAX_BYTES = int(os.getenv('BLOB_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # Recently used blobs kept in memory
+
+    # Image preprocessing (see image_preprocessing.py): uploads and outgoing images are downscaled to
+    # what each provider actually uses and re-encoded when that makes them smaller
+    IMAGE_PREPROCESSING_ENABLED = os.getenv('IMAGE_PREPROCESSING_ENABLED', 'true').lower() == 'true'
+    IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', 85))
+    IMAGE_RECOMPRESS_MIN_BYTES = int(os.getenv('IMAGE_RECOMPRESS_MIN_BYTES', 512 * 1024))  # Smaller images that fit are sent as uploaded
+    IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # Images prepared per provider, kept in memory
+
+    # Conversations whose sanitized history is kept for reuse on the next turn (see context_sanitizer.SanitizationCache)
+    SANITIZE_CACHE_MAX_ENTRIES = int(os.getenv('SANITIZE_CACHE_MAX_ENTRIES', 2000))
+    SANITIZE_CACHE_MAX_BYTES = int(os.getenv('SANITIZE_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # Messages and output held by checkpoints
+    # Per-message token counts kept for reuse across turns (see token_counter.TokenCountCache)
+    TOKEN_COUNT_CACHE_MAX_ENTRIES = int(os.getenv('TOKEN_COUNT_CACHE_MAX_ENTRIES', 50000))
+
+    # Rolling summaries of old turns, written in the background (see conversation_summarizer.py)
+    SUMMARY_ENABLED = os.getenv('SUMMARY_ENABLED', 'true').lower() == 'true'
+    SUMMARY_TRIGGER_MESSAGES = int(os.getenv('SUMMARY_TRIGGER_MESSAGES', 60))  # Unsummarized messages that trigger a summary
+    SUMMARY_KEEP_RECENT_MESSAGES = int(os.getenv('SUMMARY_KEEP_RECENT_MESSAGES', 20))  # Newest messages always sent verbatim
+    SUMMARY_PROVIDER = os.getenv('SUMMARY_PROVIDER')  # Default: cheapest provider with a server API key
+    SUMMARY_MODEL = os.getenv('SUMMARY_MODEL')
+    SUMMARY_WORKERS = int(os.getenv('SUMMARY_WORKERS', 2))
+
+    # Retrieval memory: send the past turns most relevant to the new message plus the recent window
+    # instead of the whole history (see retrieval_memory.py). Takes precedence over rolling summaries.
+    RETRIEVAL_MEMORY_ENABLED = os.getenv('RETRIEVAL_MEMORY_ENABLED', 'false').lower() == 'true'
+    RETRIEVAL_EMBEDDING_MODEL = os.getenv('RETRIEVAL_EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')  # Or 'hashing'
+    RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', 4))  # Past turns retrieved per request
+    RETRIEVAL_RECENT_MESSAGES = int(os.getenv('RETRIEVAL_RECENT_MESSAGES', 12))  # Newest messages always sent
+    RETRIEVAL_MAX_SESSIONS = int(os.getenv('RETRIEVAL_MAX_SESSIONS', 500))  # Session indexes kept in memory
+
+    # NeuroSwitch classifier loading (see neuroswitch_classifier.start_warmup)
+    # 'background' loads the model in a thread at startup, 'lazy' on the first routed request,
+    # 'blocking' at startup before the server binds. Until it is ready, routed requests use the fallback provider.
+    NEUROSWITCH_WARMUP = os.getenv('NEUROSWITCH_WARMUP', 'background')
+    NEUROSWITCH_FALLBACK_PROVIDER = os.getenv('NEUROSWITCH_FALLBACK_PROVIDER', 'claude')
+    NEUROSWITCH_LOAD_WAIT_SECONDS = float(os.getenv('NEUROSWITCH_LOAD_WAIT_SECONDS', 0))  # How long a routed request may wait for a loading model
+
+    # NeuroSwitch classifier engine: 'zero-shot' (BART-large-MNLI, one forward pass per label),
+    # 'embedding' (one encoder pass and a cosine similarity against stored label embeddings, see embedding_router.py)
+    # or 'onnx' (the same BART model quantized to int8 and run by ONNX Runtime, see onnx_classifier.py)
+    NEUROSWITCH_ENGINE = os.getenv('NEUROSWITCH_ENGINE', 'zero-shot')
+    NEUROSWITCH_EMBEDDING_MODEL = os.getenv('NEUROSWITCH_EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')  # Or 'hashing'
+    NEUROSWITCH_EMBEDDING_TEMPERATURE = float(os.getenv('NEUROSWITCH_EMBEDDING_TEMPERATURE', 0.05))  # Softmax temperature over cosine similarities
+    NEUROSWITCH_CACHE_DIR = os.getenv('NEUROSWITCH_CACHE_DIR', str(Path(__file__).parent / 'data' / 'neuroswitch'))  # Label embeddings, ONNX exports
+    NEUROSWITCH_ONNX_INTRA_OP_THREADS = int(os.getenv('NEUROSWITCH_ONNX_INTRA_OP_THREADS', 0))  # 0: ONNX Runtime default (all cores)
+    NEUROSWITCH_ONNX_INTER_OP_THREADS = int(os.getenv('NEUROSWITCH_ONNX_INTER_OP_THREADS', 0))
+    NEUROSWITCH_ONNX_MIN_AGREEMENT = float(os.getenv('NEUROSWITCH_ONNX_MIN_AGREEMENT', 0.9))  # Warn below this top-label agreement with PyTorch
+
+    # NeuroSwitch routing decision cache: repeated prompts (after lowercasing and collapsing whitespace) skip the model
+    NEUROSWITCH_ROUTE_CACHE_MAX_ENTRIES = int(os.getenv('NEUROSWITCH_ROUTE_CACHE_MAX_ENTRIES', 10000))  # 0 disables the cache
+    NEUROSWITCH_ROUTE_CACHE_TTL_SECONDS = float(os.getenv('NEUROSWITCH_ROUTE_CACHE_TTL_SECONDS', 0))  # 0 keeps decisions until evicted
+    NEUROSWITCH_ROUTE_CACHE_KEY_CHARS = int(os.getenv('NEUROSWITCH_ROUTE_CACHE_KEY_CHARS', 2000))  # Longer inputs are keyed by this prefix
+
+    # NeuroSwitch micro-batching: concurrent classifications are collected for up to MAX_WAIT_MS
+    # (or MAX_SIZE texts) and run as one batched forward pass (see micro_batcher.py). MAX_SIZE 1 disables it.
+    NEUROSWITCH_BATCH_MAX_SIZE = int(os.getenv('NEUROSWITCH_BATCH_MAX_SIZE', 8))
+    NEUROSWITCH_BATCH_MAX_WAIT_MS = float(os.getenv('NEUROSWITCH_BATCH_MAX_WAIT_MS', 5))
+    NEUROSWITCH_BATCH_TIMEOUT_SECONDS = float(os.getenv('NEUROSWITCH_BATCH_TIMEOUT_SECONDS', 10))  # Longer waits for a batch route to the default provider
+
+    # NeuroSwitch session affinity: keep a conversation on its provider unless the classifier's pick wins clearly
+    NEUROSWITCH_AFFINITY_ENABLED = os.getenv('NEUROSWITCH_AFFINITY_ENABLED', 'true').lower() == 'true'
+    NEUROSWITCH_AFFINITY_MARGIN = float(os.getenv('NEUROSWITCH_AFFINITY_MARGIN', 0.3))  # Required provider score advantage (0-1)
+    NEUROSWITCH_AFFINITY_MIN_MESSAGES = int(os.getenv('NEUROSWITCH_AFFINITY_MIN_MESSAGES', 4))  # Shorter sessions always follow the classifier
 
     # Paths
     BASE_DIR = Path(__file__).parent
@@ -0,0 +1,165 @@
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import token_counter
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Context window sizes in tokens, matched by longest model-name prefix
+MODEL_CONTEXT_WINDOWS = {
+    'claude-3': 200000,
+    'claude-sonnet-4': 200000,
+    'claude-opus-4': 200000,
+    'gpt-4o': 128000,
+    'gpt-4-turbo': 128000,
+    'gpt-4.1': 1000000,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+    'o1': 200000,
+    'o3': 200000,
+    'gemini-1.5-flash': 1000000,
+    'gemini-1.5-pro': 2000000,
+    'gemini-2.0': 1000000,
+    'gemini-2.5': 1000000,
+}
+
+# Used when the model is not in MODEL_CONTEXT_WINDOWS
+PROVIDER_DEFAULT_CONTEXT_WINDOWS = {
+    'claude': 200000,
+    'openai': 128000,
+    'gemini': 1000000,
+}
+
+class ContextWindowExceededError(ValueError):
+    """Raised before calling the provider when the messages that cannot be dropped exceed the model's context window."""
+    pass
+
+def resolve_model(provider) -> str:
+    """The model name a provider instance will call, mirroring each provider's own selection logic."""
+    client_model = getattr(provider, 'client_model', None)
+    if client_model:
+        return client_model
+    return {
+        'claude': Config.MODEL,
+        'openai': Config.OPENAI_MODEL,
+        'gemini': Config.GEMINI_MODEL,
+    }.get(provider.name, '')
+
+def context_window_tokens(provider_name: str, model: str) -> int:
+    """Context window of a model, by longest matching prefix, falling back to the provider default."""
+    model = (model or '').lower()
+    matches = [prefix for prefix in MODEL_CONTEXT_WINDOWS if model.startswith(prefix)]
+    if matches:
+        return MODEL_CONTEXT_WINDOWS[max(matches, key=len)]
+    return PROVIDER_DEFAULT_CONTEXT_WINDOWS.get(provider_name, 128000)
+
+def input_token_budget(provider_name: str, model: str) -> int:
+    """
+    Tokens available for the request's input: the model's context window minus the output
+    reserved by Config.MAX_TOKENS, capped by Config.CONTEXT_MAX_INPUT_TOKENS (0 disables the cap).
+    """
+    budget = context_window_tokens(provider_name, model) - Config.MAX_TOKENS
+    if Config.CONTEXT_MAX_INPUT_TOKENS > 0:
+        budget = min(budget, Config.CONTEXT_MAX_INPUT_TOKENS)
+    return max(budget, 0)
+
+def _is_tool_continuation(message: Dict[str, Any]) -> bool:
+    """True for messages that answer the previous message's tool call and must stay attached to it."""
+    if message.get('role') == 'tool':
+        return True
+    content = message.get('content', message.get('parts'))
+    if isinstance(content, list):
+        return any(isinstance(part, dict) and (part.get('type') == 'tool_result' or 'function_response' in part)
+                   for part in content)
+    return False
+
+def _group_units(messages: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Split messages into units that are kept or dropped together (a tool call with its results)."""
+    units: List[List[Dict[str, Any]]] = []
+    for message in messages:
+        if units and _is_tool_continuation(message):
+            units[-1].append(message)
+        else:
+            units.append([message])
+    return units
+
+def fit_messages(messages: List[Dict[str, Any]], provider_name: str, model: str,
+                 budget: Optional[int] = None,
+                 count_tokens: Optional[Callable[[Dict[str, Any]], int]] = None
+                 ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Fit a provider-ready message list (system prompt first) into the input token budget.
+
+    The system prompt and the newest turn are always kept. Older turns are dropped, oldest first,
+    until the rest fits; a tool call is never separated from its results, and the kept history
+    always opens with a user message, as Claude and Gemini require.
+
+    Old turns are dropped in multiples of Config.CONTEXT_TRIM_STEP units rather than one per
+    request, so the first kept message (and with it the prompt prefix that provider-side prompt
+    caches match on) stays the same for several turns instead of shifting every turn.
+
+    Tokens are counted with the provider's tokenizer from token_counter (cached per message)
+    unless `count_tokens` is given.
+
+    Returns:
+        (messages to send, report) where report is a dict with budget_tokens,
+        estimated_input_tokens, estimated_input_cost_usd (None for unknown models), kept_messages,
+        trimmed_messages and over_budget (True when even the pinned messages exceed the budget).
+    """
+    if budget is None:
+        budget = input_token_budget(provider_name, model)
+    if count_tokens is None:
+        tokenizer = token_counter.get_tokenizer(provider_name, model)
+        count_tokens = lambda message: token_counter.count_message_tokens(message, tokenizer)
+
+    system_messages = messages[:1] if messages and messages[0].get('role') == 'system' else []
+    body = messages[len(system_messages):]
+
+    used = sum(count_tokens(message) for message in system_messages)
+    units = _group_units(body)
+    kept_units: List[Tuple[List[Dict[str, Any]], int]] = []
+    for unit in reversed(units):
+        cost = sum(count_tokens(message) for message in unit)
+        if kept_units and used + cost > budget:
+            break
+        used += cost
+        kept_units.append((unit, cost))
+    kept_units.reverse()
+
+    dropped = len(units) - len(kept_units)
+    if dropped and Config.CONTEXT_TRIM_STEP > 1:
+        target = min(-(-dropped // Config.CONTEXT_TRIM_STEP) * Config.CONTEXT_TRIM_STEP, len(units) - 1)
+        while len(units) - len(kept_units) < target:
+            used -= kept_units.pop(0)[1]
+
+    # Dropping turns can leave an assistant reply at the front; the history must open with the user
+    while len(kept_units) > 1 and kept_units[0][0][0].get('role') != 'user':
+        used -= kept_units.pop(0)[1]
+
+    kept = [message for unit, _ in kept_units for message in unit]
+    report = {
+        'budget_tokens': budget,
+        'estimated_input_tokens': used,
+        'estimated_input_cost_usd': token_counter.estimate_cost(model, used),
+        'kept_messages': len(kept),
+        'trimmed_messages': len(body) - len(kept),
+        'over_budget': used > budget,
+    }
+    if report['trimmed_messages']:
+        logger.info(f"Context window: dropped {report['trimmed_messages']} older messages for {provider_name}/{model} "
+                    f"(~{used} of {budget} input tokens).")
+    return system_messages + kept, report
+
+def ensure_fits_model(report: Dict[str, Any], provider_name: str, model: str):
+    """
+    Pre-flight check: raise ContextWindowExceededError if the fitted request cannot fit the
+    model's context window at all (e.g. a single huge message), instead of paying for a
+    request the vendor will reject.
+    """
+    limit = context_window_tokens(provider_name, model) - Config.MAX_TOKENS
+    if report['estimated_input_tokens'] > limit:
+        raise ContextWindowExceededError(
+            f"The message is too long for {model or provider_name}: about {report['estimated_input_tokens']} input tokens, "
+            f"but at most {limit} fit alongside the {Config.MAX_TOKENS}-token reply. Please shorten it or split it up."
+        )
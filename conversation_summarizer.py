@@ -0,0 +1,225 @@
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import token_counter
+from ce3 import response_text
+from config import Config
+from providers.provider_factory import ProviderFactory
+from session_store import SessionStore
+
+logger = logging.getLogger(__name__)
+
+# Models considered for summarization; the cheapest one whose provider has a server API key is used
+SUMMARY_MODEL_CANDIDATES = [
+    ('gemini', 'gemini-1.5-flash-latest'),
+    ('openai', 'gpt-4o-mini'),
+    ('claude', 'claude-3-haiku-20240307'),
+]
+
+# Longest stretch of a single message included in the summarization transcript
+MAX_TRANSCRIPT_CHARS_PER_MESSAGE = 4000
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain the running summary of a long conversation between a user and an AI assistant. "
+    "Rewrite the summary so that it also covers the new messages below. Keep every fact, decision, "
+    "name, number, code identifier and open question the assistant may need later; drop greetings "
+    "and repetition. Write plain prose or short bullet points, at most about 400 words, and reply "
+    "with the summary only."
+)
+
+def _provider_api_keys() -> Dict[str, Optional[str]]:
+    return {
+        'claude': Config.ANTHROPIC_API_KEY,
+        'openai': Config.OPENAI_API_KEY,
+        'gemini': Config.GEMINI_API_KEY,
+    }
+
+def choose_summary_model() -> Optional[Tuple[str, str]]:
+    """
+    (provider, model) used to write summaries: Config.SUMMARY_PROVIDER/SUMMARY_MODEL if set,
+    otherwise the candidate with the lowest list price among providers with a server API key.
+    Returns None when no provider is configured.
+    """
+    keys = _provider_api_keys()
+    if Config.SUMMARY_PROVIDER:
+        provider_name = Config.SUMMARY_PROVIDER.lower()
+        default_model = dict(SUMMARY_MODEL_CANDIDATES).get(provider_name)
+        return provider_name, Config.SUMMARY_MODEL or default_model
+    configured = [(name, model) for name, model in SUMMARY_MODEL_CANDIDATES if keys.get(name)]
+    if not configured:
+        return None
+    # Summaries read far more than they write, so rank by the cost of a typical input-heavy call
+    return min(configured, key=lambda candidate: token_counter.estimate_cost(candidate[1], 10000, 500) or float('inf'))
+
+def summary_boundary(history: List[Dict[str, Any]], keep_recent: int) -> int:
+    """
+    Number of leading messages to fold into the summary so that at least `keep_recent` recent
+    messages stay verbatim. The boundary is moved back to the start of a user turn, so a tool
+    call is never separated from its result and the verbatim window opens with the user.
+    """
+    boundary = len(history) - keep_recent
+    while boundary > 0 and history[boundary].get('role') != 'user':
+        boundary -= 1
+    while boundary > 0 and is_tool_result(history[boundary]):
+        boundary -= 1
+        while boundary > 0 and history[boundary].get('role') != 'user':
+            boundary -= 1
+    return max(boundary, 0)
+
+def is_tool_result(message: Dict[str, Any]) -> bool:
+    """True for a user message carrying tool results, which continues the previous turn."""
+    content = message.get('content')
+    return isinstance(content, list) and any(isinstance(part, dict) and part.get('type') == 'tool_result' for part in content)
+
+def message_text(message: Dict[str, Any], max_chars: int = MAX_TRANSCRIPT_CHARS_PER_MESSAGE) -> str:
+    """Plain-text rendering of a stored message, cut to max_chars."""
+    content = message.get('content')
+    if isinstance(content, str):
+        text = content
+    elif isinstance(content, list):
+        parts = []
+        for part in content:
+            if not isinstance(part, dict):
+                parts.append(str(part))
+            elif part.get('type') == 'text':
+                parts.append(part.get('text', ''))
+            elif part.get('type') == 'image':
+                parts.append('[image]')
+            elif part.get('type') == 'tool_use':
+                parts.append(f"[called tool {part.get('name')} with {part.get('input')}]")
+            elif part.get('type') == 'tool_result':
+                parts.append(f"[tool result: {part.get('content')}]")
+        text = '\n'.join(parts)
+    else:
+        text = str(content or '')
+    if len(text) > max_chars:
+        text = text[:max_chars] + ' [...]'
+    return text
+
+def build_summary_prompt(previous_summary: Optional[str], messages: List[Dict[str, Any]]) -> str:
+    """The single user message sent to the summarization model."""
+    lines = [SUMMARY_INSTRUCTIONS, '']
+    lines.append('Current summary:')
+    lines.append(previous_summary or '(none yet)')
+    lines.append('')
+    lines.append('New messages:')
+    for message in messages:
+        lines.append(f"{message.get('role', 'unknown').upper()}: {message_text(message)}")
+    return '\n'.join(lines)
+
+class ConversationSummarizer:
+    """
+    Compacts old turns of long sessions into a rolling summary, off the request path.
+
+    After a turn is saved, maybe_schedule() checks whether the session has more than
+    Config.SUMMARY_TRIGGER_MESSAGES messages not covered by its summary. If so, a worker thread
+    folds everything except the newest Config.SUMMARY_KEEP_RECENT_MESSAGES into the summary
+    using the cheapest configured model and stores it with SessionStore.save_summary(). Later
+    turns then send the summary plus the recent messages instead of the full history (see
+    build_history_with_summary). At most one summarization runs per session at a time; failures
+    are logged and the session simply keeps sending its full history.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='summarizer')
+        self._in_flight: Set[str] = set()
+        self._lock = threading.Lock()
+        self._metrics = {'scheduled': 0, 'stored': 0, 'discarded': 0, 'failed': 0}
+
+    def maybe_schedule(self, session_id: str, store: SessionStore) -> bool:
+        """Queue a summarization for the session if it needs one. Returns True if queued."""
+        if not Config.SUMMARY_ENABLED:
+            return False
+        try:
+            data = store.get(session_id)
+        except Exception as e:
+            logger.warning(f"Summarizer could not read session {session_id}: {e}")
+            return False
+        covered = data['summary']['covers'] if data.get('summary') else 0
+        if len(data['conversation_history']) - covered <= Config.SUMMARY_TRIGGER_MESSAGES:
+            return False
+        with self._lock:
+            if session_id in self._in_flight:
+                return False
+            self._in_flight.add(session_id)
+            self._metrics['scheduled'] += 1
+        self._executor.submit(self._run, session_id, store, data)
+        return True
+
+    def _run(self, session_id: str, store: SessionStore, data: Dict[str, Any]):
+        try:
+            self.summarize(session_id, store, data)
+        except Exception:
+            with self._lock:
+                self._metrics['failed'] += 1
+            logger.exception(f"Background summarization failed for session {session_id}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(session_id)
+
+    def summarize(self, session_id: str, store: SessionStore, data: Dict[str, Any]) -> bool:
+        """Summarize one session snapshot (as returned by store.get) and store the result."""
+        history = list(data['conversation_history'])
+        previous = data.get('summary')
+        covered = previous['covers'] if previous else 0
+        covers = summary_boundary(history, Config.SUMMARY_KEEP_RECENT_MESSAGES)
+        if covers <= covered:
+            return False
+
+        choice = choose_summary_model()
+        if choice is None:
+            logger.info("Summarization skipped: no provider API key configured.")
+            return False
+        provider_name, model = choice
+        api_key = _provider_api_keys().get(provider_name)
+        if not api_key:
+            logger.info(f"Summarization skipped: no server API key configured for {provider_name}.")
+            return False
+        provider = ProviderFactory.get_provider(provider_name, api_key=api_key, client_model=model)
+
+        # Instructions go in the user message: not every provider honours a system message here
+        prompt = build_summary_prompt(previous['text'] if previous else None, history[covered:covers])
+        response = provider.chat([{'role': 'user', 'content': [{'type': 'text', 'text': prompt}]}], [], Config)
+        # Providers report failures as a normal response; never store their error text as the summary
+        text = response_text(response).strip()
+        if response.get('stop_reason') == 'error':
+            raise RuntimeError(f"{provider_name}/{model} failed to summarize: {text}")
+        if not text:
+            raise RuntimeError(f"{provider_name}/{model} returned an empty summary")
+
+        stored = store.save_summary(session_id, text, covers, data['generation'])
+        with self._lock:
+            self._metrics['stored' if stored else 'discarded'] += 1
+        usage = response.get('usage', {})
+        logger.info(f"Summarized messages {covered}-{covers} of session {session_id} with {provider_name}/{model} "
+                    f"({usage.get('input_tokens', 0)} in / {usage.get('output_tokens', 0)} out tokens, "
+                    f"{'stored' if stored else 'discarded: session changed'}).")
+        return stored
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._metrics, in_flight=len(self._in_flight))
+
+def summary_messages(summary_text: str) -> List[Dict[str, Any]]:
+    """The messages that stand in for the summarized turns at the start of the history."""
+    return list(_summary_message_pair(summary_text))
+
+@functools.lru_cache(maxsize=Config.SANITIZE_CACHE_MAX_ENTRIES)
+def _summary_message_pair(summary_text: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    # The same message objects are returned for the same summary so that the sanitizer's prefix
+    # checkpoints and the per-message token counts keep hitting from turn to turn.
+    return (
+        {'role': 'user', 'content': [{'type': 'text', 'text': f"Summary of our earlier conversation:\n\n{summary_text}"}]},
+        {'role': 'assistant', 'content': "Understood. I'll keep that earlier context in mind."},
+    )
+
+def build_history_with_summary(history, summary: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """The history to send: summary messages plus the messages the summary does not cover."""
+    if not summary or not summary.get('text'):
+        return history
+    return summary_messages(summary['text']) + list(history)[summary['covers']:]
+
+summarizer = ConversationSummarizer(max_workers=Config.SUMMARY_WORKERS)
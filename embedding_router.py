@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# A few typical requests per NeuroSwitch label. Each label is routed by one prototype vector: the
+# normalized mean of the embeddings of its description and these examples. Editing them changes
+# the fingerprint, so the persisted label embeddings are rebuilt on the next start.
+LABEL_EXAMPLES: Dict[str, List[str]] = {
+    "image generation": ["Draw a picture of a cat astronaut", "Generate an image of a sunset over mountains", "Create a logo for my bakery"],
+    "data analysis": ["Analyze this sales data and find trends", "What does this CSV tell us about churn?", "Compute the correlation between these columns"],
+    "programming help": ["Why does my Python script throw a KeyError?", "How do I fix this segmentation fault?", "Explain what this JavaScript closure does"],
+    "text summarization": ["Summarize this article in three bullet points", "Give me a short summary of this report", "TL;DR of the following text"],
+    "translation": ["Translate this paragraph into Spanish", "How do you say good morning in Japanese?", "Translate this email to German"],
+    "sentiment analysis": ["Is this customer review positive or negative?", "What is the tone of this message?", "Classify the sentiment of these tweets"],
+    "code generation": ["Write a Python function that reverses a linked list", "Generate a SQL query for monthly revenue", "Write a bash script to back up a folder"],
+    "content creation": ["Write a blog post about remote work", "Draft an Instagram caption for our launch", "Write a short story about a lighthouse keeper"],
+    "math problem solving": ["Solve the equation 3x + 7 = 22", "What is the integral of x squared?", "Prove that the square root of 2 is irrational"],
+    "SEO analysis": ["Which keywords should my landing page target?", "How can I improve my site's search ranking?", "Audit the meta tags on this page"],
+    "product recommendation": ["Which laptop should I buy for video editing?", "Recommend a good pair of running shoes", "What is the best budget phone right now?"],
+    "grammar checking": ["Fix the grammar in this sentence", "Proofread my cover letter", "Is it 'fewer' or 'less' here?"],
+    "financial forecasting": ["Forecast next quarter's revenue from these numbers", "Project our cash flow for the next year", "Will this stock go up next month?"],
+    "legal document review": ["Review this contract for risky clauses", "What does this NDA clause mean?", "Check this lease agreement for problems"],
+    "personal assistant task": ["Remind me to call mom tomorrow", "Schedule a meeting with the team on Friday", "Make a to-do list for my move"],
+    "weather forecast": ["What's the weather in Paris tomorrow?", "Will it rain this weekend?", "How hot will it be in Phoenix today?"],
+    "health advice": ["What can I do about frequent headaches?", "Is it safe to take ibuprofen with coffee?", "How much sleep do adults need?"],
+    "recipe suggestion": ["What can I cook with chicken and rice?", "Give me a vegan dessert recipe", "How do I make sourdough bread?"],
+    "historical fact": ["When did the Roman Empire fall?", "Who was the first president of Kenya?", "What caused World War I?"],
+    "travel planning": ["Plan a five-day trip to Tokyo", "What should I see in Lisbon?", "Find me an itinerary for a road trip in Norway"],
+    "general question": ["Hello, how are you?", "What can you help me with?", "Tell me something interesting"],
+}
+
+class EmbeddingRouter:
+    """
+    Single-pass alternative to the zero-shot NLI pipeline.
+
+    Zero-shot classification runs one BART-large forward pass per candidate label. Here each
+    label is a precomputed prototype embedding, so classifying a message costs one encoder pass
+    for the message plus a (labels x dimensions) NumPy matrix product. Cosine similarities are
+    turned into probabilities with a softmax at `temperature`, so the scores sum to 1 like the
+    pipeline's and NeuroSwitch's provider scores and affinity margin keep their meaning.
+
+    Calls take and return the same shapes as the transformers pipeline, so
+    get_neuroswitch_provider uses either one unchanged.
+    """
+
+    def __init__(self, embedder, labels: Sequence[str], examples: Dict[str, List[str]] = LABEL_EXAMPLES,
+                 cache_dir: Optional[str] = None, temperature: float = 0.05):
+        self.embedder = embedder
+        self.labels = list(labels)
+        self.examples = {label: list(examples.get(label, [])) for label in self.labels}
+        self.temperature = temperature
+        self.label_vectors = self._load_or_build(cache_dir)
+
+    def fingerprint(self) -> str:
+        """Identifies the label embeddings: changes with the model, the labels or their examples."""
+        key = json.dumps({'model': self.embedder.name, 'labels': self.labels, 'examples': self.examples}, sort_keys=True)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+    def _build(self) -> np.ndarray:
+        texts, owners = [], []
+        for row, label in enumerate(self.labels):
+            for text in [f"This request is about {label}."] + self.examples[label]:
+                texts.append(text)
+                owners.append(row)
+        vectors = self.embedder.embed(texts)
+        prototypes = np.zeros((len(self.labels), vectors.shape[1]), dtype=np.float32)
+        np.add.at(prototypes, owners, vectors)
+        return prototypes / np.maximum(np.linalg.norm(prototypes, axis=1, keepdims=True), 1e-9)
+
+    def _load_or_build(self, cache_dir: Optional[str]) -> np.ndarray:
+        """Label embeddings from cache_dir if they were persisted for this fingerprint, else computed and saved."""
+        path = os.path.join(cache_dir, f"label_embeddings-{self.fingerprint()}.npy") if cache_dir else None
+        if path and os.path.exists(path):
+            try:
+                vectors = np.load(path)
+                if vectors.shape[0] == len(self.labels):
+                    logger.info(f"Loaded NeuroSwitch label embeddings from {path}")
+                    return vectors
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read label embeddings from {path}: {e}. Recomputing them.")
+
+        vectors = self._build()
+        if path:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix='.label_embeddings-', suffix='.npy')
+                with os.fdopen(fd, 'wb') as temp_file:
+                    np.save(temp_file, vectors)
+                os.replace(temp_path, path)
+                logger.info(f"Saved NeuroSwitch label embeddings to {path}")
+            except OSError as e:
+                logger.warning(f"Could not persist label embeddings to {path}: {e}")
+        return vectors
+
+    def scores(self, texts: List[str]) -> np.ndarray:
+        """(len(texts), len(labels)) label probabilities."""
+        logits = (self.embedder.embed(texts) @ self.label_vectors.T) / self.temperature
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def __call__(self, texts: Union[str, List[str]], candidate_labels: Sequence[str] = None, multi_label: bool = False,
+                 batch_size: int = None) -> Union[dict, List[dict]]:
+        """
+        Classify a text, or a list of texts in one encoder pass: {'sequence', 'labels', 'scores'}
+        with labels by descending score (a list of them for a list), as the pipeline returns.
+        """
+        if candidate_labels is not None and list(candidate_labels) != self.labels:
+            raise ValueError("EmbeddingRouter was built for a different set of candidate labels.")
+        batch = [texts] if isinstance(texts, str) else list(texts)
+        results = []
+        for text, probabilities in zip(batch, self.scores(batch)):
+            order = np.argsort(-probabilities)
+            results.append({'sequence': text, 'labels': [self.labels[i] for i in order],
+                            'scores': [float(probabilities[i]) for i in order]})
+        return results[0] if isinstance(texts, str) else results
+
+def create_embedding_router(labels: Sequence[str]) -> EmbeddingRouter:
+    """
+    EmbeddingRouter over Config.NEUROSWITCH_EMBEDDING_MODEL ('hashing' or a Hugging Face encoder),
+    with label embeddings persisted under Config.NEUROSWITCH_CACHE_DIR.
+    Raises ImportError when the model needs transformers and torch and they are not installed.
+    """
+    import retrieval_memory
+    model_name = Config.NEUROSWITCH_EMBEDDING_MODEL
+    if model_name != 'hashing' and not retrieval_memory.TRANSFORMERS_AVAILABLE:
+        raise ImportError(f"transformers and torch are required for the embedding model '{model_name}'")
+    embedder = retrieval_memory.create_embedder(model_name)
+    return EmbeddingRouter(embedder, labels, cache_dir=Config.NEUROSWITCH_CACHE_DIR,
+                           temperature=Config.NEUROSWITCH_EMBEDDING_TEMPERATURE)
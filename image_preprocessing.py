@@ -0,0 +1,214 @@
+import base64
+import io
+import logging
+import math
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from blob_store import blob_store
+from config import Config
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# File signatures of the formats every provider accepts in some form
+MAGIC_NUMBERS = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+# (longest edge, shortest edge, pixel count) past which each vendor downsamples an image before
+# the model sees it; anything larger only costs upload bytes, latency and, for Claude, tokens.
+# None means no limit on that dimension.
+PROVIDER_IMAGE_LIMITS = {
+    'claude': (1568, None, 1_150_000),
+    'openai': (2048, 768, None),  # High detail: fit 2048x2048, then the shortest side to 768
+    'gemini': (3072, None, None),
+}
+
+# Stored uploads are capped at the largest size any provider uses
+UPLOAD_IMAGE_LIMITS = (3072, None, None)
+
+PROVIDER_MEDIA_TYPES = {
+    'claude': {'image/png', 'image/jpeg', 'image/gif', 'image/webp'},
+    'openai': {'image/png', 'image/jpeg', 'image/gif', 'image/webp'},
+    'gemini': {'image/png', 'image/jpeg', 'image/webp'},
+}
+UPLOAD_MEDIA_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/webp'}
+
+def sniff_media_type(data: bytes) -> Optional[str]:
+    """The image format from the file's magic bytes, or None if it is not PNG, JPEG, GIF or WebP."""
+    for magic, media_type in MAGIC_NUMBERS:
+        if data.startswith(magic):
+            return media_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+def target_size(width: int, height: int, limits: Tuple[Optional[int], Optional[int], Optional[int]]) -> Tuple[int, int]:
+    """The largest size within `limits` with the image's aspect ratio (never upscaled)."""
+    max_long, max_short, max_pixels = limits
+    scale = 1.0
+    if max_long:
+        scale = min(scale, max_long / max(width, height))
+    if max_short:
+        scale = min(scale, max_short / min(width, height))
+    if max_pixels:
+        scale = min(scale, math.sqrt(max_pixels / (width * height)))
+    if scale >= 1.0:
+        return width, height
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+def _has_alpha(image) -> bool:
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+def _fits(image, size_bytes: int, media_type: str, limits, allowed_media_types) -> bool:
+    """Whether an opened image can be used as it is: within `limits`, in an allowed format and small enough."""
+    return (target_size(image.width, image.height, limits) == image.size and media_type in allowed_media_types and
+            (size_bytes <= Config.IMAGE_RECOMPRESS_MIN_BYTES or getattr(image, 'is_animated', False)))
+
+def preprocess(data: bytes, limits, allowed_media_types) -> Tuple[bytes, str]:
+    """
+    (bytes, media type) of the image prepared for a destination: downscaled to `limits` and
+    re-encoded when it is too large, in a format not in `allowed_media_types`, or bigger than
+    Config.IMAGE_RECOMPRESS_MIN_BYTES. Images with transparency become PNG, others JPEG at
+    Config.IMAGE_JPEG_QUALITY. Images that already fit are returned untouched, as is anything
+    Pillow cannot read.
+    """
+    media_type = sniff_media_type(data) or 'image/jpeg'
+    if not PIL_AVAILABLE or not Config.IMAGE_PREPROCESSING_ENABLED:
+        return data, media_type
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if _fits(image, len(data), media_type, limits, allowed_media_types):
+                return data, media_type
+            size = target_size(image.width, image.height, limits)
+            resize = size != image.size
+
+            image.seek(0)  # Animated images that must be converted keep their first frame
+            alpha = _has_alpha(image)
+            converted = image.convert('RGBA' if alpha else 'RGB')
+            if resize:
+                converted = converted.resize(size, Image.LANCZOS)
+            output = io.BytesIO()
+            if alpha:
+                converted.save(output, format='PNG', optimize=True)
+                result = output.getvalue(), 'image/png'
+            else:
+                converted.save(output, format='JPEG', quality=Config.IMAGE_JPEG_QUALITY, optimize=True)
+                result = output.getvalue(), 'image/jpeg'
+    except Exception as e:
+        logger.warning(f"Could not preprocess {media_type} image ({len(data)} bytes): {e}. Sending it unchanged.")
+        return data, media_type
+
+    # A re-encode that does not help is dropped, unless the size or format had to change
+    if not resize and media_type in allowed_media_types and len(result[0]) >= len(data):
+        return data, media_type
+    return result
+
+def store_upload(data: bytes) -> Tuple[str, str]:
+    """
+    Validate, downscale and store an uploaded image. Returns (blob_id, media_type).
+    Raises ValueError when the data is not a PNG, JPEG, GIF or WebP image.
+    """
+    if sniff_media_type(data) is None:
+        raise ValueError("Unsupported image format. Please upload a PNG, JPEG, GIF or WebP image.")
+    prepared, media_type = preprocess(data, UPLOAD_IMAGE_LIMITS, UPLOAD_MEDIA_TYPES)
+    if len(prepared) < len(data):
+        logger.info(f"Stored upload as {media_type}, {len(prepared)} bytes (was {len(data)}).")
+    return blob_store.put(prepared), media_type
+
+def store_upload_stream(stream: BinaryIO) -> Tuple[str, str]:
+    """
+    store_upload for a seekable binary file object, such as a multipart part Werkzeug has spooled
+    to a temporary file. Only the header is read to check the image; one that can be stored as
+    it is gets copied to the blob store in chunks instead of being read into memory.
+    """
+    media_type = sniff_media_type(stream.read(16))
+    if media_type is None:
+        raise ValueError("Unsupported image format. Please upload a PNG, JPEG, GIF or WebP image.")
+    stream.seek(0, io.SEEK_END)
+    size_bytes = stream.tell()
+    stream.seek(0)
+    fits = not PIL_AVAILABLE or not Config.IMAGE_PREPROCESSING_ENABLED
+    if not fits:
+        try:
+            with Image.open(stream) as image:
+                fits = _fits(image, size_bytes, media_type, UPLOAD_IMAGE_LIMITS, UPLOAD_MEDIA_TYPES)
+        except Exception:
+            fits = False  # Let store_upload decide, and log, on the full data
+        stream.seek(0)
+    if fits:
+        return blob_store.put_stream(stream), media_type
+    return store_upload(stream.read())
+
+class PreparedImage:
+    """An image ready for one provider; the base64 form is built on first use and kept."""
+    __slots__ = ('data', 'media_type', '_base64')
+
+    def __init__(self, data: bytes, media_type: str):
+        self.data = data
+        self.media_type = media_type
+        self._base64 = None
+
+    @property
+    def base64(self) -> str:
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode('ascii')
+        return self._base64
+
+class PreparedImageCache:
+    """
+    Thread-safe LRU of images prepared per (blob id, provider), bounded by their total size.
+    Decoding and resizing a photo takes tens of milliseconds, and the same image is re-sent on
+    every later turn of its conversation, so each is prepared once per provider.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[Tuple[str, str], PreparedImage]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, blob_id: str, provider: str) -> Optional[PreparedImage]:
+        """The image prepared for `provider`, or None if the blob is missing."""
+        key = (blob_id, provider)
+        with self._lock:
+            image = self._entries.get(key)
+            if image is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return image
+            self.misses += 1
+
+        data = blob_store.get(blob_id)
+        if data is None:
+            return None
+        limits = PROVIDER_IMAGE_LIMITS.get(provider, UPLOAD_IMAGE_LIMITS)
+        image = PreparedImage(*preprocess(data, limits, PROVIDER_MEDIA_TYPES.get(provider, UPLOAD_MEDIA_TYPES)))
+
+        with self._lock:
+            if key not in self._entries and len(image.data) <= self.max_bytes:
+                self._entries[key] = image
+                self.total_bytes += len(image.data)
+                while self.total_bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.total_bytes -= len(evicted.data)
+        return image
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.total_bytes, 'hits': self.hits, 'misses': self.misses}
+
+# Shared by all requests in this process
+prepared_images = PreparedImageCache(max_bytes=Config.IMAGE_CACHE_MAX_BYTES)
@@ -0,0 +1,454 @@
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from image_preprocessing import PreparedImage, prepared_images
+
+logger = logging.getLogger(__name__)
+
+# Gemini calls the assistant role 'model'; other roles (system, tool) are not sent as history
+GEMINI_ROLES = {'user': 'user', 'assistant': 'model'}
+
+# A dict with one of these keys (and no 'type') is already a Gemini part
+GEMINI_PART_KEYS = ('text', 'inline_data', 'function_call', 'function_response')
+
+# State carried between messages by the OpenAI encoder:
+# (previous message was an assistant tool_use request, role of the last message it produced)
+OpenAIState = Tuple[bool, Optional[str]]
+OPENAI_INITIAL_STATE: OpenAIState = (False, None)
+
+class WireMessage(dict):
+    """
+    A message in a provider's request format, as produced by the encoders below. Providers send
+    these as they are; any other message dict is encoded first (see to_wire).
+    """
+    __slots__ = ()
+
+class LazyWireMessage(WireMessage):
+    """
+    A WireMessage with images stored in the blob store. Its own content references the blobs
+    by id, which is what gets cached and token-counted; resolve() returns the copy with the image
+    bytes, built by to_wire only when a request is actually sent.
+    """
+    __slots__ = ('resolve',)
+
+def _to_dict_if_possible(obj: Any) -> Union[Dict, Any]:
+    """Convert object to dictionary if possible, otherwise return as-is."""
+    if hasattr(obj, 'dict') and callable(getattr(obj, 'dict', None)):
+        return obj.dict()
+    if hasattr(obj, '__dict__') and hasattr(obj, 'type'):
+        # For Anthropic blocks like TextBlock, ToolUseBlock, etc.
+        return {k: v for k, v in obj.__dict__.items() if not k.startswith('_')}
+    return obj
+
+def _deep_sanitize(obj: Any) -> Any:
+    """Recursively convert SDK objects (Pydantic models, Anthropic blocks) to dicts and lists."""
+    if isinstance(obj, list):
+        return [_deep_sanitize(_to_dict_if_possible(item)) for item in obj]
+    elif isinstance(obj, dict):
+        return {k: _deep_sanitize(_to_dict_if_possible(v)) for k, v in obj.items()}
+    else:
+        return _to_dict_if_possible(obj)
+
+class Part:
+    """Base of the canonical content parts. `source` is the dict the part was parsed from, if any."""
+    __slots__ = ('source',)
+
+class TextPart(Part):
+    __slots__ = ('text',)
+
+    def __init__(self, text: Any, source: Optional[Dict[str, Any]] = None):
+        self.text = text
+        self.source = source
+
+class ImagePart(Part):
+    """
+    An Anthropic-style image block. Its source is either inline base64 `data` or, for uploads,
+    a `blob_id` in the blob store (source type 'blob'), read only when a request is sent.
+    """
+    __slots__ = ('source_type', 'media_type', 'data', 'blob_id')
+
+    def __init__(self, source_type: Optional[str], media_type: str, data: str, source: Dict[str, Any], blob_id: Optional[str] = None):
+        self.source_type = source_type
+        self.media_type = media_type
+        self.data = data
+        self.blob_id = blob_id
+        self.source = source
+
+class ImageUrlPart(Part):
+    """An OpenAI-style image_url part; `url` is None when the part is malformed."""
+    __slots__ = ('url',)
+
+    def __init__(self, url: Optional[str], source: Dict[str, Any]):
+        self.url = url
+        self.source = source
+
+class ToolUsePart(Part):
+    __slots__ = ('id', 'name', 'input')
+
+    def __init__(self, id: Optional[str], name: Optional[str], input: Any, source: Dict[str, Any]):
+        self.id = id
+        self.name = name
+        self.input = input
+        self.source = source
+
+class ToolResultPart(Part):
+    """A tool result; `name` is the tool's name when the history recorded it (tool_name or name)."""
+    __slots__ = ('tool_use_id', 'name', 'content')
+
+    def __init__(self, tool_use_id: Optional[str], name: Optional[str], content: Any, source: Dict[str, Any]):
+        self.tool_use_id = tool_use_id
+        self.name = name
+        self.content = content
+        self.source = source
+
+class OtherPart(Part):
+    """Anything else: an unrecognized dict (kept in `source`) or a non-dict value."""
+    __slots__ = ('value',)
+
+    def __init__(self, value: Any):
+        self.value = value
+        self.source = value if isinstance(value, dict) else None
+
+class Message:
+    """
+    Canonical form of one history message, parsed once and then encoded for any provider.
+
+    Content is either `text` (a plain string) or `parts`. `single` is True when the stored
+    content was one part rather than a list, which some providers render differently.
+    """
+    __slots__ = ('role', 'text', 'parts', 'single', 'tool_call_id', 'source')
+
+    def __init__(self, role: str, text: Optional[str] = None, parts: Tuple[Part, ...] = (), single: bool = False,
+                 tool_call_id: Optional[str] = None, source: Optional[Dict[str, Any]] = None):
+        self.role = role
+        self.text = text
+        self.parts = parts
+        self.single = single
+        self.tool_call_id = tool_call_id
+        self.source = source
+
+def parse_part(item: Any) -> Part:
+    """Canonical part for one content item (dict, string or SDK content block)."""
+    if isinstance(item, str):
+        return TextPart(item)
+    if not isinstance(item, dict):
+        # Stored history is plain JSON; only SDK objects need the recursive conversion
+        item = _deep_sanitize(item)
+        if isinstance(item, str):
+            return TextPart(item)
+        if not isinstance(item, dict):
+            return OtherPart(item)
+
+    part_type = item.get('type')
+    if part_type == 'text':
+        return TextPart(item.get('text', ''), item)
+    if part_type == 'image':
+        image_source = item.get('source')
+        if not isinstance(image_source, dict):
+            image_source = {}
+        return ImagePart(image_source.get('type'), image_source.get('media_type', 'image/jpeg'), image_source.get('data', ''), item,
+                         blob_id=image_source.get('blob_id') if image_source.get('type') == 'blob' else None)
+    if part_type == 'image_url':
+        image_url = item.get('image_url')
+        return ImageUrlPart(image_url.get('url') if isinstance(image_url, dict) else None, item)
+    if part_type == 'tool_use':
+        return ToolUsePart(item.get('id'), item.get('name'), item.get('input', {}), item)
+    if part_type == 'tool_result':
+        return ToolResultPart(item.get('tool_use_id'), item.get('name', item.get('tool_name')), item.get('content', ''), item)
+    return OtherPart(item)
+
+def parse_message(message: Dict[str, Any]) -> Optional[Message]:
+    """Canonical form of a stored message, or None for messages without a role or content."""
+    role = message.get('role')
+    content = message.get('content')
+    if not role or content is None:
+        return None
+    tool_call_id = message.get('tool_call_id')
+    if isinstance(content, str):
+        return Message(role, text=content, tool_call_id=tool_call_id, source=message)
+    if isinstance(content, list):
+        return Message(role, parts=tuple(parse_part(item) for item in content), tool_call_id=tool_call_id, source=message)
+    return Message(role, parts=(parse_part(content),), single=True, tool_call_id=tool_call_id, source=message)
+
+def _has_blob_images(message: Message) -> bool:
+    return any(isinstance(part, ImagePart) and part.blob_id for part in message.parts)
+
+def _prepared_image(part: ImagePart, provider: str) -> Optional[PreparedImage]:
+    """The blob image downscaled and re-encoded for `provider` (cached), or None if the blob is missing."""
+    image = prepared_images.get(part.blob_id, provider)
+    if image is None:
+        logger.warning(f"Image blob {part.blob_id} is missing from the blob store; sending a placeholder instead.")
+    return image
+
+def _missing_image_text(part: ImagePart) -> str:
+    return f"[Image {part.blob_id[:12]} is no longer available]"
+
+def _lazy(wire: WireMessage, resolve: Callable[[], WireMessage]) -> LazyWireMessage:
+    lazy = LazyWireMessage(wire)
+    lazy.resolve = resolve
+    return lazy
+
+# --- Claude ---
+
+def _claude_block(part: Part, resolve: bool = False) -> Any:
+    if resolve and isinstance(part, ImagePart) and part.blob_id:
+        image = _prepared_image(part, 'claude')
+        if image is None:
+            return {"type": "text", "text": _missing_image_text(part)}
+        return {"type": "image", "source": {"type": "base64", "media_type": image.media_type, "data": image.base64}}
+    if isinstance(part, TextPart):
+        return part.source if part.source is not None else {"type": "text", "text": part.text}
+    if isinstance(part, ToolResultPart):
+        # Claude matches results by tool_use_id and rejects the tool_name other providers record
+        if 'tool_name' in part.source:
+            return {k: v for k, v in part.source.items() if k != 'tool_name'}
+        return part.source
+    if isinstance(part, (ImagePart, ToolUsePart)):
+        return part.source
+    if part.source is not None:  # Unknown dicts and image_url parts become text
+        return {"type": "text", "text": str(part.source)}
+    return part.value
+
+def _claude_content(message: Message, resolve: bool = False) -> Any:
+    if message.text is not None:
+        return message.text
+    if message.single:
+        return _claude_block(message.parts[0], resolve)
+    return [_claude_block(part, resolve) for part in message.parts] or [{"type": "text", "text": "[Empty or unsupported list content]"}]
+
+def encode_claude(message: Message) -> List[WireMessage]:
+    """Anthropic Messages API form: the stored blocks pass through, anything unsupported becomes text."""
+    wire = WireMessage(role=message.role, content=_claude_content(message))
+    if _has_blob_images(message):
+        wire = _lazy(wire, lambda: WireMessage(role=message.role, content=_claude_content(message, resolve=True)))
+    return [wire]
+
+# --- Gemini ---
+
+def _gemini_part(part: Part, resolve: bool = False) -> Dict[str, Any]:
+    if isinstance(part, TextPart):
+        return {"text": part.text}
+    if isinstance(part, ImagePart) and part.blob_id:
+        if not resolve:
+            return {"inline_data": {"mime_type": part.media_type, "blob_id": part.blob_id}}
+        # The SDK takes raw bytes here, so Gemini images are never base64-encoded by us
+        image = _prepared_image(part, 'gemini')
+        if image is None:
+            return {"text": _missing_image_text(part)}
+        return {"inline_data": {"mime_type": image.media_type, "data": image.data}}
+    if isinstance(part, ImagePart) and part.source_type == 'base64':
+        return {"text": f"[Image content: {part.media_type}, data omitted for history sanitization]"}
+    if isinstance(part, ToolUsePart):
+        if not part.name:
+            return {"text": "[Invalid 'tool_use' part encountered: missing name]"}
+        return {"function_call": {"name": part.name, "args": dict(part.input) if isinstance(part.input, dict) else {}}}
+    if isinstance(part, ToolResultPart):
+        # Gemini matches a function_response to its function_call by the function's name
+        function_name = part.name if part.name is not None else part.tool_use_id
+        if not function_name:
+            return {"text": "[Invalid 'tool_result' part encountered: missing function name/id]"}
+        return {"function_response": {"name": function_name, "response": {"content": part.content}}}
+    if part.source is not None:
+        if 'type' not in part.source and any(key in part.source for key in GEMINI_PART_KEYS):
+            return part.source  # Already a Gemini part
+        return {"text": f"[Unsupported structured part converted to text: {str(part.source)[:100]}]"}
+    return {"text": f"[Unsupported content type '{type(part.value)}' converted to text: {str(part.value)[:100]}]"}
+
+def encode_gemini(message: Message) -> List[WireMessage]:
+    """Gemini Content form: {'role': 'user' | 'model', 'parts': [...]}, tool calls as function_call/function_response."""
+    role = GEMINI_ROLES.get(message.role)
+    if role is None:
+        return []
+    if message.text is not None:
+        return [WireMessage(role=role, parts=[{"text": message.text}])]
+    parts = [_gemini_part(part) for part in message.parts]
+    wire = WireMessage(role=role, parts=parts or [{"text": "[Content was empty or fully unsupported after sanitization for Gemini]"}])
+    if _has_blob_images(message):
+        wire = _lazy(wire, lambda: WireMessage(role=role, parts=[_gemini_part(part, resolve=True) for part in message.parts]))
+    return [wire]
+
+# --- OpenAI ---
+
+def _openai_content(message: Message, resolve: bool = False) -> Any:
+    """Content of a plain (non tool-call) message: a string or a list of text/image_url parts."""
+    if message.text is not None:
+        return message.text
+    if message.single:
+        part = message.parts[0]
+        if isinstance(part, (ToolUsePart, ToolResultPart)):
+            return f"[Unsupported content type '{part.source.get('type')}' at top level of message content converted to text.]"
+        if part.source is None:
+            return part.text if isinstance(part, TextPart) else part.value
+        return str(part.source)
+
+    openai_parts = []
+    for part in message.parts:
+        if isinstance(part, TextPart):
+            openai_parts.append({"type": "text", "text": part.text})
+        elif isinstance(part, ImageUrlPart):
+            openai_parts.append(part.source)
+        elif isinstance(part, ImagePart) and part.source_type == 'base64':
+            openai_parts.append({"type": "image_url", "image_url": {"url": f"data:{part.media_type};base64,{part.data}"}})
+        elif isinstance(part, ImagePart) and part.blob_id:
+            if not resolve:
+                openai_parts.append({"type": "image_url", "image_url": {"url": f"blob:{part.blob_id}"}})
+                continue
+            image = _prepared_image(part, 'openai')
+            if image is None:
+                openai_parts.append({"type": "text", "text": _missing_image_text(part)})
+            else:
+                openai_parts.append({"type": "image_url", "image_url": {"url": f"data:{image.media_type};base64,{image.base64}"}})
+        elif isinstance(part, (ToolUsePart, ToolResultPart)):
+            # Only valid as tool_calls / role 'tool' messages, not inside text content
+            openai_parts.append({"type": "text", "text": f"[Unsupported content part type '{part.source.get('type')}' in message was converted to text.]"})
+        elif part.source is not None:
+            openai_parts.append({"type": "text", "text": part.source.get("text", str(part.source))})
+    return openai_parts or [{"type": "text", "text": "[Empty or unsupported list content]"}]
+
+def _openai_tool_arguments(part: ToolUsePart) -> str:
+    if isinstance(part.input, str):
+        return part.input
+    if isinstance(part.input, dict):
+        try:
+            # Sorted keys keep the serialized history byte-stable across turns for prompt caching
+            return json.dumps(part.input, sort_keys=True)
+        except TypeError as e:
+            logger.error(f"Could not serialize tool arguments to JSON for tool '{part.name}': {part.input}. Error: {e}")
+            return "{}"
+    logger.warning(f"Tool arguments for tool '{part.name}' are not a dict or string: {part.input}. Using empty JSON object string.")
+    return "{}"
+
+def _openai_assistant_tool_calls(message: Message) -> List[WireMessage]:
+    texts = []
+    tool_calls = []
+    for part in message.parts:
+        if isinstance(part, TextPart):
+            texts.append(part.text)
+        elif isinstance(part, ToolUsePart):
+            if not part.id or not part.name:
+                logger.error(f"Assistant tool_use item missing id or name: {part.source}. Skipping this tool_call.")
+                continue
+            tool_calls.append({
+                "id": part.id,
+                "type": "function",
+                "function": {"name": part.name, "arguments": _openai_tool_arguments(part)},
+            })
+    text = " ".join(filter(None, texts)).strip()
+    if tool_calls:
+        return [WireMessage(role="assistant", tool_calls=tool_calls, content=text or None)]
+    if text:
+        return [WireMessage(role="assistant", content=text)]
+    logger.error(f"Assistant message contained tool_use parts that could not be formatted: {message.source}")
+    return [WireMessage(role="assistant", content="[Internal error: Failed to process tool calls for assistant message.]")]
+
+def _openai_assistant_text(message: Message) -> List[WireMessage]:
+    content = _openai_content(message)
+    if isinstance(content, list):
+        content = " ".join(filter(None, (part.get("text", "") for part in content if part.get("type") == "text")))
+    elif not isinstance(content, str):
+        return [WireMessage(role="assistant", content=f"[Unparseable assistant content: {str(content)[:100]}]")]
+    text = content.strip()
+    return [WireMessage(role="assistant", content=text)] if text else []
+
+def _openai_user(message: Message, resolve: bool = False) -> List[WireMessage]:
+    content = _openai_content(message, resolve)
+    if isinstance(content, str):
+        return [WireMessage(role="user", content=content)]
+    if not isinstance(content, list):
+        return []
+    parts = [part for part in content if part.get("type") != "image_url" or (isinstance(part.get("image_url"), dict) and "url" in part["image_url"])]
+    if len(parts) < len(content):
+        logger.warning(f"Skipped malformed image_url parts in user message: {message.source}")
+    return [WireMessage(role="user", content=parts)] if parts else []
+
+def _openai_tool_results(message: Message, after_tool_request: bool) -> List[WireMessage]:
+    results = [part for part in message.parts if isinstance(part, ToolResultPart)]
+    if not after_tool_request:
+        # A tool result without the assistant tool call before it is rejected by OpenAI; keep it as text
+        summary_parts = []
+        for part in results:
+            tool_name = part.name if part.name is not None else "[unknown_tool]"
+            tool_output_summary = str(part.source.get("content", "[no_result]"))[:100]
+            summary_parts.append(f"[User-provided tool result for '{tool_name}' (output: {tool_output_summary}...) was removed due to invalid sequence for OpenAI.]")
+        return [WireMessage(role="user", content=" ".join(summary_parts))]
+    tool_messages = []
+    for part in results:
+        if not part.tool_use_id:
+            logger.error(f"Tool result item missing 'tool_use_id': {part.source}. Skipping this result.")
+            continue
+        tool_messages.append(WireMessage(role="tool", tool_call_id=part.tool_use_id, content=str(part.content) if part.content is not None else ""))
+    return tool_messages
+
+def encode_openai(message: Message, state: OpenAIState) -> Tuple[List[WireMessage], OpenAIState]:
+    """
+    Chat Completions form. Assistant tool_use blocks become tool_calls and the user message with
+    their results becomes one role 'tool' message per result. Tool results not preceded by a
+    tool call, and role 'tool' messages out of sequence, are turned into user text, since OpenAI
+    rejects them. System messages are left out: the provider sends the system prompt itself.
+
+    Returns (messages to send, state after this message).
+    """
+    last_was_assistant_tool_request, last_role = state
+    role = message.role
+
+    if role == "assistant":
+        if not message.single and any(isinstance(part, ToolUsePart) for part in message.parts):
+            return _openai_assistant_tool_calls(message), (True, "assistant")
+        return _openai_assistant_text(message), (False, "assistant")
+
+    if role == "user":
+        if not message.single and message.parts and isinstance(message.parts[0], ToolResultPart):
+            return _openai_tool_results(message, last_was_assistant_tool_request), (False, "user")
+        encoded = _openai_user(message)
+        if encoded and _has_blob_images(message):
+            encoded = [_lazy(encoded[0], lambda: _openai_user(message, resolve=True)[0])]
+        return encoded, (False, "user")
+
+    if role == "tool":
+        raw_content = message.source.get("content")
+        if last_role == "assistant":
+            if not message.tool_call_id:
+                logger.error(f"Message with role 'tool' is missing 'tool_call_id': {message.source}. Skipping.")
+                return [], (False, "tool")
+            return [WireMessage(role="tool", tool_call_id=message.tool_call_id, content=str(raw_content))], (False, "tool")
+        summary = (f"[Standalone 'role:tool' message (tool_call_id: {message.tool_call_id}, content: {str(raw_content)[:100]}) "
+                   f"converted to user text due to missing preceding assistant tool_call.]")
+        return [WireMessage(role="user", content=summary)], (False, "user")
+
+    return [], (False, role)
+
+def encode_message(message: Dict[str, Any], provider: str, state: OpenAIState = OPENAI_INITIAL_STATE) -> Tuple[List[WireMessage], OpenAIState]:
+    """
+    Parse one stored message and encode it for `provider`. Returns (wire messages, OpenAI state
+    after this message); messages that cannot be parsed are skipped with a warning.
+    """
+    try:
+        parsed = parse_message(message)
+        if parsed is None:
+            return [], state
+        if provider == 'openai':
+            return encode_openai(parsed, state)
+        if provider == 'claude':
+            return encode_claude(parsed), state
+        return encode_gemini(parsed), state
+    except Exception as e:
+        logger.warning(f"Could not encode message with role {message.get('role')} for {provider}: {e}. Skipping message.")
+        return [], state
+
+def to_wire(messages: Sequence[Any], provider: str) -> List[Dict[str, Any]]:
+    """
+    The request messages for `provider`: WireMessages (from context_sanitizer.sanitize_history)
+    as they are, with blob images resolved, and anything else encoded on the way, so callers
+    may pass stored messages directly.
+    """
+    wire = []
+    state = OPENAI_INITIAL_STATE
+    for message in messages:
+        if isinstance(message, WireMessage):
+            wire.append(message.resolve() if isinstance(message, LazyWireMessage) else message)
+            state = ('tool_calls' in message, message.get('role'))
+        elif isinstance(message, dict):
+            encoded, state = encode_message(message, provider, state)
+            wire.extend(item.resolve() if isinstance(item, LazyWireMessage) else item for item in encoded)
+    return wire
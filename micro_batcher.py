@@ -0,0 +1,90 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+class MicroBatcher:
+    """
+    Coalesces concurrent calls into batches for a function that is cheaper per item in bulk,
+    such as a model forward pass.
+
+    Callers submit one item and block on a Future. A single worker thread takes the first
+    queued item, keeps collecting until it has max_batch_size items or max_wait_seconds have
+    passed, runs `run_batch` on the whole list and hands each caller its own result (or the
+    batch's exception). Only the worker runs the model, so concurrent requests no longer
+    compete for the same intra-op threads; under load a caller waits at most max_wait_seconds
+    plus one batch.
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], List[Any]], max_batch_size: int = 8,
+                 max_wait_seconds: float = 0.005, name: str = "micro-batcher"):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_seconds = max_wait_seconds
+        self.name = name
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+    def submit(self, item: Any) -> Future:
+        """Queue item for the next batch; the Future resolves to its result."""
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._worker.start()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item: Any, timeout: float = None) -> Any:
+        return self.submit(item).result(timeout)
+
+    def _collect(self) -> List[tuple]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = self.run_batch(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: batch of {len(items)} items returned {len(results)} results")
+            except Exception as e:
+                logger.exception(f"{self.name}: batch of {len(items)} items failed")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+            with self._stats_lock:
+                self.batches += 1
+                self.items += len(items)
+                self.largest_batch = max(self.largest_batch, len(items))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "average_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "queued": self._queue.qsize()
+            }
@@ -1,6 +1,15 @@
+import hashlib
 import requests
 import logging
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import List
+
+from config import Config
+from micro_batcher import MicroBatcher
 
 print("--- neuroswitch_classifier.py: Module Execution START ---")
 
@@ -81,34 +90,196 @@ LABEL_PROVIDER_MAP = {
 DEFAULT_PROVIDER = "claude"  # Fallback provider if NeuroSwitch fails or input is empty
 
 # --- Pipeline Initialization ---
-classifier_pipeline = None # Explicitly None initially
+# The pipeline is not built at import: importing transformers and loading BART takes from seconds to
+# minutes (longer when the weights must be downloaded), and the web workers import this module at
+# startup. start_warmup() loads it in a background thread (app.py calls it per Config.NEUROSWITCH_WARMUP),
+# and until it is ready get_neuroswitch_provider() routes to Config.NEUROSWITCH_FALLBACK_PROVIDER.
+classifier_pipeline = None # Set once the warm-up has finished
 MODEL_NAME = "facebook/bart-large-mnli"
 
-print(f"--- neuroswitch_classifier.py: Attempting to initialize pipeline for {MODEL_NAME} ---")
-try:
-    print("--- neuroswitch_classifier.py: Importing transformers... ---")
-    from transformers import pipeline
-    from transformers.pipelines import ZeroShotClassificationPipeline # Import here
-    print("--- neuroswitch_classifier.py: Transformers imported. Creating pipeline... ---")
-    
-    # Ensure pipeline type hint matches the imported class
-    classifier_pipeline: ZeroShotClassificationPipeline | None = None 
+CLASSIFIER_NOT_LOADED = "not_loaded"
+CLASSIFIER_LOADING = "loading"
+CLASSIFIER_READY = "ready"
+CLASSIFIER_FAILED = "failed"
+
+classifier_state = CLASSIFIER_NOT_LOADED
+classifier_batcher = None # MicroBatcher over _classify_batch once loaded, if Config.NEUROSWITCH_BATCH_MAX_SIZE > 1
+classifier_error = None # Why loading failed, if it did
+classifier_load_seconds = None
+_classifier_state_lock = threading.Lock()
+_classifier_loaded = threading.Event() # Set when loading has finished, successfully or not
 
+def classifier_model_name() -> str:
+    """The model behind the configured engine."""
+    if Config.NEUROSWITCH_ENGINE == 'embedding':
+        return Config.NEUROSWITCH_EMBEDDING_MODEL
+    return MODEL_NAME
+
+def _build_pipeline():
+    """
+    Builds the classifier for Config.NEUROSWITCH_ENGINE: the transformers zero-shot pipeline, an
+    embedding_router.EmbeddingRouter or an int8 onnx_classifier.OnnxZeroShotClassifier of the same
+    model. All three are called the same way and return the same result.
+    """
+    if Config.NEUROSWITCH_ENGINE == 'embedding':
+        from embedding_router import create_embedding_router
+        logging.info(f"(Log) Initializing NeuroSwitch embedding router with model: {Config.NEUROSWITCH_EMBEDDING_MODEL}...")
+        return create_embedding_router(CANDIDATE_LABELS)
+    if Config.NEUROSWITCH_ENGINE == 'onnx':
+        from embedding_router import LABEL_EXAMPLES
+        from onnx_classifier import create_onnx_classifier
+        # The label examples double as the parity set the int8 export is checked against
+        parity_texts = [example for examples in LABEL_EXAMPLES.values() for example in examples]
+        return create_onnx_classifier(MODEL_NAME, CANDIDATE_LABELS, parity_texts, LABEL_PROVIDER_MAP)
+    if Config.NEUROSWITCH_ENGINE != 'zero-shot':
+        raise ValueError(f"Unknown NEUROSWITCH_ENGINE '{Config.NEUROSWITCH_ENGINE}'. Expected 'zero-shot', 'embedding' or 'onnx'.")
+    from transformers import pipeline
     logging.info(f"(Log) Initializing local zero-shot pipeline with model: {MODEL_NAME}...")
-    classifier_pipeline = pipeline("zero-shot-classification", model=MODEL_NAME, use_auth_token=False, token=None)
-    print("--- neuroswitch_classifier.py: Pipeline CREATED successfully! ---")
-    logging.info(f"(Log) Local zero-shot pipeline initialized successfully.")
+    return pipeline("zero-shot-classification", model=MODEL_NAME, token=None)
+
+def _classify_batch(texts: List[str]) -> List[dict]:
+    """
+    Classify several texts in one call. The zero-shot pipeline batches all (text, label) pairs
+    into one forward pass; the embedding router encodes all texts in one pass.
+    """
+    results = classifier_pipeline(texts, CANDIDATE_LABELS, multi_label=False, batch_size=len(texts) * len(CANDIDATE_LABELS))
+    return results if isinstance(results, list) else [results]
+
+def _load_classifier_pipeline():
+    """Builds the classifier and records the outcome. Runs once, normally in the warm-up thread."""
+    global classifier_pipeline, classifier_batcher, classifier_state, classifier_error, classifier_load_seconds
+    started = time.perf_counter()
+    try:
+        loaded_pipeline = _build_pipeline()
+    except ImportError as e:
+        logging.error(f"Failed to initialize pipeline: Missing libraries (transformers/torch/tensorflow?). Error: {e}")
+        classifier_error = f"Missing libraries: {e}"
+        classifier_state = CLASSIFIER_FAILED
+    except Exception as e:
+        logging.exception(f"Failed to initialize local zero-shot pipeline: {e}")
+        classifier_error = str(e)
+        classifier_state = CLASSIFIER_FAILED
+    else:
+        classifier_pipeline = loaded_pipeline
+        if Config.NEUROSWITCH_BATCH_MAX_SIZE > 1:
+            classifier_batcher = MicroBatcher(_classify_batch, max_batch_size=Config.NEUROSWITCH_BATCH_MAX_SIZE,
+                                              max_wait_seconds=Config.NEUROSWITCH_BATCH_MAX_WAIT_MS / 1000,
+                                              name="neuroswitch-batcher")
+        routing_cache.clear()
+        classifier_state = CLASSIFIER_READY
+        logging.info(f"(Log) NeuroSwitch classifier ({Config.NEUROSWITCH_ENGINE}, {classifier_model_name()}) initialized successfully in {time.perf_counter() - started:.1f}s.")
+    finally:
+        classifier_load_seconds = time.perf_counter() - started
+        _classifier_loaded.set()
+
+def start_warmup(background: bool = True) -> str:
+    """
+    Starts loading the classifier unless that has already been started, and returns its state.
+    With background=False the model is loaded before this returns (the old import-time behaviour).
+    """
+    global classifier_state
+    with _classifier_state_lock:
+        if classifier_state != CLASSIFIER_NOT_LOADED:
+            return classifier_state
+        classifier_state = CLASSIFIER_LOADING
+    if background:
+        threading.Thread(target=_load_classifier_pipeline, name="neuroswitch-warmup", daemon=True).start()
+    else:
+        _load_classifier_pipeline()
+    return classifier_state
+
+def wait_until_ready(timeout: float = None) -> bool:
+    """Blocks until loading has finished (or timeout seconds) and returns whether the classifier is ready."""
+    _classifier_loaded.wait(timeout)
+    return classifier_state == CLASSIFIER_READY
+
+def classifier_status() -> dict:
+    """Readiness of the classifier: its state, model, load time and, if loading failed, why."""
+    return {
+        "state": classifier_state,
+        "engine": Config.NEUROSWITCH_ENGINE,
+        "model": classifier_model_name(),
+        "load_seconds": round(classifier_load_seconds, 2) if classifier_load_seconds is not None else None,
+        "error": classifier_error,
+        "route_cache": routing_cache.stats(),
+        "batching": classifier_batcher.stats() if classifier_batcher is not None else None
+    }
+
+class RoutingDecisionCache:
+    """
+    Thread-safe LRU of classification results keyed by a hash of the normalized input text
+    (lowercased, whitespace collapsed, truncated to key_chars), with an optional TTL.
+
+    Much of the routed traffic repeats: suggestion cards, "Image uploaded" for bare images,
+    retried API calls and common one-liners. Their decisions are served from here without
+    running the model. Only successful classifications are stored.
+    """
 
-except ImportError as e:
-    print(f"--- neuroswitch_classifier.py: ERROR during import: {e} ---") # Print error
-    logging.error(f"Failed to initialize pipeline: Missing libraries (transformers/torch/tensorflow?). Error: {e}")
-    classifier_pipeline = None
-except Exception as e:
-    print(f"--- neuroswitch_classifier.py: ERROR during pipeline creation: {e} ---") # Print error
-    logging.exception(f"Failed to initialize local zero-shot pipeline: {e}")
-    classifier_pipeline = None
+    def __init__(self, max_entries: int, ttl_seconds: float = 0, key_chars: int = 2000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.key_chars = key_chars
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (stored_at, status)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-print("--- neuroswitch_classifier.py: End of initialization block ---")
+    def key(self, text: str) -> str:
+        normalized = " ".join(text.lower().split())[:self.key_chars]
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def get(self, text: str):
+        """A copy of the cached status for text, or None."""
+        if self.max_entries <= 0:
+            return None
+        key = self.key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds > 0 and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        status = entry[1]
+        return dict(status, provider_scores=dict(status["provider_scores"]))
+
+    def put(self, text: str, status: dict):
+        if self.max_entries <= 0:
+            return
+        key = self.key(text)
+        stored = dict(status, provider_scores=dict(status["provider_scores"]))
+        with self._lock:
+            self._entries[key] = (time.monotonic(), stored)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+# Shared by all requests in this process; cleared whenever a classifier finishes loading
+routing_cache = RoutingDecisionCache(
+    max_entries=Config.NEUROSWITCH_ROUTE_CACHE_MAX_ENTRIES,
+    ttl_seconds=Config.NEUROSWITCH_ROUTE_CACHE_TTL_SECONDS,
+    key_chars=Config.NEUROSWITCH_ROUTE_CACHE_KEY_CHARS
+)
 
 def get_neuroswitch_provider(text_input: str) -> dict:
     """
@@ -123,18 +294,30 @@ def get_neuroswitch_provider(text_input: str) -> dict:
             "provider": The name of the selected AI provider.
             "neuroswitch_active": Boolean indicating if classification was successful.
             "fallback_reason": String explaining why fallback occurred, if any.
+            "provider_scores": Classifier probability mass per provider (summed over its labels);
+                               empty if classification did not run.
     """
     status = {
         "provider": DEFAULT_PROVIDER,
         "neuroswitch_active": False,  # Assume inactive unless classification succeeds
-        "fallback_reason": None
+        "fallback_reason": None,
+        "provider_scores": {}
     }
 
-    # Check if pipeline failed to load
-    if classifier_pipeline is None:
-        reason = f"Local classifier pipeline ({MODEL_NAME}) failed to initialize."
-        # Keep warning for actual issues
-        logging.warning(f"NeuroSwitch disabled: {reason}. Request routed to default: {DEFAULT_PROVIDER}") 
+    # Never block a request on loading the model (beyond Config.NEUROSWITCH_LOAD_WAIT_SECONDS):
+    # until it is ready, requests take the fallback route. The first request starts a lazy load.
+    if classifier_state != CLASSIFIER_READY:
+        if start_warmup() == CLASSIFIER_LOADING and Config.NEUROSWITCH_LOAD_WAIT_SECONDS > 0:
+            wait_until_ready(Config.NEUROSWITCH_LOAD_WAIT_SECONDS)
+    if classifier_state != CLASSIFIER_READY:
+        if classifier_state == CLASSIFIER_FAILED:
+            reason = f"Local classifier pipeline ({classifier_model_name()}) failed to initialize: {classifier_error}"
+            # Keep warning for actual issues
+            logging.warning(f"NeuroSwitch disabled: {reason}. Request routed to fallback: {Config.NEUROSWITCH_FALLBACK_PROVIDER}")
+        else:
+            reason = f"Local classifier pipeline ({classifier_model_name()}) is still loading."
+            logging.info(f"NeuroSwitch not ready: {reason} Request routed to fallback: {Config.NEUROSWITCH_FALLBACK_PROVIDER}")
+        status["provider"] = Config.NEUROSWITCH_FALLBACK_PROVIDER
         status["fallback_reason"] = reason
         return status
 
@@ -144,14 +327,23 @@ def get_neuroswitch_provider(text_input: str) -> dict:
         # logging.info("NeuroSwitch received empty input, using default provider.") # Replaced
         status["neuroswitch_active"] = False
         return status
-    
+
+    cached_status = routing_cache.get(text_input)
+    if cached_status is not None:
+        logging.info(f"NeuroSwitch: Routing decision cache hit, provider '{cached_status['provider']}'.")
+        return cached_status
+
     # Use print for this info level message
     print(f"--- NeuroSwitch: Classifying locally: '{text_input[:100]}...' ---") 
     # logging.info(f"NeuroSwitch classifying locally: '{text_input[:100]}...'") # Replaced
     classified_label = "unknown"
 
     try:
-        result = classifier_pipeline(text_input, CANDIDATE_LABELS, multi_label=False)
+        if classifier_batcher is not None:
+            # Concurrent requests are coalesced into one batched forward pass; a stuck batch must not hold the request
+            result = classifier_batcher(text_input, timeout=Config.NEUROSWITCH_BATCH_TIMEOUT_SECONDS)
+        else:
+            result = classifier_pipeline(text_input, CANDIDATE_LABELS, multi_label=False)
         
         # Use print for the detailed raw output
         print(f"--- NeuroSwitch: RAW classification result object: {result} ---") 
@@ -161,6 +353,9 @@ def get_neuroswitch_provider(text_input: str) -> dict:
             classified_label = result['labels'][0]
             top_score = result['scores'][0]
             status["neuroswitch_active"] = True
+            for label, score in zip(result['labels'], result['scores']):
+                label_provider = LABEL_PROVIDER_MAP.get(label, DEFAULT_PROVIDER)
+                status["provider_scores"][label_provider] = status["provider_scores"].get(label_provider, 0.0) + score
             # Use print for the top pick info
             print(f"--- NeuroSwitch: Local classification TOP PICK: Label='{classified_label}', Score={top_score:.4f} ---") 
             # logging.info(f"Local classification TOP PICK: Label='{classified_label}', Score={top_score:.4f}") # Replaced
@@ -174,6 +369,14 @@ def get_neuroswitch_provider(text_input: str) -> dict:
         # Use print for routing info
         print(f"--- NeuroSwitch: Routing to provider: '{selected_provider}' based on label '{classified_label}' ---") 
         # logging.info(f"NeuroSwitch routing to provider: '{selected_provider}' based on label '{classified_label}'") # Replaced
+        if status["neuroswitch_active"]:
+            routing_cache.put(text_input, status)
+
+    except FutureTimeoutError:
+        reason = f"Local classification timed out after {Config.NEUROSWITCH_BATCH_TIMEOUT_SECONDS}s."
+        logging.warning(f"NeuroSwitch: {reason} Request routed to default provider: {DEFAULT_PROVIDER}")
+        status["fallback_reason"] = reason
+        status["provider"] = DEFAULT_PROVIDER
 
     except Exception as e:
         # Keep exception logging
@@ -182,4 +385,39 @@ def get_neuroswitch_provider(text_input: str) -> dict:
         status["fallback_reason"] = reason
         status["provider"] = DEFAULT_PROVIDER
 
-    return status 
\ No newline at end of file
+    return status
+
+def apply_session_affinity(status: dict, session_provider: str, history_length: int) -> dict:
+    """
+    Keeps a conversation on the provider that answered its previous turn.
+
+    Switching providers mid-conversation discards the provider-side prompt cache and makes the
+    whole history be re-sanitized into another format, so the classifier's pick only replaces
+    the session's provider when its provider score beats the session provider's score by at
+    least Config.NEUROSWITCH_AFFINITY_MARGIN. Sessions shorter than
+    Config.NEUROSWITCH_AFFINITY_MIN_MESSAGES messages have little cached context to lose and
+    follow the classifier.
+
+    Args:
+        status: The dictionary returned by get_neuroswitch_provider().
+        session_provider: The provider of the session's previous turn, if any.
+        history_length: Number of messages in the session's history.
+
+    Returns:
+        A copy of status with "provider" possibly replaced and "affinity_override" set to True
+        if the session's provider was kept against the classifier's choice.
+    """
+    routed = dict(status, affinity_override=False)
+    if (not Config.NEUROSWITCH_AFFINITY_ENABLED or not status.get("neuroswitch_active") or not session_provider
+            or session_provider == status["provider"] or session_provider not in LABEL_PROVIDER_MAP.values()
+            or history_length < Config.NEUROSWITCH_AFFINITY_MIN_MESSAGES):
+        return routed
+
+    scores = status.get("provider_scores") or {}
+    advantage = scores.get(status["provider"], 0.0) - scores.get(session_provider, 0.0)
+    if advantage < Config.NEUROSWITCH_AFFINITY_MARGIN:
+        logging.info(f"NeuroSwitch affinity: staying on '{session_provider}' instead of '{status['provider']}' "
+                     f"(score advantage {advantage:.3f} < margin {Config.NEUROSWITCH_AFFINITY_MARGIN}).")
+        routed["provider"] = session_provider
+        routed["affinity_override"] = True
+    return routed
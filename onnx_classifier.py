@@ -0,0 +1,264 @@
+import contextlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from config import Config
+
+try:
+    import onnxruntime
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+try:
+    import fcntl
+except ImportError:  # Windows: exports are not serialized across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+HYPOTHESIS_TEMPLATE = "This example is {}."  # The transformers zero-shot pipeline's default
+QUANTIZED_MODEL_FILE = "model.int8.onnx"
+METADATA_FILE = "fusion_export.json"
+EXPORT_FORMAT_VERSION = 1  # Bump when export_quantized_model changes, so cached exports are redone
+
+def _softmax(logits: np.ndarray, axis: int = -1) -> np.ndarray:
+    shifted = np.exp(logits - logits.max(axis=axis, keepdims=True))
+    return shifted / shifted.sum(axis=axis, keepdims=True)
+
+def entailment_id_for(label2id: Dict[str, int]) -> int:
+    """Index of the NLI model's entailment logit, found the same way the transformers pipeline does."""
+    for label, index in label2id.items():
+        if label.lower().startswith("entail"):
+            return int(index)
+    return -1
+
+class OnnxZeroShotClassifier:
+    """
+    Zero-shot classification with an NLI model running in ONNX Runtime.
+
+    Each (text, label) pair is scored as premise/hypothesis ("This example is {label}.") and the
+    entailment logits are turned into label scores exactly as the transformers
+    ZeroShotClassificationPipeline does, so calls and results are interchangeable with it
+    (and with embedding_router.EmbeddingRouter) behind get_neuroswitch_provider.
+    """
+
+    def __init__(self, session, tokenizer, entailment_id: int, hypothesis_template: str = HYPOTHESIS_TEMPLATE,
+                 max_length: int = 512):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.entailment_id = entailment_id
+        self.contradiction_id = -1 if entailment_id == 0 else 0
+        self.hypothesis_template = hypothesis_template
+        self.max_length = max_length
+        self._input_names = [model_input.name for model_input in session.get_inputs()]
+
+    def _logits(self, premises: List[str], hypotheses: List[str]) -> np.ndarray:
+        encoded = self.tokenizer(premises, hypotheses, padding=True, truncation="only_first",
+                                 max_length=self.max_length, return_tensors="np")
+        feed = {name: np.asarray(encoded[name], dtype=np.int64) for name in self._input_names}
+        return self.session.run(None, feed)[0]
+
+    def __call__(self, texts: Union[str, List[str]], candidate_labels: Sequence[str], multi_label: bool = False,
+                 batch_size: int = None) -> Union[dict, List[dict]]:
+        """Classify a text or a list of texts; batch_size is the number of (text, label) pairs per forward pass."""
+        batch = [texts] if isinstance(texts, str) else list(texts)
+        labels = list(candidate_labels)
+        premises = [text for text in batch for _ in labels]
+        hypotheses = [self.hypothesis_template.format(label) for _ in batch for label in labels]
+        step = batch_size or len(premises)
+        logits = np.concatenate([self._logits(premises[start:start + step], hypotheses[start:start + step])
+                                 for start in range(0, len(premises), step)])
+        logits = logits.reshape(len(batch), len(labels), -1)
+
+        if multi_label or len(labels) == 1:
+            # Each label on its own: entailment against contradiction
+            scores = _softmax(logits[..., [self.contradiction_id, self.entailment_id]])[..., 1]
+        else:
+            # Labels compete: softmax over their entailment logits
+            scores = _softmax(logits[..., self.entailment_id])
+
+        results = []
+        for text, text_scores in zip(batch, scores):
+            order = np.argsort(-text_scores, kind="stable")
+            results.append({"sequence": text, "labels": [labels[i] for i in order],
+                            "scores": [float(text_scores[i]) for i in order]})
+        return results[0] if isinstance(texts, str) else results
+
+def parity_check(reference: Callable, candidate: Callable, texts: List[str], labels: Sequence[str],
+                 label_provider_map: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Compares two zero-shot classifiers on texts: the share of texts with the same top label
+    (and, given label_provider_map, routed to the same provider), the largest difference in
+    any label's score, and the texts whose top label differs.
+    """
+    reference_results = reference(list(texts), list(labels), multi_label=False)
+    candidate_results = candidate(list(texts), list(labels), multi_label=False)
+    same_label = same_provider = 0
+    max_score_diff = 0.0
+    disagreements = []
+    for text, expected, actual in zip(texts, reference_results, candidate_results):
+        expected_scores = dict(zip(expected["labels"], expected["scores"]))
+        actual_scores = dict(zip(actual["labels"], actual["scores"]))
+        max_score_diff = max(max_score_diff, max(abs(expected_scores[label] - actual_scores.get(label, 0.0)) for label in expected_scores))
+        if expected["labels"][0] == actual["labels"][0]:
+            same_label += 1
+        else:
+            disagreements.append({"text": text, "reference": expected["labels"][0], "candidate": actual["labels"][0]})
+        if label_provider_map is not None and label_provider_map.get(expected["labels"][0]) == label_provider_map.get(actual["labels"][0]):
+            same_provider += 1
+    report = {
+        "texts": len(texts),
+        "label_agreement": round(same_label / len(texts), 4) if texts else 1.0,
+        "max_score_diff": round(max_score_diff, 4),
+        "disagreements": disagreements
+    }
+    if label_provider_map is not None:
+        report["provider_agreement"] = round(same_provider / len(texts), 4) if texts else 1.0
+    return report
+
+def artifact_dir(model_name: str) -> str:
+    """Where the quantized export of model_name is cached."""
+    return os.path.join(Config.NEUROSWITCH_CACHE_DIR, "onnx", re.sub(r"[^A-Za-z0-9_.-]+", "--", model_name))
+
+def _read_metadata(directory: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(directory, METADATA_FILE)) as metadata_file:
+            return json.load(metadata_file)
+    except (OSError, ValueError):
+        return None
+
+def _valid_export(directory: str, model_name: str) -> Optional[Dict[str, Any]]:
+    """The metadata of a complete, current export of model_name in directory, else None."""
+    metadata = _read_metadata(directory)
+    if metadata is None or metadata.get("format_version") != EXPORT_FORMAT_VERSION or metadata.get("model") != model_name:
+        return None
+    return metadata if os.path.exists(os.path.join(directory, QUANTIZED_MODEL_FILE)) else None
+
+@contextlib.contextmanager
+def _export_lock(directory: str):
+    """Serializes exports to directory across threads and worker processes (an advisory file lock)."""
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    with open(directory + ".lock", "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield  # Closing the file releases the lock
+
+def _publish_export(staging: str, directory: str, model_name: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Moves a finished export from staging to directory and returns the metadata of the export in
+    place. A complete, current export already there is kept and staging is deleted; only a
+    stale or incomplete one is replaced.
+    """
+    existing = _valid_export(directory, model_name)
+    if existing is not None:
+        logger.info(f"{model_name} was already exported to {directory}; using that export.")
+        shutil.rmtree(staging, ignore_errors=True)
+        return existing
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(staging, directory)
+    return metadata
+
+def open_quantized_model(directory: str, metadata: Dict[str, Any]) -> OnnxZeroShotClassifier:
+    """An OnnxZeroShotClassifier over an exported model, with Config's ONNX Runtime thread counts."""
+    from transformers import AutoTokenizer
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if Config.NEUROSWITCH_ONNX_INTRA_OP_THREADS > 0:
+        options.intra_op_num_threads = Config.NEUROSWITCH_ONNX_INTRA_OP_THREADS
+    if Config.NEUROSWITCH_ONNX_INTER_OP_THREADS > 0:
+        options.inter_op_num_threads = Config.NEUROSWITCH_ONNX_INTER_OP_THREADS
+    session = onnxruntime.InferenceSession(os.path.join(directory, QUANTIZED_MODEL_FILE), sess_options=options,
+                                           providers=["CPUExecutionProvider"])
+    return OnnxZeroShotClassifier(session, AutoTokenizer.from_pretrained(directory), metadata["entailment_id"])
+
+def export_quantized_model(model_name: str, directory: str, parity_texts: List[str], labels: Sequence[str],
+                           label_provider_map: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Exports model_name to ONNX, quantizes its weights to int8 (dynamic quantization) and saves
+    it with its tokenizer in directory. Needs torch, transformers and onnxruntime (with onnx),
+    but only here: serving the export needs onnxruntime and the tokenizer alone.
+
+    Before the export is put in place, the int8 model is compared with the PyTorch pipeline on
+    parity_texts; the report is stored in the export's metadata and a warning is logged when
+    fewer than Config.NEUROSWITCH_ONNX_MIN_AGREEMENT of the texts get the same top label.
+    A complete, current export already in directory is kept; create_onnx_classifier holds
+    _export_lock so concurrent workers export only once.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
+
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=parent, prefix=".export-")
+    try:
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        model.eval()
+        sample = tokenizer(["A sample premise."], [HYPOTHESIS_TEMPLATE.format("sample")], return_tensors="pt")
+        full_precision_path = os.path.join(staging, "model.onnx")
+        with torch.no_grad():
+            torch.onnx.export(
+                model, (sample["input_ids"], sample["attention_mask"]), full_precision_path,
+                input_names=["input_ids", "attention_mask"], output_names=["logits"],
+                dynamic_axes={"input_ids": {0: "batch", 1: "sequence"}, "attention_mask": {0: "batch", 1: "sequence"},
+                              "logits": {0: "batch"}},
+                opset_version=17, do_constant_folding=True
+            )
+        quantize_dynamic(full_precision_path, os.path.join(staging, QUANTIZED_MODEL_FILE), weight_type=QuantType.QInt8)
+        os.remove(full_precision_path)
+        tokenizer.save_pretrained(staging)
+
+        metadata = {
+            "model": model_name,
+            "format_version": EXPORT_FORMAT_VERSION,
+            "entailment_id": entailment_id_for(model.config.label2id)
+        }
+        reference = pipeline("zero-shot-classification", model=model, tokenizer=tokenizer)
+        metadata["parity"] = parity_check(reference, open_quantized_model(staging, metadata), parity_texts, labels, label_provider_map)
+        with open(os.path.join(staging, METADATA_FILE), "w") as metadata_file:
+            json.dump(metadata, metadata_file, indent=2)
+        return _publish_export(staging, directory, model_name, metadata)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+def create_onnx_classifier(model_name: str, labels: Sequence[str], parity_texts: List[str],
+                           label_provider_map: Optional[Dict[str, str]] = None) -> OnnxZeroShotClassifier:
+    """
+    The int8 ONNX Runtime classifier for model_name, exported on first use and cached under
+    Config.NEUROSWITCH_CACHE_DIR. Raises ImportError when onnxruntime (or, for the one-off
+    export, torch or transformers) is not installed.
+    """
+    if not ONNXRUNTIME_AVAILABLE:
+        raise ImportError("onnxruntime is required for NEUROSWITCH_ENGINE=onnx. Install it with: pip install onnxruntime onnx")
+    directory = artifact_dir(model_name)
+    metadata = _valid_export(directory, model_name)
+    if metadata is None:
+        with _export_lock(directory):
+            # Another worker may have finished the export while this one waited for the lock
+            metadata = _valid_export(directory, model_name)
+            if metadata is None:
+                logger.info(f"Exporting {model_name} to int8 ONNX in {directory}. This happens once and needs torch.")
+                metadata = export_quantized_model(model_name, directory, parity_texts, labels, label_provider_map)
+
+    parity = metadata.get("parity") or {}
+    agreement = parity.get("label_agreement")
+    if agreement is not None:
+        message = (f"int8 ONNX {model_name} matched the PyTorch top label on {agreement:.1%} of {parity.get('texts')} "
+                   f"parity texts (max score difference {parity.get('max_score_diff')}).")
+        if agreement < Config.NEUROSWITCH_ONNX_MIN_AGREEMENT:
+            logger.warning(f"{message} Below NEUROSWITCH_ONNX_MIN_AGREEMENT={Config.NEUROSWITCH_ONNX_MIN_AGREEMENT}; "
+                           f"consider NEUROSWITCH_ENGINE=zero-shot.")
+        else:
+            logger.info(message)
+    return open_quantized_model(directory, metadata)
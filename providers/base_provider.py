@@ -1,5 +1,6 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
 from config import Config
 
 class BaseProvider(ABC):
@@ -25,4 +26,36 @@ class BaseProvider(ABC):
             A dictionary representing the provider's response, including content and usage data.
             Expected structure might vary slightly but should contain 'content' and 'usage'.
         """
-        pass 
\ No newline at end of file
+        pass
+
+    def stream_chat(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], config: Config) -> Iterator[Dict[str, Any]]:
+        """
+        Stream a response from the AI provider as it is generated.
+
+        Yields event dictionaries:
+            {'type': 'text_delta', 'text': <str>} for each chunk of generated text, then
+            {'type': 'final', 'response': <dict>} exactly once, where 'response' has the
+            same structure as the return value of chat().
+
+        Providers that support native streaming override this. The default falls back
+        to a blocking chat() call and emits the whole text as a single delta.
+        """
+        response = self.chat(messages, tools, config)
+        content = response.get('content')
+        if isinstance(content, list):
+            text = ''.join(part.get('text', '') for part in content if isinstance(part, dict) and part.get('type') == 'text')
+        else:
+            text = str(content or '')
+        if text:
+            yield {'type': 'text_delta', 'text': text}
+        yield {'type': 'final', 'response': response}
+
+    async def achat(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], config: Config) -> Dict[str, Any]:
+        """
+        Async variant of chat() for the ASGI serving path; returns the same dictionary.
+
+        Providers with an async SDK client override this so no thread is held while waiting
+        on the vendor. The default runs the blocking chat() in a worker thread.
+        """
+        return await asyncio.to_thread(self.chat, messages, tools, config)
+
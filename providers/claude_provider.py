@@ -1,11 +1,37 @@
 import anthropic
-from typing import List, Dict, Any
+import asyncio
+from typing import List, Dict, Any, Iterator, Tuple
+import functools
 import logging
 import time
 import json
 
 from .base_provider import BaseProvider
 from config import Config
+import message_model
+
+# Marks the end of a prompt prefix Anthropic should cache (reads cost ~10% of normal input tokens)
+CACHE_BREAKPOINT = {"type": "ephemeral"}
+
+@functools.lru_cache(maxsize=None)
+def _system_prompt_blocks(system_prompt: str, cached: bool) -> Tuple[Dict[str, Any], ...]:
+    """The system parameter as content blocks, built once per prompt text."""
+    block = {"type": "text", "text": system_prompt}
+    if cached:
+        block["cache_control"] = CACHE_BREAKPOINT
+    return (block,)
+
+def _with_cache_breakpoint(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of a message whose last content block carries a cache breakpoint (messages are shared, never modified)."""
+    content = message.get('content')
+    if isinstance(content, str):
+        blocks = [{"type": "text", "text": content}]
+    elif isinstance(content, list) and content and isinstance(content[-1], dict):
+        blocks = list(content)
+    else:
+        return message
+    blocks[-1] = dict(blocks[-1], cache_control=CACHE_BREAKPOINT)
+    return dict(message, content=blocks)
 
 class ClaudeProvider(BaseProvider):
     """Provider implementation for Anthropic's Claude API."""
@@ -13,7 +39,9 @@ class ClaudeProvider(BaseProvider):
     def __init__(self, api_key: str = None, client_model: str = None):
         self.logger = logging.getLogger(__name__)
         self.client = None
+        self.async_client = None # Created on first achat() call; only the ASGI app needs it
         self.client_model = client_model
+        self._api_key = api_key
 
         final_api_key_to_use = api_key # This is the key selected by app.py
 
@@ -37,31 +65,18 @@ class ClaudeProvider(BaseProvider):
     def name(self) -> str:
         return "claude"
 
-    def chat(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], config: Config) -> Dict[str, Any]:
-        """Send chat request to Claude API."""
-        self.logger.debug(f"Sending request to Claude with {len(messages)} messages and {len(tools)} tools.")
-        
-        # TEMPORARY: Remove 'tool_name' from tool_result blocks in user messages
-        # ALSO: Remove any system messages from the messages array as Claude expects system prompts as separate parameter
-        processed_messages = []
-        for msg in messages:
-            # Skip any system messages - Claude handles system prompts separately
-            if msg.get('role') == 'system':
-                continue
-                
-            if msg.get('role') == 'user' and isinstance(msg.get('content'), list):
-                new_content = []
-                for item in msg['content']:
-                    if isinstance(item, dict) and item.get('type') == 'tool_result' and 'tool_name' in item:
-                        filtered_item = {k: v for k, v in item.items() if k != 'tool_name'}
-                        new_content.append(filtered_item)
-                    else:
-                        new_content.append(item)
-                processed_messages.append({'role': msg['role'], 'content': new_content})
-            else:
-                processed_messages.append(msg)
-
-        self.logger.debug(f"ClaudeProvider: History after formatting (sent to API): {json.dumps(processed_messages, indent=2)}")
+    def _build_request_params(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], config: Config) -> Tuple[Dict[str, Any], str]:
+        """Format messages for Claude and assemble the request parameters shared by chat() and stream_chat()."""
+        # Claude takes the system prompt as a separate parameter, so system messages are left out.
+        # Messages from context_sanitizer are already encoded; others are encoded here
+        # (see message_model.encode_claude).
+        processed_messages = message_model.to_wire([msg for msg in messages if msg.get('role') != 'system'], self.name)
+
+        if config.PROMPT_CACHE_ENABLED:
+            processed_messages = self._add_history_cache_breakpoints(processed_messages)
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"ClaudeProvider: History after formatting (sent to API): {json.dumps(processed_messages, indent=2)}")
 
         # ITEM 2: Modified Model Selection Logic
         model_name_to_use = None
@@ -73,81 +88,171 @@ class ClaudeProvider(BaseProvider):
             self.logger.info(f"Using configured/default Claude model: {model_name_to_use}")
         # END ITEM 2
 
-        try:
-            start_time = time.time()
-            
-            # Prepare request parameters
-            request_params = {
-                "model": model_name_to_use,
-                "max_tokens": config.MAX_TOKENS,
-                "temperature": config.DEFAULT_TEMPERATURE,
-                "system": self._get_system_prompt(),
-                "messages": processed_messages
-            }
-            
-            # Only include tools and tool_choice if tools are provided
-            if tools:
-                request_params["tools"] = tools
-                request_params["tool_choice"] = {"type": "auto"}
-            
-            response = self.client.messages.create(**request_params)
-            end_time = time.time()
-            runtime = end_time - start_time
-            self.logger.debug(f"Received response from Claude. Stop reason: {response.stop_reason}")
-            self.logger.debug(f"Claude usage: input_tokens={response.usage.input_tokens}, output_tokens={response.usage.output_tokens}, runtime={runtime}")
-            
-            # Extract text content from Claude's response content blocks
-            content_text = ""
-            if response.content:
-                for block in response.content:
-                    if hasattr(block, 'text'):
-                        content_text += block.text
-                    elif isinstance(block, dict) and 'text' in block:
-                        content_text += block['text']
-            
-            # Convert the response object to a dictionary for consistent return type
-            response_dict = {
-                'content': content_text,  # Use extracted text instead of raw content blocks
-                'usage': {
-                    'input_tokens': response.usage.input_tokens,
-                    'output_tokens': response.usage.output_tokens,
-                    'runtime': runtime
-                },
-                'stop_reason': response.stop_reason,
-                'model_used': model_name_to_use,
-                # Add other relevant fields if needed
-                'id': response.id,
-                'model': response.model,
-                'role': response.role,
-                'stop_sequence': response.stop_sequence,
-                'type': response.type,
-            }
-            return response_dict
-
-        except anthropic.APIConnectionError as e:
+        # Prepare request parameters
+        request_params = {
+            "model": model_name_to_use,
+            "max_tokens": config.MAX_TOKENS,
+            "temperature": config.DEFAULT_TEMPERATURE,
+            "system": list(_system_prompt_blocks(self._get_system_prompt(), config.PROMPT_CACHE_ENABLED)),
+            "messages": processed_messages
+        }
+        
+        # Only include tools and tool_choice if tools are provided
+        if tools:
+            request_params["tools"] = tools
+            request_params["tool_choice"] = {"type": "auto"}
+
+        return request_params, model_name_to_use
+
+    def _add_history_cache_breakpoints(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Put cache breakpoints on the last two user messages. The newest one writes the whole
+        conversation to the cache; the previous one is where last turn's write ended, so this
+        turn reads everything up to it from the cache. Together with the system prompt that is
+        three of the four breakpoints Anthropic allows. Prefixes shorter than the model's
+        minimum cacheable length are simply not cached.
+        """
+        user_indexes = [index for index, msg in enumerate(messages) if msg.get('role') == 'user'][-2:]
+        if not user_indexes:
+            return messages
+        marked = list(messages)
+        for index in user_indexes:
+            marked[index] = _with_cache_breakpoint(messages[index])
+        return marked
+
+    def _response_to_dict(self, response: Any, model_name_to_use: str, runtime: float) -> Dict[str, Any]:
+        """Convert a Claude Message object into the provider-neutral response dictionary."""
+        self.logger.debug(f"Received response from Claude. Stop reason: {response.stop_reason}")
+        # Anthropic reports cached prompt tokens apart from input_tokens; input_tokens below counts all
+        # of them, like the other providers, and the cache_* fields say how many came from the cache
+        cache_read_tokens = getattr(response.usage, 'cache_read_input_tokens', None) or 0
+        cache_write_tokens = getattr(response.usage, 'cache_creation_input_tokens', None) or 0
+        self.logger.debug(f"Claude usage: input_tokens={response.usage.input_tokens}, output_tokens={response.usage.output_tokens}, "
+                          f"cache_read={cache_read_tokens}, cache_write={cache_write_tokens}, runtime={runtime}")
+        
+        # Extract text content from Claude's response content blocks
+        content_text = ""
+        if response.content:
+            for block in response.content:
+                if hasattr(block, 'text'):
+                    content_text += block.text
+                elif isinstance(block, dict) and 'text' in block:
+                    content_text += block['text']
+        
+        # Convert the response object to a dictionary for consistent return type
+        return {
+            'content': content_text,  # Use extracted text instead of raw content blocks
+            'usage': {
+                'input_tokens': response.usage.input_tokens + cache_read_tokens + cache_write_tokens,
+                'output_tokens': response.usage.output_tokens,
+                'cache_read_tokens': cache_read_tokens,
+                'cache_write_tokens': cache_write_tokens,
+                'runtime': runtime
+            },
+            'stop_reason': response.stop_reason,
+            'model_used': model_name_to_use,
+            # Add other relevant fields if needed
+            'id': response.id,
+            'model': response.model,
+            'role': response.role,
+            'stop_sequence': response.stop_sequence,
+            'type': response.type,
+        }
+
+    def _translate_error(self, e: Exception) -> Exception:
+        """Map Anthropic SDK exceptions onto the ConnectionError/RuntimeError types callers expect."""
+        if isinstance(e, anthropic.APIConnectionError):
             self.logger.error(f"Claude APIConnectionError: {e}")
-            raise ConnectionError(f"Failed to connect to Anthropic API: {e}") from e
-        except anthropic.RateLimitError as e:
+            return ConnectionError(f"Failed to connect to Anthropic API: {e}")
+        if isinstance(e, anthropic.RateLimitError):
             self.logger.error(f"Claude RateLimitError: {e}")
-            raise ConnectionError(f"Anthropic API rate limit exceeded: {e}") from e # Or a more specific exception
-        except anthropic.APIStatusError as e:
+            return ConnectionError(f"Anthropic API rate limit exceeded: {e}") # Or a more specific exception
+        if isinstance(e, anthropic.APIStatusError):
             self.logger.error(f"Claude APIStatusError: status={e.status_code}, response={e.response}")
             # Pass the detailed error message back if possible
             error_details = e.response.json().get('error', {})
             error_message = error_details.get('message', str(e))
             error_type = error_details.get('type', 'unknown_error')
             full_error = f"Anthropic API error (Status {e.status_code}, Type: {error_type}): {error_message}"
-            raise ConnectionError(full_error) from e
+            return ConnectionError(full_error)
+        self.logger.exception("An unexpected error occurred during Claude API call")
+        return RuntimeError(f"An unexpected error occurred interacting with Claude: {e}")
+
+    def _client_not_configured_response(self) -> Dict[str, Any]:
+        return {
+            'content': [{'type': 'text', 'text': 'Claude API key not configured. Cannot process request.'}],
+            'usage': {'input_tokens': 0, 'output_tokens': 0, 'runtime': 0.0},
+            'stop_reason': 'error'
+        }
+
+    def chat(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], config: Config) -> Dict[str, Any]:
+        """Send chat request to Claude API."""
+        if not self.client:
+            return self._client_not_configured_response()
+
+        self.logger.debug(f"Sending request to Claude with {len(messages)} messages and {len(tools)} tools.")
+        request_params, model_name_to_use = self._build_request_params(messages, tools, config)
+
+        try:
+            start_time = time.time()
+            response = self.client.messages.create(**request_params)
+            runtime = time.time() - start_time
+            return self._response_to_dict(response, model_name_to_use, runtime)
+        except Exception as e:
+            raise self._translate_error(e) from e
+
+    def stream_chat(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], config: Config) -> Iterator[Dict[str, Any]]:
+        """Stream chat response from Claude API, yielding text deltas as they arrive."""
+        if not self.client:
+            yield {'type': 'final', 'response': self._client_not_configured_response()}
+            return
+
+        self.logger.debug(f"Streaming request to Claude with {len(messages)} messages and {len(tools)} tools.")
+        request_params, model_name_to_use = self._build_request_params(messages, tools, config)
+
+        try:
+            start_time = time.time()
+            with self.client.messages.stream(**request_params) as stream:
+                for text in stream.text_stream:
+                    if text:
+                        yield {'type': 'text_delta', 'text': text}
+                response = stream.get_final_message()
+            runtime = time.time() - start_time
         except Exception as e:
-            self.logger.exception("An unexpected error occurred during Claude API call")
-            raise RuntimeError(f"An unexpected error occurred interacting with Claude: {e}") from e
+            raise self._translate_error(e) from e
+
+        yield {'type': 'final', 'response': self._response_to_dict(response, model_name_to_use, runtime)}
+
+    async def achat(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], config: Config) -> Dict[str, Any]:
+        """Send chat request to Claude API without blocking the event loop."""
+        if not self.client:
+            return self._client_not_configured_response()
+
+        self.logger.debug(f"Sending async request to Claude with {len(messages)} messages and {len(tools)} tools.")
+        # Formatting loads and resizes blob images; keep it off the event loop
+        request_params, model_name_to_use = await asyncio.to_thread(self._build_request_params, messages, tools, config)
+
+        if self.async_client is None:
+            self.async_client = anthropic.AsyncAnthropic(api_key=self._api_key)
+
+        try:
+            start_time = time.time()
+            response = await self.async_client.messages.create(**request_params)
+            runtime = time.time() - start_time
+            return self._response_to_dict(response, model_name_to_use, runtime)
+        except Exception as e:
+            raise self._translate_error(e) from e
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1)
+    def _load_system_prompt() -> str:
+        from prompts.system_prompts import SystemPrompts
+        return SystemPrompts().get_system_prompt("normal")
 
     def _get_system_prompt(self) -> str:
-        """Helper to load the system prompt using SystemPrompts class."""
+        """Helper to load the system prompt using SystemPrompts class (loaded once, then reused byte for byte)."""
         try:
-            from prompts.system_prompts import SystemPrompts
-            system_prompts = SystemPrompts()
-            return system_prompts.get_system_prompt("normal")
+            return self._load_system_prompt()
         except ImportError:
             self.logger.warning("SystemPrompts class not found. Using a basic default prompt.")
             return "You are a helpful assistant." # Default basic prompt 
@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .base_provider import BaseProvider
+
+logger = logging.getLogger(__name__)
+
+PoolKey = Tuple[str, str, str]
+
+class ProviderClientPool:
+    """
+    Thread-safe pool of provider instances (and the SDK clients they own), keyed by
+    (provider name, model, SHA-256 of the API key).
+
+    Each SDK client (anthropic.Anthropic, openai.OpenAI, ...) keeps its own HTTP connection
+    pool, so reusing the provider instance keeps TCP+TLS connections to the vendor warm across
+    requests. Entries idle for longer than `idle_ttl` seconds are evicted, and the pool never
+    holds more than `max_size` entries (least recently used entries are evicted first).
+
+    Pooled instances are shared, not checked out exclusively: the SDK clients are safe to use
+    from several threads, so concurrent requests with the same key borrow the same instance.
+    Evicted instances are simply dropped; any request still using one finishes normally and
+    the client's connections are released when it is garbage collected.
+    """
+
+    def __init__(self, max_size: int = 64, idle_ttl: float = 900.0):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._entries: "OrderedDict[PoolKey, Tuple[BaseProvider, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(provider_name: str, api_key: Optional[str], client_model: Optional[str]) -> PoolKey:
+        """Build the pool key. The raw API key is never stored, only its hash."""
+        key_hash = hashlib.sha256(api_key.encode('utf-8')).hexdigest() if api_key else ''
+        return (provider_name.lower(), client_model or '', key_hash)
+
+    def get(self, provider_name: str, api_key: Optional[str], client_model: Optional[str],
+            factory: Callable[[], BaseProvider]) -> BaseProvider:
+        """
+        Return the pooled provider for this (provider, model, key), creating it with `factory` on a miss.
+
+        Instances created without an API key are not pooled: they cannot make requests anyway,
+        and pooling them would hide a key that gets configured later.
+        """
+        if not api_key:
+            return factory()
+
+        key = self.make_key(provider_name, api_key, client_model)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], now)
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Build outside the lock: creating an SDK client can be slow and must not block other keys.
+        provider = factory()
+
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None:
+                # Another thread created the same client meanwhile; keep the first one.
+                self._entries.move_to_end(key)
+                return existing[0]
+            self._entries[key] = (provider, now)
+            while len(self._entries) > self.max_size:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                logger.info(f"Provider client pool full; evicted {evicted_key[0]}/{evicted_key[1] or 'default'} client.")
+        return provider
+
+    def _evict_idle(self, now: float):
+        """Drop entries idle longer than idle_ttl. Caller must hold the lock."""
+        if self.idle_ttl <= 0:
+            return
+        while self._entries:
+            oldest_key, (_, last_used) = next(iter(self._entries.items()))
+            if now - last_used < self.idle_ttl:
+                break
+            del self._entries[oldest_key]
+            self.evictions += 1
+            logger.info(f"Evicted idle {oldest_key[0]}/{oldest_key[1] or 'default'} client from provider client pool.")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
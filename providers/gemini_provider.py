@@ -1,26 +1,29 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Tuple
 import logging
 import os
+import re
 import json
 import time
+import collections
 import collections.abc # Added for Mapping type check
+import hashlib
+import threading
+import asyncio
+import datetime
 
 # Attempt to import the google.generativeai library
 try:
     import google.generativeai as genai
+    from google.generativeai import caching
     from google.generativeai.types import HarmCategory, HarmBlockThreshold, FunctionDeclaration, Tool
+    from google.ai import generativelanguage as glm
 except ImportError:
     raise ImportError("The 'google-generativeai' library is required for GeminiProvider. Please install it using: pip install google-generativeai")
 
 from .base_provider import BaseProvider
 from config import Config
-
-# Mapping from internal roles to Gemini roles
-ROLE_MAPPING = {
-    "user": "user",
-    "assistant": "model" 
-    # System prompts are handled differently in Gemini (as of latest versions)
-}
+import message_model
+import token_counter
 
 def _recursively_convert_mappings_to_dict(item: Any) -> Any:
     """
@@ -33,6 +36,231 @@ def _recursively_convert_mappings_to_dict(item: Any) -> Any:
         return [_recursively_convert_mappings_to_dict(i) for i in item]
     return item
 
+def _digest_default(value: Any) -> str:
+    # Image bytes (inline_data from the blob store) are identified by their hash, not their repr
+    if isinstance(value, bytes):
+        return hashlib.sha256(value).hexdigest()
+    return str(value)
+
+def _default_client_factory(api_key: str) -> Any:
+    return glm.GenerativeServiceClient(client_options={"api_key": api_key})
+
+def _default_async_client_factory(api_key: str) -> Any:
+    return glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+
+def _default_cache_client_factory(api_key: str) -> Any:
+    return glm.CacheServiceClient(client_options={"api_key": api_key})
+
+class _KeyClients:
+    """The transports and GenerativeModels built for one API key."""
+
+    def __init__(self):
+        self.client = None
+        self.async_client = None
+        self.cache_client = None
+        self.models: Dict[str, Any] = {}
+
+class GeminiClientCache:
+    """
+    Per-API-key Gemini transports and GenerativeModel instances.
+
+    genai.configure() swaps a process-global client, so concurrent requests carrying different
+    X-Gemini-API-Key headers could send one tenant's traffic with another tenant's key. Instead,
+    each key gets its own GenerativeServiceClient (and, lazily, an async client), and every
+    GenerativeModel handed out is bound to the client for its key. Keys are held only as
+    SHA-256 hashes in the cache keys; the raw key lives inside the client's credentials.
+
+    Like ProviderClientPool, the cache holds at most `max_size` keys and drops keys unused for
+    `idle_ttl` seconds, least recently used first; a key's clients and models are dropped together.
+    Models already handed out keep working and are released when garbage collected.
+    """
+
+    def __init__(self, client_factory=_default_client_factory, async_client_factory=_default_async_client_factory,
+                 cache_client_factory=_default_cache_client_factory, max_size: int = 64, idle_ttl: float = 900.0):
+        self._client_factory = client_factory
+        self._async_client_factory = async_client_factory
+        self._cache_client_factory = cache_client_factory
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._keys: "collections.OrderedDict[str, Tuple[_KeyClients, float]]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @staticmethod
+    def _hash_key(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+    def _entry(self, key_hash: str) -> _KeyClients:
+        """The key's clients, marked as just used; evicts idle and excess keys. Caller must hold the lock."""
+        now = time.monotonic()
+        if self.idle_ttl > 0:
+            while self._keys:
+                oldest_hash, (_, last_used) = next(iter(self._keys.items()))
+                if now - last_used < self.idle_ttl:
+                    break
+                del self._keys[oldest_hash]
+                self.evictions += 1
+        entry = self._keys[key_hash][0] if key_hash in self._keys else _KeyClients()
+        self._keys[key_hash] = (entry, now)
+        self._keys.move_to_end(key_hash)
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def get_model(self, api_key: str, model_name: str) -> Any:
+        """Return the cached GenerativeModel for (key, model), bound to that key's own client."""
+        with self._lock:
+            entry = self._entry(self._hash_key(api_key))
+            model = entry.models.get(model_name)
+            if model is not None:
+                return model
+            if entry.client is None:
+                entry.client = self._client_factory(api_key)
+            model = genai.GenerativeModel(model_name)
+            # GenerativeModel only falls back to the global (genai.configure) client when _client is None
+            model._client = entry.client
+            entry.models[model_name] = model
+            return model
+
+    def bind_async_client(self, model: Any, api_key: str):
+        """Attach the key's async client to a model before its first *_async call."""
+        if getattr(model, '_async_client', None) is not None:
+            return
+        with self._lock:
+            entry = self._entry(self._hash_key(api_key))
+            if entry.async_client is None:
+                entry.async_client = self._async_client_factory(api_key)
+            model._async_client = entry.async_client
+
+    def get_cached_content_model(self, api_key: str, cached_content: Any) -> Any:
+        """A GenerativeModel that uses a cached content as its context, bound to the key's client."""
+        model = self.get_model(api_key, cached_content.model)
+        cached_model = genai.GenerativeModel.from_cached_content(cached_content)
+        cached_model._client = model._client
+        return cached_model
+
+    def get_cache_client(self, api_key: str) -> Any:
+        """The key's CacheServiceClient, for creating cached contents without the global client."""
+        with self._lock:
+            entry = self._entry(self._hash_key(api_key))
+            if entry.cache_client is None:
+                entry.cache_client = self._cache_client_factory(api_key)
+            return entry.cache_client
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'keys': len(self._keys), 'max_size': self.max_size, 'evictions': self.evictions}
+
+# Shared across GeminiProvider instances, bounded like the provider client pool
+client_cache = GeminiClientCache(max_size=Config.PROVIDER_POOL_MAX_SIZE, idle_ttl=Config.PROVIDER_POOL_IDLE_SECONDS)
+
+class GeminiContextCache:
+    """
+    Gemini cached contents for long conversation prefixes.
+
+    Gemini does not cache prompts implicitly the way OpenAI does; a prefix has to be uploaded as a
+    CachedContent, after which requests send only the remaining messages and are billed the
+    cached-token rate for the prefix. Cached contents cannot be extended, so one is created for
+    the history before the newest message once that history is at least
+    Config.GEMINI_CACHE_MIN_TOKENS long (the API minimum for Gemini 1.5 is 32,768 tokens), and
+    reused by later turns until the messages sent after it grow as long again. Entries are keyed
+    by a hash of (API key, model, prefix contents) and expire with the cache's TTL.
+    """
+
+    # The API's answer for models (e.g. '-latest' aliases) that cannot create cached contents
+    UNSUPPORTED_MODEL_ERROR = re.compile(r"not supported for createCachedContent|does not support (?:context )?cach", re.IGNORECASE)
+
+    def __init__(self, max_entries: int = 256, unsupported_retry_seconds: float = 3600.0):
+        self.max_entries = max_entries
+        self.unsupported_retry_seconds = unsupported_retry_seconds
+        self._entries: "collections.OrderedDict[str, Tuple[Any, int, float]]" = collections.OrderedDict()
+        self._unsupported_models: Dict[str, float] = {}  # model -> time.time() after which caching is tried again
+        self._lock = threading.Lock()
+
+    def _is_unsupported(self, model_name: str) -> bool:
+        with self._lock:
+            retry_at = self._unsupported_models.get(model_name)
+            if retry_at is not None and retry_at <= time.time():
+                del self._unsupported_models[model_name]
+                return False
+            return retry_at is not None
+
+    @staticmethod
+    def _prefix_digests(api_key: str, model_name: str, contents: List[Dict[str, Any]]) -> List[str]:
+        """digests[i] identifies contents[:i + 1] for this key and model."""
+        running = hashlib.sha256(f"{GeminiClientCache._hash_key(api_key)}:{model_name}".encode('utf-8'))
+        digests = []
+        for content in contents:
+            running.update(json.dumps(content, sort_keys=True, default=_digest_default).encode('utf-8'))
+            digests.append(running.copy().hexdigest())
+        return digests
+
+    def _lookup(self, digests: List[str]) -> Tuple[Any, int]:
+        """The cached content covering the longest known prefix, and how many contents it covers."""
+        now = time.time()
+        with self._lock:
+            for length in range(len(digests), 0, -1):
+                entry = self._entries.get(digests[length - 1])
+                if entry is None:
+                    continue
+                if entry[2] <= now:
+                    del self._entries[digests[length - 1]]
+                    continue
+                self._entries.move_to_end(digests[length - 1])
+                return entry[0], length
+        return None, 0
+
+    def _store(self, digest: str, cached_content: Any, covered: int, expires_at: float):
+        with self._lock:
+            self._entries[digest] = (cached_content, covered, expires_at)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def prepare(self, api_key: str, model_name: str, contents: List[Dict[str, Any]]) -> Tuple[Any, List[Dict[str, Any]]]:
+        """
+        Returns (cached content or None, contents to send). Creates a cached content when the
+        uncached part of the history before the newest message is long enough; on any failure the
+        full contents are sent uncached.
+        """
+        prefix = contents[:-1]
+        if not prefix or self._is_unsupported(model_name):
+            return None, contents
+        digests = self._prefix_digests(api_key, model_name, prefix)
+        cached_content, covered = self._lookup(digests)
+
+        tokenizer = token_counter.get_tokenizer('gemini', model_name)
+        uncached_tokens = sum(token_counter.count_content_tokens(content.get('parts'), tokenizer) for content in prefix[covered:])
+        if uncached_tokens >= Config.GEMINI_CACHE_MIN_TOKENS:
+            try:
+                ttl = datetime.timedelta(seconds=Config.GEMINI_CACHE_TTL_SECONDS)
+                # Built with the SDK's request helper but sent with the key's own client (see GeminiClientCache)
+                request = caching.CachedContent._prepare_create_request(model=model_name, contents=prefix, ttl=ttl)
+                response = client_cache.get_cache_client(api_key).create_cached_content(request)
+                cached_content, covered = caching.CachedContent._from_obj(response), len(prefix)
+                self._store(digests[-1], cached_content, covered, time.time() + Config.GEMINI_CACHE_TTL_SECONDS - 30)
+                logging.getLogger(__name__).info(f"Created Gemini cached content {cached_content.name} for {covered} messages (~{uncached_tokens} tokens).")
+            except Exception as e:
+                if self.UNSUPPORTED_MODEL_ERROR.search(str(e)):
+                    # A property of the model, not of this key or request: stop trying for a while
+                    logging.getLogger(__name__).warning(f"Gemini context caching is not supported for {model_name}: {e}")
+                    with self._lock:
+                        self._unsupported_models[model_name] = time.time() + self.unsupported_retry_seconds
+                else:
+                    # Quota, network or key errors: send this request uncached and try again next time
+                    logging.getLogger(__name__).warning(f"Could not create a Gemini cached content for {model_name}, sending uncached: {e}")
+                return None, contents
+
+        if cached_content is None:
+            return None, contents
+        return cached_content, contents[covered:]
+
+context_cache = GeminiContextCache()
+
 class GeminiProvider(BaseProvider):
     """Provider implementation for Google's Gemini API."""
 
@@ -41,13 +269,12 @@ class GeminiProvider(BaseProvider):
         self.model = None
         self.client_model = client_model
         self._effective_model_name_used = None # NEW: Instance variable to store the model name
+        self._api_key = api_key
 
         final_api_key_to_use = api_key
 
         if final_api_key_to_use:
             try:
-                genai.configure(api_key=final_api_key_to_use)
-                
                 effective_model_name = None # Renamed for clarity within __init__ scope
                 if self.client_model:
                     effective_model_name = self.client_model
@@ -57,7 +284,8 @@ class GeminiProvider(BaseProvider):
                     self.logger.info(f"Using configured/default Gemini model: {effective_model_name}")
                 
                 self._effective_model_name_used = effective_model_name # Store it
-                self.model = genai.GenerativeModel(self._effective_model_name_used)
+                # Isolated per-key client; never touches the process-global genai.configure() state
+                self.model = client_cache.get_model(final_api_key_to_use, self._effective_model_name_used)
                 self.logger.info(f"Gemini client configured with API key for model: {self._effective_model_name_used}")
             except Exception as e:
                 # Log which model it attempted to use if possible
@@ -198,55 +426,161 @@ class GeminiProvider(BaseProvider):
         return Tool(function_declarations=function_declarations) if function_declarations else None
 
     def _format_messages_for_gemini(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-         """Convert message history to Gemini's format, handling roles and content types."""
-         self.logger.debug(f"GeminiProvider: Input messages to _format_messages_for_gemini: {json.dumps(messages, indent=2)}")
-         gemini_history = []
-         # system_prompt = None # System prompts handled separately (not in this function)
-
-         for msg in messages:
-             role = ROLE_MAPPING.get(msg['role'])
-             content_as_gemini_parts = msg.get('content') # This comes from context_sanitizer._sanitize_for_gemini
-
-             if not role:
-                 self.logger.warning(f"Skipping message with unmapped role: {msg['role']}")
-                 continue
-
-            # content_as_gemini_parts should already be a list of dicts formatted for Gemini by the sanitizer
-            # (e.g., [{"text": "..."}, {"text": "[tool call redacted]"}])
-            # We validate it and ensure it's a non-empty list of such parts.
-             if isinstance(content_as_gemini_parts, list) and content_as_gemini_parts:
-                 valid_parts_for_this_message = []
-                 for part_dict in content_as_gemini_parts:
-                     if isinstance(part_dict, dict) and \
-                        any(key in part_dict for key in ['text', 'inline_data', 'function_call', 'function_response']):
-                         valid_parts_for_this_message.append(part_dict)
-                     else:
-                         self.logger.warning(f"GeminiProvider: Invalid or unexpected part structure in content for role '{role}': {part_dict}. Skipping this part.")
-                 
-                 if valid_parts_for_this_message: # Only add if we have valid parts for this message
-                     gemini_history.append({"role": role, "parts": valid_parts_for_this_message})
-                 else:
-                     self.logger.warning(f"GeminiProvider: Role '{role}' had content that resulted in no valid Gemini parts after validation: {content_as_gemini_parts}. Skipping message.")
-             else:
-                 self.logger.warning(f"GeminiProvider: Role '{role}' has empty or invalid content from sanitizer: {content_as_gemini_parts}. Skipping message.")
-         
-         self.logger.debug(f"GeminiProvider: Formatted gemini_history: {json.dumps(gemini_history, indent=2)}")
-         return gemini_history
+        """
+        Convert message history to Gemini's format, handling roles and content types. Messages
+        from context_sanitizer are already encoded and pass through; others are encoded here
+        (see message_model.encode_gemini). System messages are dropped.
+        """
+        gemini_history = message_model.to_wire(messages, self.name)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"GeminiProvider: Formatted gemini_history: {json.dumps(gemini_history, indent=2)}")
+        return gemini_history
+
+    def _not_configured_response(self) -> Dict[str, Any]:
+        return {
+            'content': [{'type': 'text', 'text': 'Gemini client not configured (check API key?). Cannot process request.'}],
+            'usage': {'input_tokens': 0, 'output_tokens': 0, 'runtime': 0.0},
+            'stop_reason': 'error'
+        }
+
+    def _model_for_request(self, gemini_history: List[Dict[str, Any]], gemini_tools: Any, config: Config) -> Tuple[Any, List[Dict[str, Any]]]:
+        """
+        The model to call and the contents to send: a cached-content model plus the messages after
+        the cached prefix when a long history can use one (see GeminiContextCache), otherwise
+        self.model and the full history. Requests with tools are never cached, since a cached
+        content fixes the tools it was created with.
+        """
+        if not config.PROMPT_CACHE_ENABLED or gemini_tools:
+            return self.model, gemini_history
+        cached_content, contents = context_cache.prepare(self._api_key, self._effective_model_name_used, gemini_history)
+        if cached_content is None:
+            return self.model, gemini_history
+        return client_cache.get_cached_content_model(self._api_key, cached_content), contents
+
+    def _generation_config(self, config: Config) -> Any:
+        return genai.types.GenerationConfig(
+             # candidate_count=1, # Default
+             # stop_sequences=['...'],
+             # max_output_tokens=config.MAX_TOKENS, # Set max output tokens
+             temperature=config.DEFAULT_TEMPERATURE
+         )
+
+    def _count_tokens(self, response: Any, gemini_history: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        (input, output) tokens for a completed response: from its usage metadata when present
+        (which also covers cached-content requests), otherwise with the count_tokens endpoint.
+        """
+        input_token_count = 0
+        output_token_count = 0
+        if not response.candidates:
+            return input_token_count, output_token_count
+        usage_metadata = getattr(response, 'usage_metadata', None)
+        if usage_metadata is not None and getattr(usage_metadata, 'prompt_token_count', 0):
+            return usage_metadata.prompt_token_count, getattr(usage_metadata, 'candidates_token_count', 0) or 0
+        candidate = response.candidates[0]
+        try:
+            # Count input tokens (using the history sent)
+            input_token_count = self.model.count_tokens(gemini_history).total_tokens
+            self.logger.debug(f"Gemini calculated input tokens: {input_token_count}")
+        except Exception as e:
+            self.logger.error(f"Failed to count Gemini input tokens: {e}")
+
+        try:
+            # Count output tokens (using the candidate content)
+            if candidate.content and candidate.content.parts:
+                output_token_count = self.model.count_tokens(candidate.content).total_tokens
+                self.logger.debug(f"Gemini calculated output tokens: {output_token_count}")
+        except Exception as e:
+            self.logger.error(f"Failed to count Gemini output tokens: {e}")
+        return input_token_count, output_token_count
+
+    async def _acount_tokens(self, response: Any, gemini_history: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """Async variant of _count_tokens()."""
+        input_token_count = 0
+        output_token_count = 0
+        if not response.candidates:
+            return input_token_count, output_token_count
+        usage_metadata = getattr(response, 'usage_metadata', None)
+        if usage_metadata is not None and getattr(usage_metadata, 'prompt_token_count', 0):
+            return usage_metadata.prompt_token_count, getattr(usage_metadata, 'candidates_token_count', 0) or 0
+        candidate = response.candidates[0]
+        try:
+            input_token_count = (await self.model.count_tokens_async(gemini_history)).total_tokens
+        except Exception as e:
+            self.logger.error(f"Failed to count Gemini input tokens: {e}")
+        try:
+            if candidate.content and candidate.content.parts:
+                output_token_count = (await self.model.count_tokens_async(candidate.content)).total_tokens
+        except Exception as e:
+            self.logger.error(f"Failed to count Gemini output tokens: {e}")
+        return input_token_count, output_token_count
+
+    def _response_to_dict(self, response: Any, runtime: float, input_token_count: int, output_token_count: int) -> Dict[str, Any]:
+        """Convert a (fully consumed) Gemini response into the provider-neutral response dictionary."""
+        # Extract content
+        response_content = []
+        finish_reason = "unknown"
+
+        if response.candidates:
+             candidate = response.candidates[0]
+             finish_reason = candidate.finish_reason.name if candidate.finish_reason else "unknown"
+
+             if candidate.content and candidate.content.parts:
+                 for part in candidate.content.parts:
+                     if hasattr(part, 'text') and part.text:
+                         response_content.append({"type": "text", "text": part.text})
+                     elif hasattr(part, 'function_call'):
+                         # Map Gemini function call to Claude-like format
+                         fc = part.function_call
+                         tool_input_args = {}
+                         if hasattr(fc, 'args') and fc.args is not None:
+                             # Use the recursive converter
+                             tool_input_args = _recursively_convert_mappings_to_dict(fc.args)
+                         
+                         response_content.append({
+                             "type": "tool_use",
+                             "id": fc.name, # Gemini doesn't seem to provide a unique ID per call like others
+                             "name": fc.name,
+                             "input": tool_input_args
+                         })
+                         # Standardize finish reason
+                         finish_reason = "tool_calls"
+        else:
+             # Handle blocked responses
+             self.logger.warning(f"Gemini response potentially blocked. Prompt feedback: {response.prompt_feedback}")
+             finish_reason = "blocked" # Or map from prompt_feedback
+             response_content = [{'type': 'text', 'text': '[Response blocked by safety settings or other reasons]'}]
+
+        # Prepare final usage dictionary; cached-content tokens are part of input_token_count
+        usage_metadata = getattr(response, 'usage_metadata', None)
+        usage_dict = {
+            'input_tokens': input_token_count,
+            'output_tokens': output_token_count,
+            'total_tokens': input_token_count + output_token_count,
+            'cache_read_tokens': getattr(usage_metadata, 'cached_content_token_count', 0) or 0,
+            'runtime': runtime
+        }
+
+        self.logger.debug(f"Gemini usage: input_tokens={input_token_count}, output_tokens={output_token_count}, runtime={runtime}")
+        
+        return_dict = {
+            'content': response_content,
+            'usage': usage_dict,
+            'stop_reason': finish_reason.lower(),
+            'model_used': self._effective_model_name_used 
+        }
+        self.logger.debug(f"GeminiProvider returning: {json.dumps(return_dict)}")
+        return return_dict
 
     def chat(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], config: Config) -> Dict[str, Any]:
         """Send chat request to Gemini API."""
         if not self.model:
-            return {
-                'content': [{'type': 'text', 'text': 'Gemini client not configured (check API key?). Cannot process request.'}],
-                'usage': {'input_tokens': 0, 'output_tokens': 0, 'runtime': 0.0},
-                'stop_reason': 'error'
-            }
+            return self._not_configured_response()
         
         self.logger.debug(f"Sending request to Gemini with {len(messages)} messages and {len(tools)} tools.")
         gemini_tools = self._format_tools_for_gemini(tools)
         gemini_history = self._format_messages_for_gemini(messages)
         
-        self.logger.debug(f"GeminiProvider: History for generate_content: {json.dumps(gemini_history, indent=2)}")
         
         # Extract latest user message as the current prompt for generate_content
         # The history should contain previous turns
@@ -259,98 +593,93 @@ class GeminiProvider(BaseProvider):
         # Simpler approach for now: send full history directly if supported
         try:
             start_time = time.time()
-            response = self.model.generate_content(
-                gemini_history, 
+            model, contents = self._model_for_request(gemini_history, gemini_tools, config)
+            response = model.generate_content(
+                contents, 
                 tools=gemini_tools,
-                generation_config=genai.types.GenerationConfig(
-                     # candidate_count=1, # Default
-                     # stop_sequences=['...'],
-                     # max_output_tokens=config.MAX_TOKENS, # Set max output tokens
-                     temperature=config.DEFAULT_TEMPERATURE
-                 )
+                generation_config=self._generation_config(config)
             )
-            end_time = time.time()
-            runtime = end_time - start_time
-
-            # Extract content and usage
-            response_content = []
-            finish_reason = "unknown"
-            input_token_count = 0
-            output_token_count = 0
-
-            if response.candidates:
-                 candidate = response.candidates[0]
-                 finish_reason = candidate.finish_reason.name if candidate.finish_reason else "unknown"
-
-                 # --- Calculate Token Usage --- >
-                 try:
-                     # Count input tokens (using the history sent)
-                     input_token_result = self.model.count_tokens(gemini_history)
-                     input_token_count = input_token_result.total_tokens
-                     self.logger.debug(f"Gemini calculated input tokens: {input_token_count}")
-                 except Exception as e:
-                     self.logger.error(f"Failed to count Gemini input tokens: {e}")
-
-                 try:
-                     # Count output tokens (using the candidate content)
-                     if candidate.content and candidate.content.parts:
-                         output_token_result = self.model.count_tokens(candidate.content)
-                         output_token_count = output_token_result.total_tokens
-                         self.logger.debug(f"Gemini calculated output tokens: {output_token_count}")
-                 except Exception as e:
-                     self.logger.error(f"Failed to count Gemini output tokens: {e}")
-                 # < --- End Token Usage Calculation ---
-
-                 if candidate.content and candidate.content.parts:
-                     for part in candidate.content.parts:
-                         if hasattr(part, 'text') and part.text:
-                             response_content.append({"type": "text", "text": part.text})
-                         elif hasattr(part, 'function_call'):
-                             # Map Gemini function call to Claude-like format
-                             fc = part.function_call
-                             tool_input_args = {}
-                             if hasattr(fc, 'args') and fc.args is not None:
-                                 # Use the recursive converter
-                                 tool_input_args = _recursively_convert_mappings_to_dict(fc.args)
-                             
-                             response_content.append({
-                                 "type": "tool_use",
-                                 "id": fc.name, # Gemini doesn't seem to provide a unique ID per call like others
-                                 "name": fc.name,
-                                 "input": tool_input_args
-                             })
-                             # Standardize finish reason
-                             finish_reason = "tool_calls"
-            else:
-                 # Handle blocked responses
-                 self.logger.warning(f"Gemini response potentially blocked. Prompt feedback: {response.prompt_feedback}")
-                 finish_reason = "blocked" # Or map from prompt_feedback
-                 response_content = [{'type': 'text', 'text': '[Response blocked by safety settings or other reasons]'}]
-
-            # Prepare final usage dictionary
-            usage_dict = {
-                'input_tokens': input_token_count,
-                'output_tokens': output_token_count,
-                'total_tokens': input_token_count + output_token_count,
-                'runtime': runtime
-            }
-
-            self.logger.debug(f"Gemini usage: input_tokens={input_token_count}, output_tokens={output_token_count}, runtime={runtime}")
-            
-            return_dict = {
-                'content': response_content,
-                'usage': usage_dict,
-                'stop_reason': finish_reason.lower(),
-                'model_used': self._effective_model_name_used 
-            }
-            self.logger.debug(f"GeminiProvider returning: {json.dumps(return_dict)}")
-            return return_dict
+            runtime = time.time() - start_time
+            input_tokens, output_tokens = self._count_tokens(response, gemini_history)
+            return self._response_to_dict(response, runtime, input_tokens, output_tokens)
 
         except Exception as e:
             self.logger.exception("An unexpected error occurred during Gemini API call")
             # You might want to inspect the specific error type from google.api_core.exceptions
             raise RuntimeError(f"An unexpected error occurred interacting with Gemini: {e}") from e 
 
+    async def achat(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], config: Config) -> Dict[str, Any]:
+        """Send chat request to Gemini API without blocking the event loop."""
+        if not self.model:
+            return self._not_configured_response()
+
+        self.logger.debug(f"Sending async request to Gemini with {len(messages)} messages and {len(tools)} tools.")
+        gemini_tools = self._format_tools_for_gemini(tools)
+        # Formatting loads and resizes blob images; keep it off the event loop
+        gemini_history = await asyncio.to_thread(self._format_messages_for_gemini, messages)
+
+        if not gemini_history:
+             return {'content': [{'type': 'text', 'text': 'Cannot send empty message history to Gemini.'}], 'usage': {'input_tokens': 0, 'output_tokens': 0}, 'stop_reason': 'error'}
+
+        try:
+            start_time = time.time()
+            # Creating a cached content is a blocking call; keep it off the event loop
+            model, contents = await asyncio.to_thread(self._model_for_request, gemini_history, gemini_tools, config)
+            client_cache.bind_async_client(model, self._api_key)
+            response = await model.generate_content_async(
+                contents,
+                tools=gemini_tools,
+                generation_config=self._generation_config(config)
+            )
+            runtime = time.time() - start_time
+            input_tokens, output_tokens = await self._acount_tokens(response, gemini_history)
+            return self._response_to_dict(response, runtime, input_tokens, output_tokens)
+
+        except Exception as e:
+            self.logger.exception("An unexpected error occurred during async Gemini API call")
+            raise RuntimeError(f"An unexpected error occurred interacting with Gemini: {e}") from e
+
+    def stream_chat(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], config: Config) -> Iterator[Dict[str, Any]]:
+        """Stream chat response from Gemini API, yielding text deltas as they arrive."""
+        if not self.model:
+            yield {'type': 'final', 'response': self._not_configured_response()}
+            return
+
+        self.logger.debug(f"Streaming request to Gemini with {len(messages)} messages and {len(tools)} tools.")
+        gemini_tools = self._format_tools_for_gemini(tools)
+        gemini_history = self._format_messages_for_gemini(messages)
+
+        if not gemini_history:
+             yield {'type': 'final', 'response': {'content': [{'type': 'text', 'text': 'Cannot send empty message history to Gemini.'}], 'usage': {'input_tokens': 0, 'output_tokens': 0}, 'stop_reason': 'error'}}
+             return
+
+        try:
+            start_time = time.time()
+            model, contents = self._model_for_request(gemini_history, gemini_tools, config)
+            response = model.generate_content(
+                contents,
+                tools=gemini_tools,
+                generation_config=self._generation_config(config),
+                stream=True
+            )
+            for chunk in response:
+                # chunk.text raises if the chunk carries no text part (e.g. a function call), so read parts directly
+                for candidate in chunk.candidates or []:
+                    if not candidate.content:
+                        continue
+                    for part in candidate.content.parts:
+                        if getattr(part, 'text', None):
+                            yield {'type': 'text_delta', 'text': part.text}
+            runtime = time.time() - start_time
+            # After iteration the streaming response holds the aggregated candidates
+            input_tokens, output_tokens = self._count_tokens(response, gemini_history)
+            final_response = self._response_to_dict(response, runtime, input_tokens, output_tokens)
+        except Exception as e:
+            self.logger.exception("An unexpected error occurred during Gemini streaming API call")
+            raise RuntimeError(f"An unexpected error occurred interacting with Gemini: {e}") from e
+
+        yield {'type': 'final', 'response': final_response}
+
     def _prepare_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         # ... existing helper ...
         pass
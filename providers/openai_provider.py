@@ -1,4 +1,5 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Tuple
+import asyncio
 import logging
 import os
 import json
@@ -13,6 +14,7 @@ except ImportError:
 
 from .base_provider import BaseProvider
 from config import Config
+import message_model
 
 class OpenAIProvider(BaseProvider):
     """Provider implementation for OpenAI's ChatGPT API."""
@@ -20,7 +22,9 @@ class OpenAIProvider(BaseProvider):
     def __init__(self, api_key: str = None, client_model: str = None):
         self.logger = logging.getLogger(__name__)
         self.client = None 
+        self.async_client = None # Created on first achat() call; only the ASGI app needs it
         self.client_model = client_model
+        self._api_key = api_key
 
         final_api_key_to_use = api_key # This is the key selected by app.py
 
@@ -42,36 +46,6 @@ class OpenAIProvider(BaseProvider):
     def name(self) -> str:
         return "openai"
 
-    def _normalize_message_blocks(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """
-        Recursively convert any Pydantic/Anthropic message blocks to dicts. Leaves dicts unchanged.
-        Only used internally for OpenAIProvider to ensure compatibility.
-        """
-        def block_to_dict(block):
-            # If it's a Pydantic object (Anthropic), convert to dict
-            if hasattr(block, 'dict') and callable(getattr(block, 'dict', None)):
-                return block.dict()
-            # If it's a known Anthropic block (TextBlock, ToolUseBlock, etc.)
-            if hasattr(block, '__dict__') and hasattr(block, 'type'):
-                # Only include public attributes
-                return {k: v for k, v in block.__dict__.items() if not k.startswith('_')}
-            # If it's already a dict, return as is
-            if isinstance(block, dict):
-                return block
-            return block  # fallback (should not happen)
-
-        normalized = []
-        for msg in messages:
-            content = msg.get('content')
-            if isinstance(content, list):
-                norm_content = [block_to_dict(b) for b in content]
-            else:
-                norm_content = content
-            norm_msg = dict(msg)
-            norm_msg['content'] = norm_content
-            normalized.append(norm_msg)
-        return normalized
-
     def _format_tools_for_openai(self, tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Convert the internal tool format to OpenAI's expected format."""
         openai_tools = []
@@ -92,186 +66,15 @@ class OpenAIProvider(BaseProvider):
         return openai_tools
 
     def _format_messages_for_openai(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Convert internal message history to OpenAI's expected format."""
-        formatted_messages = []
-        for msg in messages:
-            role = msg.get('role')
-            content = msg.get('content') # This content is already processed by context_sanitizer
-
-            if role == 'assistant':
-                assistant_text_accumulated = []
-                assistant_tool_calls = []
-                has_any_tool_use_defined = False # To track if a tool_use was seen, even if it failed to format
-
-                if isinstance(content, list):
-                    for item in content:
-                        if not isinstance(item, dict):
-                            self.logger.warning(f"Assistant message content part is not a dict: {item}. Skipping.")
-                            continue
-                        
-                        item_type = item.get('type')
-                        if item_type == 'text':
-                            assistant_text_accumulated.append(item.get('text', ''))
-                        elif item_type == 'tool_use':
-                            has_any_tool_use_defined = True
-                            tool_id = item.get('id')
-                            tool_name = item.get('name')
-                            tool_input_args = item.get('input', {})
-                            
-                            if not tool_id or not tool_name:
-                                self.logger.error(f"Assistant tool_use item missing id or name: {item}. Skipping this tool_call.")
-                                continue
-
-                            tool_arguments_str = ""
-                            if isinstance(tool_input_args, str):
-                                tool_arguments_str = tool_input_args
-                            elif isinstance(tool_input_args, dict):
-                                try:
-                                    tool_arguments_str = json.dumps(tool_input_args)
-                                except TypeError as e:
-                                    self.logger.error(f"Could not serialize tool arguments to JSON for tool '{tool_name}': {tool_input_args}. Error: {e}")
-                                    tool_arguments_str = "{}"
-                            else:
-                                self.logger.warning(f"Tool arguments for tool '{tool_name}' are not a dict or string: {tool_input_args}. Using empty JSON object string.")
-                                tool_arguments_str = "{}"
-
-                            assistant_tool_calls.append({
-                                "id": tool_id,
-                                "type": "function",
-                                "function": {
-                                    "name": tool_name,
-                                    "arguments": tool_arguments_str
-                                }
-                            })
-                        else:
-                            self.logger.warning(f"Unsupported part type '{item_type}' in assistant message content: {item}. It will be ignored.")
-
-                elif isinstance(content, str):
-                    assistant_text_accumulated.append(content)
-                elif content is None and role == 'assistant':
-                    pass
-                else:
-                    self.logger.warning(f"Assistant message content is of unexpected type or None: {type(content)}. Content: {content}")
-
-                openai_assistant_msg = {"role": "assistant"}
-                final_assistant_text_content = " ".join(filter(None, assistant_text_accumulated)).strip()
-
-                if assistant_tool_calls:
-                    openai_assistant_msg["tool_calls"] = assistant_tool_calls
-                    if final_assistant_text_content:
-                        openai_assistant_msg["content"] = final_assistant_text_content
-                    else:
-                        openai_assistant_msg["content"] = None
-                elif final_assistant_text_content:
-                    openai_assistant_msg["content"] = final_assistant_text_content
-                else:
-                    if has_any_tool_use_defined and not assistant_tool_calls:
-                        self.logger.error(f"Assistant message contained tool_use parts that could not be formatted: {content}")
-                        openai_assistant_msg["content"] = "[Internal error: Failed to process tool calls for assistant message.]"
-                        # Append this error message only if it's constructed
-                        formatted_messages.append(openai_assistant_msg) 
-                    elif content is not None and not isinstance(content, list) and not isinstance(content, str):
-                         openai_assistant_msg["content"] = f"[Unparseable assistant content: {str(content)[:100]}]"
-                         formatted_messages.append(openai_assistant_msg)
-                    # elif not (final_assistant_text_content or assistant_tool_calls or (has_any_tool_use_defined and not assistant_tool_calls)):
-                    #     self.logger.debug(f"Skipping empty or fully unhandled assistant message. Original content: {content}")
-                    # The above elif is commented out to ensure that if an error message was set, it gets appended by the next check
-
-                if "tool_calls" in openai_assistant_msg or ("content" in openai_assistant_msg and openai_assistant_msg["content"] is not None):
-                    # Avoid appending if it was already appended due to an error message construction above
-                    if not (has_any_tool_use_defined and not assistant_tool_calls and "content" in openai_assistant_msg and openai_assistant_msg["content"].startswith("[Internal error")) and \
-                       not (content is not None and not isinstance(content, list) and not isinstance(content, str) and "content" in openai_assistant_msg and openai_assistant_msg["content"].startswith("[Unparseable assistant content")):
-                        if openai_assistant_msg not in formatted_messages: # Ensure it wasn't added if an error message was already set and appended
-                            formatted_messages.append(openai_assistant_msg)
-                    
-                    if assistant_tool_calls:
-                         self.logger.debug(f"Formatted assistant message with tool_calls: {json.dumps(openai_assistant_msg, indent=2)}")
-                    elif final_assistant_text_content:
-                         self.logger.debug(f"Formatted assistant message with text content: {json.dumps(openai_assistant_msg, indent=2)}")
-
-            elif role == 'user' and isinstance(content, list) and content and \
-                 isinstance(content[0], dict) and content[0].get('type') == 'tool_result':
-                self.logger.debug(f"Detected user message containing tool results: {content}")
-                for item in content:
-                    if isinstance(item, dict) and item.get('type') == 'tool_result':
-                        tool_use_id = item.get('tool_use_id')
-                        tool_output = item.get('content')
-
-                        if not tool_use_id:
-                            self.logger.error(f"Tool result item missing 'tool_use_id': {item}. Skipping this result.")
-                            continue
-                        
-                        tool_output_str = str(tool_output) if tool_output is not None else ""
-
-                        formatted_messages.append({
-                            "role": "tool",
-                            "tool_call_id": tool_use_id,
-                            "content": tool_output_str
-                        })
-                        self.logger.debug(f"Formatted tool result for tool_call_id: {tool_use_id}")
-                    else:
-                         self.logger.warning(f"Found unexpected item within user-role tool result message list: {item}")
-
-            elif role == 'user':
-                 if isinstance(content, str):
-                     formatted_messages.append({"role": "user", "content": content})
-                 elif isinstance(content, list):
-                     openai_parts = []
-                     for item in content:
-                         if not isinstance(item, dict):
-                             self.logger.warning(f"User message content part is not a dict: {item}. Converting to text.")
-                             openai_parts.append({'type': 'text', 'text': str(item)})
-                             continue
-
-                         item_type = item.get('type')
-                         if item_type == 'text':
-                             openai_parts.append({'type': 'text', 'text': item.get('text', '')})
-                         elif item_type == 'image_url':
-                             if isinstance(item.get("image_url"), dict) and "url" in item["image_url"]:
-                                 openai_parts.append(item)
-                             else:
-                                 self.logger.warning(f"Malformed image_url part in user message: {item}. Skipping.")
-                         else:
-                             self.logger.warning(f"Unsupported item type '{item_type}' in user message content list: {item}. Converting to text representation.")
-                             openai_parts.append({'type': 'text', 'text': f"[Unsupported content part: {str(item)[:100]}]"})
-                     
-                     if openai_parts:
-                          formatted_messages.append({"role": "user", "content": openai_parts})
-                     else:
-                          self.logger.warning(f"User message content was a list but resulted in no processable OpenAI parts: {content}")
-            
-            elif role == 'system':
-                 self.logger.debug(f"System message encountered in _format_messages_for_openai; should be handled by caller. Content: {str(content)[:100]}")
-                 pass
-
-            elif role == 'tool':
-                tool_call_id = msg.get("tool_call_id")
-                if not tool_call_id:
-                    self.logger.error(f"Message with role 'tool' is missing 'tool_call_id': {msg}. Skipping.")
-                    continue
-                
-                tool_content_str = str(msg.get("content", ""))
-
-                formatted_messages.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call_id,
-                    "content": tool_content_str
-                })
-                self.logger.debug(f"Passed through existing 'tool' role message for tool_call_id: {tool_call_id}")
-            else:
-                 self.logger.warning(f"Skipping message with unhandled role '{role}' in _format_messages_for_openai")
-        
-        return formatted_messages
-
-    def chat(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], config: Config) -> Dict[str, Any]:
-        """Send chat request to OpenAI API."""
-        if not self.client:
-            return {
-                'content': [{'type': 'text', 'text': 'OpenAI API key not configured. Cannot process request.'}],
-                'usage': {'input_tokens': 0, 'output_tokens': 0, 'runtime': 0.0},
-                'stop_reason': 'error'
-            }
+        """
+        Convert internal message history to OpenAI's expected format. Messages from
+        context_sanitizer are already encoded and pass through; others are encoded here
+        (see message_model.encode_openai).
+        """
+        return message_model.to_wire(messages, self.name)
 
+    def _build_request_params(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], config: Config) -> Tuple[Dict[str, Any], str]:
+        """Format messages and tools for OpenAI and assemble the request parameters shared by chat() and stream_chat()."""
         # Extract system prompt if present (OpenAI prefers it separate)
         system_prompt = None
         user_messages = []
@@ -290,10 +93,10 @@ class OpenAIProvider(BaseProvider):
         else:
              user_messages = messages # No system prompt found
 
-        self.logger.debug(f"OpenAIProvider: Messages to be formatted by _format_messages_for_openai: {json.dumps(user_messages, indent=2)}")
         openai_tools = self._format_tools_for_openai(tools)
         formatted_history = self._format_messages_for_openai(user_messages)
-        self.logger.debug(f"OpenAIProvider: Messages after formatting by _format_messages_for_openai (sent to API): {json.dumps(formatted_history, indent=2)}")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"OpenAIProvider: Messages after formatting by _format_messages_for_openai (sent to API): {json.dumps(formatted_history, indent=2)}")
 
         # ITEM 2: Modified Model Selection Logic
         model_name_to_use = None
@@ -320,72 +123,185 @@ class OpenAIProvider(BaseProvider):
             formatted_history.insert(0, {"role": "system", "content": system_prompt})
             request_params["messages"] = formatted_history
 
+        return request_params, model_name_to_use
+
+    def _tool_call_to_content_part(self, tool_call_id: str, tool_name: str, tool_arguments: str) -> Dict[str, Any]:
+        """Map an OpenAI tool call onto the Claude-like 'tool_use' content part used by ce3.py."""
         try:
-            start_time = time.time()
-            # Make the API call
-            response = self.client.chat.completions.create(**request_params)
-            end_time = time.time()
-            runtime = end_time - start_time
-            response_message = response.choices[0].message
-            finish_reason = response.choices[0].finish_reason
-
-            # Extract usage data
-            usage_data = response.usage
-            usage_dict = {
-                'input_tokens': getattr(usage_data, 'prompt_tokens', 0),
-                'output_tokens': getattr(usage_data, 'completion_tokens', 0),
-                'runtime': runtime
+            return {
+                "type": "tool_use",
+                "id": tool_call_id,
+                "name": tool_name,
+                "input": json.loads(tool_arguments) # Arguments are JSON strings
             }
-            self.logger.debug(f"Received response from OpenAI. Finish reason: {finish_reason}")
-
-            # Process the response message
-            response_content = []
-            if response_message.content:
-                 response_content.append({"type": "text", "text": response_message.content})
-            
-            # Check for tool calls
-            tool_calls = getattr(response_message, 'tool_calls', None)
-            if tool_calls:
-                finish_reason = "tool_calls" # Standardize stop reason for tool use
-                for tool_call in tool_calls:
-                    try:
-                        # Map OpenAI tool call format to Claude-like format for ce3.py handler
-                        response_content.append({
-                            "type": "tool_use",
-                            "id": tool_call.id,
-                            "name": tool_call.function.name,
-                            "input": json.loads(tool_call.function.arguments) # Arguments are JSON strings
-                        })
-                    except json.JSONDecodeError:
-                        self.logger.error(f"Failed to parse JSON arguments for tool call {tool_call.function.name}: {tool_call.function.arguments}")
-                        response_content.append({
-                             "type": "text",
-                             "text": f"[Error processing tool call {tool_call.function.name}: Invalid arguments format]"
-                        })
-                    except Exception as e:
-                        self.logger.exception(f"Error processing tool call: {e}")
-                        response_content.append({
-                             "type": "text",
-                             "text": f"[Error processing tool call {tool_call.function.name}]"
-                        })
-
-            self.logger.debug(f"OpenAI usage: input_tokens={usage_dict['input_tokens']}, output_tokens={usage_dict['output_tokens']}, runtime={runtime}")
+        except json.JSONDecodeError:
+            self.logger.error(f"Failed to parse JSON arguments for tool call {tool_name}: {tool_arguments}")
             return {
-                'content': response_content, 
-                'usage': usage_dict,
-                'stop_reason': finish_reason,
-                'model_used': model_name_to_use
+                 "type": "text",
+                 "text": f"[Error processing tool call {tool_name}: Invalid arguments format]"
+            }
+        except Exception as e:
+            self.logger.exception(f"Error processing tool call: {e}")
+            return {
+                 "type": "text",
+                 "text": f"[Error processing tool call {tool_name}]"
             }
 
-        except openai.APIConnectionError as e:
+    def _translate_error(self, e: Exception) -> Exception:
+        """Map OpenAI SDK exceptions onto the ConnectionError/RuntimeError types callers expect."""
+        if isinstance(e, openai.APIConnectionError):
             self.logger.error(f"OpenAI APIConnectionError: {e}")
-            raise ConnectionError(f"Failed to connect to OpenAI API: {e}") from e
-        except openai.RateLimitError as e:
+            return ConnectionError(f"Failed to connect to OpenAI API: {e}")
+        if isinstance(e, openai.RateLimitError):
             self.logger.error(f"OpenAI RateLimitError: {e}")
-            raise ConnectionError(f"OpenAI API rate limit exceeded: {e}") from e
-        except openai.APIStatusError as e:
+            return ConnectionError(f"OpenAI API rate limit exceeded: {e}")
+        if isinstance(e, openai.APIStatusError):
             self.logger.error(f"OpenAI APIStatusError: status={e.status_code}, response={e.response}")
-            raise ConnectionError(f"OpenAI API error (Status {e.status_code}): {e.response.json().get('error', {}).get('message', e.response.text)}") from e
+            return ConnectionError(f"OpenAI API error (Status {e.status_code}): {e.response.json().get('error', {}).get('message', e.response.text)}")
+        self.logger.exception("An unexpected error occurred during OpenAI API call")
+        return RuntimeError(f"An unexpected error occurred interacting with OpenAI: {e}")
+
+    def _client_not_configured_response(self) -> Dict[str, Any]:
+        return {
+            'content': [{'type': 'text', 'text': 'OpenAI API key not configured. Cannot process request.'}],
+            'usage': {'input_tokens': 0, 'output_tokens': 0, 'runtime': 0.0},
+            'stop_reason': 'error'
+        }
+
+    def chat(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], config: Config) -> Dict[str, Any]:
+        """Send chat request to OpenAI API."""
+        if not self.client:
+            return self._client_not_configured_response()
+
+        request_params, model_name_to_use = self._build_request_params(messages, tools, config)
+
+        try:
+            start_time = time.time()
+            # Make the API call
+            response = self.client.chat.completions.create(**request_params)
+            runtime = time.time() - start_time
+            return self._response_to_dict(response, model_name_to_use, runtime)
+        except Exception as e:
+            raise self._translate_error(e) from e
+
+    async def achat(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], config: Config) -> Dict[str, Any]:
+        """Send chat request to OpenAI API without blocking the event loop."""
+        if not self.client:
+            return self._client_not_configured_response()
+
+        # Formatting loads and resizes blob images; keep it off the event loop
+        request_params, model_name_to_use = await asyncio.to_thread(self._build_request_params, messages, tools, config)
+
+        if self.async_client is None:
+            self.async_client = openai.AsyncOpenAI(api_key=self._api_key)
+
+        try:
+            start_time = time.time()
+            response = await self.async_client.chat.completions.create(**request_params)
+            runtime = time.time() - start_time
+            return self._response_to_dict(response, model_name_to_use, runtime)
+        except Exception as e:
+            raise self._translate_error(e) from e
+
+    def _usage_to_dict(self, usage_data: Any, runtime: float) -> Dict[str, Any]:
+        """
+        Provider-neutral usage dictionary. OpenAI caches prompt prefixes of 1024+ tokens
+        automatically; cached_tokens (part of prompt_tokens) says how much of this prompt was
+        read from that cache.
+        """
+        details = getattr(usage_data, 'prompt_tokens_details', None)
+        return {
+            'input_tokens': getattr(usage_data, 'prompt_tokens', 0),
+            'output_tokens': getattr(usage_data, 'completion_tokens', 0),
+            'cache_read_tokens': getattr(details, 'cached_tokens', None) or 0,
+            'runtime': runtime
+        }
+
+    def _response_to_dict(self, response: Any, model_name_to_use: str, runtime: float) -> Dict[str, Any]:
+        """Convert an OpenAI ChatCompletion into the provider-neutral response dictionary."""
+        response_message = response.choices[0].message
+        finish_reason = response.choices[0].finish_reason
+
+        # Extract usage data
+        usage_dict = self._usage_to_dict(response.usage, runtime)
+        self.logger.debug(f"Received response from OpenAI. Finish reason: {finish_reason}")
+
+        # Process the response message
+        response_content = []
+        if response_message.content:
+             response_content.append({"type": "text", "text": response_message.content})
+        
+        # Check for tool calls
+        tool_calls = getattr(response_message, 'tool_calls', None)
+        if tool_calls:
+            finish_reason = "tool_calls" # Standardize stop reason for tool use
+            for tool_call in tool_calls:
+                response_content.append(self._tool_call_to_content_part(tool_call.id, tool_call.function.name, tool_call.function.arguments))
+
+        self.logger.debug(f"OpenAI usage: input_tokens={usage_dict['input_tokens']}, output_tokens={usage_dict['output_tokens']}, runtime={runtime}")
+        return {
+            'content': response_content, 
+            'usage': usage_dict,
+            'stop_reason': finish_reason,
+            'model_used': model_name_to_use
+        }
+
+    def stream_chat(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], config: Config) -> Iterator[Dict[str, Any]]:
+        """Stream chat response from OpenAI API, yielding text deltas as they arrive."""
+        if not self.client:
+            yield {'type': 'final', 'response': self._client_not_configured_response()}
+            return
+
+        request_params, model_name_to_use = self._build_request_params(messages, tools, config)
+        request_params["stream"] = True
+        request_params["stream_options"] = {"include_usage": True} # Usage arrives in a final chunk with no choices
+
+        text_accumulated = []
+        tool_call_fragments = {} # index -> {'id', 'name', 'arguments'}
+        finish_reason = None
+        usage_data = None
+
+        try:
+            start_time = time.time()
+            for chunk in self.client.chat.completions.create(**request_params):
+                if getattr(chunk, 'usage', None):
+                    usage_data = chunk.usage
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+                delta = choice.delta
+                if delta is None:
+                    continue
+                if delta.content:
+                    text_accumulated.append(delta.content)
+                    yield {'type': 'text_delta', 'text': delta.content}
+                for tool_call_delta in getattr(delta, 'tool_calls', None) or []:
+                    fragment = tool_call_fragments.setdefault(tool_call_delta.index, {'id': None, 'name': '', 'arguments': ''})
+                    if tool_call_delta.id:
+                        fragment['id'] = tool_call_delta.id
+                    if tool_call_delta.function:
+                        fragment['name'] += tool_call_delta.function.name or ''
+                        fragment['arguments'] += tool_call_delta.function.arguments or ''
+            runtime = time.time() - start_time
         except Exception as e:
-            self.logger.exception("An unexpected error occurred during OpenAI API call")
-            raise RuntimeError(f"An unexpected error occurred interacting with OpenAI: {e}") from e 
\ No newline at end of file
+            raise self._translate_error(e) from e
+
+        response_content = []
+        if text_accumulated:
+            response_content.append({"type": "text", "text": "".join(text_accumulated)})
+        if tool_call_fragments:
+            finish_reason = "tool_calls" # Standardize stop reason for tool use
+            for index in sorted(tool_call_fragments):
+                fragment = tool_call_fragments[index]
+                response_content.append(self._tool_call_to_content_part(fragment['id'], fragment['name'], fragment['arguments'] or "{}"))
+
+        usage_dict = self._usage_to_dict(usage_data, runtime)
+        self.logger.debug(f"OpenAI stream finished. Finish reason: {finish_reason}, usage: {usage_dict}")
+        yield {'type': 'final', 'response': {
+            'content': response_content,
+            'usage': usage_dict,
+            'stop_reason': finish_reason,
+            'model_used': model_name_to_use
+        }}
@@ -3,6 +3,8 @@ from .claude_provider import ClaudeProvider
 # Import placeholder providers once created
 from .openai_provider import OpenAIProvider
 from .gemini_provider import GeminiProvider
+from .client_pool import ProviderClientPool
+from config import Config
 
 class ProviderFactory:
     """Factory class to create provider instances based on name."""
@@ -13,6 +15,12 @@ class ProviderFactory:
         "gemini": GeminiProvider, # Uncomment when implemented
     }
 
+    # Shared pool so SDK clients (and their HTTP connection pools) are reused across requests
+    client_pool = ProviderClientPool(
+        max_size=Config.PROVIDER_POOL_MAX_SIZE,
+        idle_ttl=Config.PROVIDER_POOL_IDLE_SECONDS
+    )
+
     @staticmethod
     def create_provider(provider_name: str, api_key: str = None, client_model: str = None) -> BaseProvider:
         """
@@ -34,4 +42,22 @@ class ProviderFactory:
             raise ValueError(f"Unknown provider: {provider_name}. Available: {list(ProviderFactory._providers.keys())}")
         
         # Instantiate and return the provider, passing the api_key and client_model
-        return provider_class(api_key=api_key, client_model=client_model) 
\ No newline at end of file
+        return provider_class(api_key=api_key, client_model=client_model)
+
+    @staticmethod
+    def get_provider(provider_name: str, api_key: str = None, client_model: str = None) -> BaseProvider:
+        """
+        Borrow a provider instance from the shared client pool, creating it on first use.
+
+        Takes the same arguments as create_provider() and raises the same ValueError for
+        unknown providers. Instances are keyed by (provider, model, hashed API key), so
+        requests carrying the same per-user X-*-API-Key header reuse one warm client.
+        """
+        if provider_name.lower() not in ProviderFactory._providers:
+            raise ValueError(f"Unknown provider: {provider_name}. Available: {list(ProviderFactory._providers.keys())}")
+        return ProviderFactory.client_pool.get(
+            provider_name,
+            api_key,
+            client_model,
+            lambda: ProviderFactory.create_provider(provider_name, api_key=api_key, client_model=client_model)
+        )
@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import Config
+from conversation_summarizer import is_tool_result, message_text, summary_boundary
+
+try:
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    TRANSFORMERS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+class Embedder(ABC):
+    """Turns texts into L2-normalized float32 vectors, one row per text."""
+
+    name: str
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        pass
+
+class TransformersEmbedder(Embedder):
+    """
+    Sentence embeddings on CPU with a Hugging Face encoder (mean pooling over the last hidden
+    state). The model is loaded on first use, so importing this module stays cheap.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 32, max_length: int = 256):
+        self.name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._tokenizer = None
+        self._model = None
+        self._load_lock = threading.Lock()
+
+    def _load(self):
+        with self._load_lock:
+            if self._model is None:
+                logger.info(f"Loading embedding model {self.name} for retrieval memory...")
+                self._tokenizer = AutoTokenizer.from_pretrained(self.name)
+                model = AutoModel.from_pretrained(self.name)
+                model.eval()
+                self._model = model
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if self._model is None:
+            self._load()
+        batches = []
+        with torch.no_grad():
+            for start in range(0, len(texts), self.batch_size):
+                encoded = self._tokenizer(texts[start:start + self.batch_size], padding=True, truncation=True,
+                                          max_length=self.max_length, return_tensors='pt')
+                hidden = self._model(**encoded).last_hidden_state
+                mask = encoded['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                batches.append(torch.nn.functional.normalize(pooled, dim=1).numpy())
+        if not batches:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(batches).astype(np.float32, copy=False)
+
+class HashingEmbedder(Embedder):
+    """
+    Bag-of-words feature hashing: no model download and microsecond-scale, but it only matches
+    shared words, not meaning. Useful offline and as a baseline in benchmarks.
+    """
+
+    TOKEN_PATTERN = re.compile(r"\w+")
+
+    def __init__(self, dimensions: int = 512):
+        self.name = f"hashing-{dimensions}"
+        self.dimensions = dimensions
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in self.TOKEN_PATTERN.findall(text.lower()):
+                digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+                vectors[row, int.from_bytes(digest, 'little') % self.dimensions] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+def create_embedder(name: str) -> Optional[Embedder]:
+    """Embedder for Config.RETRIEVAL_EMBEDDING_MODEL: 'hashing' or a Hugging Face model name."""
+    if name == 'hashing':
+        return HashingEmbedder()
+    if not TRANSFORMERS_AVAILABLE:
+        logger.warning(f"Retrieval memory needs transformers and torch for '{name}'; sending full histories instead.")
+        return None
+    return TransformersEmbedder(name)
+
+def split_turns(messages: Sequence[Dict[str, Any]]) -> List[Tuple[int, int]]:
+    """
+    (start, end) message ranges of the turns in a history. A turn opens with a user message and
+    runs up to the next one; tool results stay with the tool call they answer.
+    """
+    starts = [index for index, message in enumerate(messages)
+              if message.get('role') == 'user' and not is_tool_result(message)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return [(start, end) for start, end in zip(starts, starts[1:] + [len(messages)]) if end > start]
+
+class SessionVectorIndex:
+    """
+    Embeddings of one session's older turns, built incrementally.
+
+    Histories are append-only (see session_store.SessionStore), so each update only embeds the
+    turns added since the last one. `generation` ties the index to one version of the history;
+    a replaced history needs a new index.
+    """
+
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.turns: List[Tuple[int, int]] = []
+        self.vectors: Optional[np.ndarray] = None
+        self.lock = threading.Lock()
+
+    @property
+    def indexed_messages(self) -> int:
+        return self.turns[-1][1] if self.turns else 0
+
+    def update(self, history: Sequence[Dict[str, Any]], end: int, embedder: Embedder) -> int:
+        """Index the turns in history[:end] not indexed yet. Returns the number of new turns."""
+        start = self.indexed_messages
+        if end <= start:
+            return 0
+        new_turns = [(start + a, start + b) for a, b in split_turns(history[start:end])]
+        texts = ['\n'.join(message_text(message) for message in history[a:b]) for a, b in new_turns]
+        vectors = embedder.embed(texts)
+        self.vectors = vectors if self.vectors is None else np.vstack([self.vectors, vectors])
+        self.turns.extend(new_turns)
+        return len(new_turns)
+
+    def query(self, query_vector: np.ndarray, top_k: int) -> List[Tuple[int, int]]:
+        """The top_k most similar turns (cosine similarity), in chronological order."""
+        if self.vectors is None or not self.turns:
+            return []
+        scores = self.vectors @ query_vector
+        if top_k < len(scores):
+            best = np.argpartition(-scores, top_k)[:top_k]
+        else:
+            best = np.arange(len(scores))
+        return [self.turns[index] for index in sorted(best)]
+
+class RetrievalMemory:
+    """
+    Per-session vector indexes over past turns, so a request can send only the turns relevant
+    to the new message plus the recent window instead of the whole history.
+
+    Unlike context-window trimming (which forgets the oldest turns) or rolling summaries (which
+    compress them), old turns stay reachable verbatim when the new message refers back to them.
+    Indexes live in memory, bounded by an LRU over sessions, and are rebuilt on demand after an
+    eviction or restart.
+    """
+
+    def __init__(self, embedder: Optional[Embedder], top_k: int = 4, recent_messages: int = 12, max_sessions: int = 500):
+        self.embedder = embedder
+        self.top_k = top_k
+        self.recent_messages = recent_messages
+        self.max_sessions = max_sessions
+        self._indexes: "OrderedDict[str, SessionVectorIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _index_for(self, session_id: str, generation: int) -> SessionVectorIndex:
+        with self._lock:
+            index = self._indexes.get(session_id)
+            if index is None or index.generation != generation:
+                index = SessionVectorIndex(generation)
+                self._indexes[session_id] = index
+            self._indexes.move_to_end(session_id)
+            while len(self._indexes) > self.max_sessions:
+                self._indexes.popitem(last=False)
+            return index
+
+    def select_history(self, session_id: str, generation: int, history: Sequence[Dict[str, Any]], query_text: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        The messages to send for a turn: the top_k past turns most relevant to `query_text`,
+        followed by the recent window. Returns None when retrieval is unavailable, so the
+        caller sends the history unchanged. Messages are the stored objects, not copies.
+        """
+        if self.embedder is None:
+            return None
+        history = list(history)
+        recent_start = summary_boundary(history, self.recent_messages)
+        if recent_start == 0:
+            return history
+
+        index = self._index_for(session_id, generation)
+        with index.lock:
+            index.update(history, recent_start, self.embedder)
+            if not query_text or not query_text.strip():
+                turns = index.turns[-self.top_k:]
+            else:
+                query_vector = self.embedder.embed([query_text])[0]
+                turns = index.query(query_vector, self.top_k)
+
+        selected = [message for start, end in turns for message in history[start:end]]
+        logger.info(f"Retrieval memory: sending {len(turns)} of {len(index.turns)} past turns "
+                    f"plus {len(history) - recent_start} recent messages for session {session_id}.")
+        return selected + history[recent_start:]
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._indexes.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'sessions': len(self._indexes),
+                'indexed_turns': sum(len(index.turns) for index in self._indexes.values()),
+                'embedder': self.embedder.name if self.embedder else None,
+            }
+
+retrieval_memory = RetrievalMemory(
+    create_embedder(Config.RETRIEVAL_EMBEDDING_MODEL) if Config.RETRIEVAL_MEMORY_ENABLED else None,
+    top_k=Config.RETRIEVAL_TOP_K,
+    recent_messages=Config.RETRIEVAL_RECENT_MESSAGES,
+    max_sessions=Config.RETRIEVAL_MAX_SESSIONS,
+)
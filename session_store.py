@@ -0,0 +1,624 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class SessionConflictError(Exception):
+    """
+    Raised when a conditional write finds that the session changed since it was read,
+    i.e. another request on the same session recorded a turn in the meantime.
+    """
+
+    def __init__(self, session_id: str, expected_version: int, actual_version: int):
+        self.session_id = session_id
+        self.expected_version = expected_version
+        self.actual_version = actual_version
+        super().__init__(
+            f"Session {session_id} was modified by another request "
+            f"(expected version {expected_version}, found {actual_version})."
+        )
+
+def measure_history_bytes(history: List[Dict[str, Any]]) -> int:
+    """Approximate memory footprint of a history as the size of its JSON encoding (base64 images dominate)."""
+    try:
+        return len(json.dumps(history, default=str, separators=(',', ':')))
+    except (TypeError, ValueError):
+        return len(str(history))
+
+class SessionStore(ABC):
+    """
+    Server-side storage for conversation state, keyed by session identifier.
+
+    Session data is a dict: {'conversation_history': [...], 'total_tokens_used': int, 'version': int,
+    'generation': int, 'summary': None or {'text': str, 'covers': int}, 'last_provider': None or str}.
+
+    Histories are append-only logs: a normal turn calls append() with just the messages it
+    added, so the cost of recording a turn does not grow with the length of the conversation.
+    save() replaces the whole history and is only needed when the history is rewritten
+    (e.g. a client supplied its own history, or the conversation was reset).
+
+    Concurrency is optimistic: every write bumps the session's version, and writes given an
+    `expected_version` (the version returned by get()) raise SessionConflictError if another
+    write happened in between. No lock is held while the provider call runs, so requests on
+    different sessions never wait for each other.
+
+    A session can also carry a rolling summary of its first `covers` history messages (see
+    conversation_summarizer.py). `generation` counts how often the history was replaced by
+    save(); replacing the history discards the summary, and save_summary() only accepts a
+    summary computed from the current generation, so it never describes a different history.
+    Storing a summary does not change `version`.
+
+    `last_provider` is the provider that answered the session's latest turn (passed as `provider`
+    to save() or append()), used by NeuroSwitch to keep a conversation on one provider.
+
+    `shares_message_objects` is True when get() hands back the same message objects every turn,
+    which lets context_sanitizer reuse the previous turn's output for them.
+    """
+
+    shares_message_objects = False
+
+    @abstractmethod
+    def get(self, session_id: str) -> Dict[str, Any]:
+        """Return the session data, initializing an empty session if none exists."""
+        pass
+
+    @abstractmethod
+    def save(self, session_id: str, history: List[Dict[str, Any]], tokens: int, expected_version: Optional[int] = None,
+             provider: Optional[str] = None):
+        """Replace the stored history and token count for a session."""
+        pass
+
+    def append(self, session_id: str, messages: List[Dict[str, Any]], tokens: int, expected_version: Optional[int] = None,
+               provider: Optional[str] = None):
+        """
+        Append messages to a session's history and set its token count.
+        Backends should override this; the default rewrites the whole history.
+        """
+        data = self.get(session_id)
+        if expected_version is None:
+            expected_version = data['version']
+        self.save(session_id, list(data['conversation_history']) + list(messages), tokens, expected_version,
+                  provider or data.get('last_provider'))
+
+    @abstractmethod
+    def exists(self, session_id: str) -> bool:
+        """Return True if the session is currently stored (does not create or touch it)."""
+        pass
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Forget a session entirely."""
+        pass
+
+    def reset(self, session_id: str):
+        """Clear a session's history and token count."""
+        self.save(session_id, [], 0)
+
+    def save_summary(self, session_id: str, text: str, covers: int, generation: int) -> bool:
+        """
+        Store a summary of the first `covers` history messages, computed from history `generation`.
+        Returns False (and stores nothing) if the history was replaced since, or if the session
+        already has a summary covering at least as much.
+        """
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        """Return store metrics (sizes, hit/miss and eviction counters)."""
+        return {}
+
+class _SessionEntry:
+    __slots__ = ('history', 'tokens', 'size_bytes', 'last_access', 'version', 'generation', 'summary', 'last_provider')
+
+    def __init__(self, history: List[Dict[str, Any]], tokens: int, size_bytes: int, last_access: float,
+                 version: int = 0, generation: int = 0):
+        self.history = history
+        self.tokens = tokens
+        self.size_bytes = size_bytes
+        self.last_access = last_access
+        self.version = version
+        self.generation = generation
+        self.summary: Optional[Dict[str, Any]] = None
+        self.last_provider: Optional[str] = None
+
+def _check_version(session_id: str, expected_version: Optional[int], actual_version: int):
+    if expected_version is not None and expected_version != actual_version:
+        raise SessionConflictError(session_id, expected_version, actual_version)
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process session store bounded by session count, idle time and total bytes.
+
+    - LRU: at most `max_sessions` sessions are kept; the least recently used is evicted first.
+    - Idle TTL: sessions untouched for `idle_ttl` seconds are evicted (0 disables).
+    - Byte budget: the summed measured size of all histories stays under `max_bytes`
+      (0 disables); LRU sessions are evicted until it fits. A single session larger than
+      the whole budget is still kept, since it is the one in active use.
+
+    A request that read a session before it was evicted can still save its turn (to an empty
+    history); only a write by another request in between is a conflict.
+
+    Eviction counters are reported by stats() so the limits can be tuned from real traffic.
+
+    The store lock only guards bookkeeping and is never held across a provider call. get()
+    returns a snapshot of the history as of that read: turns appended later by other
+    requests are not visible through it.
+    """
+
+    shares_message_objects = True
+
+    def __init__(self, max_sessions: int = 10000, idle_ttl: float = 86400.0, max_bytes: int = 512 * 1024 * 1024):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _SessionEntry]" = OrderedDict()
+        # (version, generation) of evicted sessions, so a request that read one before it was
+        # evicted can still save instead of failing a version check against a fresh entry
+        self._evicted: "OrderedDict[str, Tuple[int, int]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._metrics = {
+            'hits': 0,
+            'misses': 0,
+            'evictions_lru': 0,
+            'evictions_idle': 0,
+            'evictions_bytes': 0,
+            'conflicts': 0,
+        }
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self._metrics['misses'] += 1
+                entry = self._new_entry(session_id, now)
+                self._entries[session_id] = entry
+                logger.info(f"Initialized new history for session ID: {session_id}")
+                self._enforce_limits(protect=session_id)
+            else:
+                self._metrics['hits'] += 1
+                entry.last_access = now
+                self._entries.move_to_end(session_id)
+            history, length = entry.history, len(entry.history)
+            return {
+                # The stored list is only ever extended, so its first `length` items are this read's snapshot
+                'conversation_history': LazyHistory(lambda: history[:length], length),
+                'total_tokens_used': entry.tokens,
+                'version': entry.version,
+                'generation': entry.generation,
+                'summary': entry.summary,
+                'last_provider': entry.last_provider,
+            }
+
+    def save(self, session_id: str, history: List[Dict[str, Any]], tokens: int, expected_version: Optional[int] = None,
+             provider: Optional[str] = None):
+        size_bytes = measure_history_bytes(history)
+        now = time.monotonic()
+        with self._lock:
+            previous = self._entries.get(session_id)
+            self._check_write(session_id, expected_version, previous)
+            if previous is not None:
+                del self._entries[session_id]
+                self._total_bytes -= previous.size_bytes
+            else:
+                previous = self._new_entry(session_id, now)
+            version = previous.version + 1
+            generation = previous.generation + 1
+            # Copy so later appends never extend a list the caller (or an older snapshot) still holds
+            entry = _SessionEntry(list(history), tokens, size_bytes, now, version, generation)
+            entry.last_provider = provider
+            self._entries[session_id] = entry
+            self._total_bytes += size_bytes
+            self._enforce_limits(protect=session_id)
+
+    def append(self, session_id: str, messages: List[Dict[str, Any]], tokens: int, expected_version: Optional[int] = None,
+               provider: Optional[str] = None):
+        # Only the new messages are measured; the stored list is extended in place.
+        size_bytes = measure_history_bytes(messages) if messages else 0
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            self._check_write(session_id, expected_version, entry)
+            if entry is None:
+                entry = self._new_entry(session_id, now)
+                self._entries[session_id] = entry
+            else:
+                self._entries.move_to_end(session_id)
+            entry.history.extend(messages)
+            entry.tokens = tokens
+            entry.size_bytes += size_bytes
+            entry.last_access = now
+            entry.version += 1
+            if provider:
+                entry.last_provider = provider
+            self._total_bytes += size_bytes
+            self._enforce_limits(protect=session_id)
+
+    def save_summary(self, session_id: str, text: str, covers: int, generation: int) -> bool:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry.generation != generation or covers > len(entry.history):
+                return False
+            if entry.summary is not None and entry.summary['covers'] >= covers:
+                return False
+            size_delta = len(text) - (len(entry.summary['text']) if entry.summary else 0)
+            entry.summary = {'text': text, 'covers': covers}
+            entry.size_bytes += size_delta
+            self._total_bytes += size_delta
+            return True
+
+    def _new_entry(self, session_id: str, now: float) -> _SessionEntry:
+        """
+        An empty entry for a session that is not stored. An evicted session keeps counting versions
+        from where it stopped, and starts a new generation since its history is gone. Caller must hold the lock.
+        """
+        evicted = self._evicted.pop(session_id, None)
+        if evicted is None:
+            return _SessionEntry([], 0, 0, now)
+        version, generation = evicted
+        return _SessionEntry([], 0, 0, now, version, generation + 1)
+
+    def _check_write(self, session_id: str, expected_version: Optional[int], entry: Optional[_SessionEntry]):
+        """Raise SessionConflictError if the session moved past expected_version. Caller must hold the lock."""
+        if entry is not None:
+            actual_version = entry.version
+        else:
+            actual_version = self._evicted.get(session_id, (0, 0))[0]
+        try:
+            _check_version(session_id, expected_version, actual_version)
+        except SessionConflictError:
+            self._metrics['conflicts'] += 1
+            raise
+
+    def exists(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._entries
+
+    def delete(self, session_id: str):
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            self._evicted.pop(session_id, None)
+            if entry is not None:
+                self._total_bytes -= entry.size_bytes
+
+    def _evict_idle(self, now: float):
+        """Drop sessions idle longer than idle_ttl. Caller must hold the lock."""
+        if self.idle_ttl <= 0:
+            return
+        while self._entries:
+            oldest_id, oldest = next(iter(self._entries.items()))
+            if now - oldest.last_access < self.idle_ttl:
+                break
+            self._remove(oldest_id, 'evictions_idle')
+
+    def _enforce_limits(self, protect: Optional[str] = None):
+        """Evict LRU sessions until count and byte limits hold, never evicting `protect`. Caller must hold the lock."""
+        while len(self._entries) > self.max_sessions:
+            if not self._evict_lru(protect, 'evictions_lru'):
+                break
+        while self.max_bytes > 0 and self._total_bytes > self.max_bytes:
+            if not self._evict_lru(protect, 'evictions_bytes'):
+                break
+
+    def _evict_lru(self, protect: Optional[str], reason: str) -> bool:
+        for session_id in self._entries:
+            if session_id != protect:
+                self._remove(session_id, reason)
+                return True
+        return False
+
+    def _remove(self, session_id: str, reason: str):
+        entry = self._entries.pop(session_id)
+        self._total_bytes -= entry.size_bytes
+        self._metrics[reason] += 1
+        self._evicted[session_id] = (entry.version, entry.generation)
+        while len(self._evicted) > self.max_sessions:
+            self._evicted.popitem(last=False)
+        logger.info(f"Evicted session {session_id} ({entry.size_bytes} bytes, {len(entry.history)} messages): {reason}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'sessions': len(self._entries),
+                'total_bytes': self._total_bytes,
+                'max_sessions': self.max_sessions,
+                'max_bytes': self.max_bytes,
+                'idle_ttl': self.idle_ttl,
+                **self._metrics,
+            }
+
+class LazyHistory(Sequence):
+    """
+    Read-only view of a stored conversation that loads its messages on first access.
+
+    len() is answered from the stored turn count without touching the message rows, so a
+    request that ends up using a client-provided history never pays for loading the stored one.
+    Concatenation with a list (history + [message]) returns a plain list.
+    """
+
+    def __init__(self, loader, length: int):
+        self._loader = loader
+        self._length = length
+        self._messages: Optional[List[Dict[str, Any]]] = None
+
+    def _load(self) -> List[Dict[str, Any]]:
+        if self._messages is None:
+            self._messages = self._loader()
+            self._length = len(self._messages)
+        return self._messages
+
+    def __len__(self) -> int:
+        return self._length if self._messages is None else len(self._messages)
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self._load())
+
+    def __add__(self, other):
+        return list(self._load()) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self._load())
+
+    def __eq__(self, other):
+        return list(self._load()) == list(other)
+
+    def __repr__(self) -> str:
+        return f"LazyHistory(len={len(self)}, loaded={self._messages is not None})"
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Durable session store in a SQLite database running in WAL mode.
+
+    Several worker processes (e.g. gunicorn workers) can point at the same file: WAL lets
+    readers proceed while one writer commits, and writers wait up to `busy_timeout` seconds
+    for the write lock instead of failing. History is stored one row per message, and get()
+    returns a LazyHistory so message rows are only read when the history is actually used.
+    Version checks run inside the write transaction, so conflicts are detected across processes.
+    Sessions not updated for `idle_ttl` seconds are purged periodically (0 disables).
+    """
+
+    PURGE_INTERVAL_SECONDS = 600
+    ADDED_SESSION_COLUMNS = {
+        'version': 'INTEGER NOT NULL DEFAULT 0',
+        'generation': 'INTEGER NOT NULL DEFAULT 0',
+        'summary': 'TEXT',
+        'summary_covers': 'INTEGER NOT NULL DEFAULT 0',
+        'last_provider': 'TEXT',
+    }
+
+    def __init__(self, path: str, idle_ttl: float = 86400.0, busy_timeout: float = 30.0):
+        self.path = str(path)
+        self.idle_ttl = idle_ttl
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._last_purge = 0.0
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        # Serialize schema setup so workers starting together do not race on the migration
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY,"
+                " total_tokens_used INTEGER NOT NULL DEFAULT 0,"
+                " turn_count INTEGER NOT NULL DEFAULT 0,"
+                " version INTEGER NOT NULL DEFAULT 0,"
+                " generation INTEGER NOT NULL DEFAULT 0,"
+                " summary TEXT,"
+                " summary_covers INTEGER NOT NULL DEFAULT 0,"
+                " last_provider TEXT,"
+                " updated_at REAL NOT NULL)"
+            )
+            # Databases created by earlier versions lack the columns added since
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+            for column, definition in self.ADDED_SESSION_COLUMNS.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE sessions ADD COLUMN {column} {definition}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                " session_id TEXT NOT NULL,"
+                " turn_index INTEGER NOT NULL,"
+                " message TEXT NOT NULL,"
+                " PRIMARY KEY (session_id, turn_index)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; sqlite3 connections must not be shared across threads."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # Durable across process crashes in WAL mode
+            self._local.conn = conn
+        return conn
+
+    def _load_messages(self, session_id: str, turn_count: int) -> List[Dict[str, Any]]:
+        # Bounded by the turn count seen at get() time, so turns appended since are not included
+        rows = self._connection().execute(
+            "SELECT message FROM turns WHERE session_id = ? AND turn_index < ? ORDER BY turn_index", (session_id, turn_count)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT total_tokens_used, turn_count, version, generation, summary, summary_covers, last_provider"
+            " FROM sessions WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+        if row is None:
+            conn.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, total_tokens_used, turn_count, version, updated_at) VALUES (?, 0, 0, 0, ?)",
+                (session_id, time.time())
+            )
+            logger.info(f"Initialized new history for session ID: {session_id}")
+            return {'conversation_history': [], 'total_tokens_used': 0, 'version': 0, 'generation': 0, 'summary': None,
+                    'last_provider': None}
+        tokens, turn_count, version, generation, summary, summary_covers, last_provider = row
+        return {
+            'conversation_history': LazyHistory(lambda: self._load_messages(session_id, turn_count), turn_count),
+            'total_tokens_used': tokens,
+            'version': version,
+            'generation': generation,
+            'summary': {'text': summary, 'covers': summary_covers} if summary is not None else None,
+            'last_provider': last_provider,
+        }
+
+    def _begin_write(self, conn: sqlite3.Connection, session_id: str, expected_version: Optional[int]) -> Tuple[int, int]:
+        """Take the write lock and check the session version. Returns (turn_count, version)."""
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT turn_count, version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        turn_count, version = row if row else (0, 0)
+        try:
+            _check_version(session_id, expected_version, version)
+        except SessionConflictError:
+            conn.execute("ROLLBACK")
+            raise
+        return turn_count, version
+
+    def _finish_write(self, conn: sqlite3.Connection, session_id: str, tokens: int, turn_count: int, version: int,
+                      provider: Optional[str]):
+        conn.execute(
+            "INSERT INTO sessions (session_id, total_tokens_used, turn_count, version, last_provider, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(session_id) DO UPDATE SET total_tokens_used = excluded.total_tokens_used,"
+            " turn_count = excluded.turn_count, version = excluded.version,"
+            " last_provider = COALESCE(excluded.last_provider, sessions.last_provider), updated_at = excluded.updated_at",
+            (session_id, tokens, turn_count, version, provider, time.time())
+        )
+        conn.execute("COMMIT")
+
+    def save(self, session_id: str, history: List[Dict[str, Any]], tokens: int, expected_version: Optional[int] = None,
+             provider: Optional[str] = None):
+        rows = [(session_id, index, json.dumps(message, default=str)) for index, message in enumerate(history)]
+        conn = self._connection()
+        _, version = self._begin_write(conn, session_id, expected_version)
+        try:
+            conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            conn.executemany("INSERT INTO turns (session_id, turn_index, message) VALUES (?, ?, ?)", rows)
+            # A replaced history starts a new generation; its old summary and provider no longer apply
+            conn.execute(
+                "UPDATE sessions SET generation = generation + 1, summary = NULL, summary_covers = 0, last_provider = NULL"
+                " WHERE session_id = ?",
+                (session_id,)
+            )
+            self._finish_write(conn, session_id, tokens, len(rows), version + 1, provider)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._maybe_purge_idle()
+
+    def append(self, session_id: str, messages: List[Dict[str, Any]], tokens: int, expected_version: Optional[int] = None,
+               provider: Optional[str] = None):
+        conn = self._connection()
+        start, version = self._begin_write(conn, session_id, expected_version)
+        try:
+            conn.executemany(
+                "INSERT INTO turns (session_id, turn_index, message) VALUES (?, ?, ?)",
+                [(session_id, start + offset, json.dumps(message, default=str)) for offset, message in enumerate(messages)]
+            )
+            self._finish_write(conn, session_id, tokens, start + len(messages), version + 1, provider)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._maybe_purge_idle()
+
+    def save_summary(self, session_id: str, text: str, covers: int, generation: int) -> bool:
+        updated = self._connection().execute(
+            "UPDATE sessions SET summary = ?, summary_covers = ?"
+            " WHERE session_id = ? AND generation = ? AND turn_count >= ? AND summary_covers < ?",
+            (text, covers, session_id, generation, covers, covers)
+        ).rowcount
+        return updated == 1
+
+    def exists(self, session_id: str) -> bool:
+        row = self._connection().execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row is not None
+
+    def delete(self, session_id: str):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _maybe_purge_idle(self):
+        if self.idle_ttl <= 0:
+            return
+        now = time.time()
+        if now - self._last_purge < self.PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = now
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cutoff = now - self.idle_ttl
+            conn.execute(
+                "DELETE FROM turns WHERE session_id IN (SELECT session_id FROM sessions WHERE updated_at < ?)", (cutoff,)
+            )
+            purged = conn.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,)).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if purged:
+            logger.info(f"Purged {purged} idle sessions from {self.path}")
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._connection()
+        sessions, turns = conn.execute("SELECT COUNT(*), COALESCE(SUM(turn_count), 0) FROM sessions").fetchone()
+        return {
+            'backend': 'sqlite',
+            'path': self.path,
+            'sessions': sessions,
+            'turns': turns,
+            'file_bytes': os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            'idle_ttl': self.idle_ttl,
+        }
+
+def create_session_store() -> SessionStore:
+    """Build the session store selected by Config.SESSION_BACKEND ('memory' or 'sqlite')."""
+    backend = Config.SESSION_BACKEND.lower()
+    if backend == 'sqlite':
+        logger.info(f"Using SQLite session store at {Config.SESSION_SQLITE_PATH}")
+        return SQLiteSessionStore(
+            path=Config.SESSION_SQLITE_PATH,
+            idle_ttl=Config.SESSION_IDLE_TTL_SECONDS,
+        )
+    if backend != 'memory':
+        raise ValueError(f"Unknown SESSION_BACKEND '{Config.SESSION_BACKEND}'. Expected 'memory' or 'sqlite'.")
+    if Config.SERVER_WORKERS > 1:
+        # Each worker would keep its own sessions: a conversation (browser or API) is only found
+        # when the next request happens to reach the worker that served the previous one
+        logger.error(f"SESSION_BACKEND=memory with WEB_CONCURRENCY={Config.SERVER_WORKERS}: sessions are per worker "
+                     f"process and conversations will be lost between requests. Set SESSION_BACKEND=sqlite.")
+    return MemorySessionStore(
+        max_sessions=Config.SESSION_MAX_SESSIONS,
+        idle_ttl=Config.SESSION_IDLE_TTL_SECONDS,
+        max_bytes=Config.SESSION_MAX_BYTES,
+    )
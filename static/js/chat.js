@@ -109,6 +109,53 @@ function appendMessage(content, sender = 'ai', provider = 'claude', toolName = n
     messageWrapper.appendChild(messageDiv);
     messagesDiv.appendChild(messageWrapper);
     messagesDiv.scrollTop = messagesDiv.scrollHeight;
+    return messageWrapper;
+}
+
+// Re-render the markdown body of an AI message created by appendMessage (used while streaming)
+function updateMessageContent(messageWrapper, content) {
+    const innerDiv = messageWrapper?.querySelector('.prose');
+    if (!innerDiv) return;
+    try {
+        innerDiv.innerHTML = marked.parse(content);
+        innerDiv.querySelectorAll('pre code').forEach((block) => {
+            hljs.highlightElement(block);
+        });
+    } catch (e) {
+        innerDiv.textContent = content;
+    }
+    const messagesDiv = document.getElementById('chat-messages');
+    messagesDiv.scrollTop = messagesDiv.scrollHeight;
+}
+
+// Read a text/event-stream response body and call onEvent(eventName, parsedData) for each frame
+async function readServerSentEvents(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let eventName = 'message';
+            const dataLines = [];
+            frame.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+            });
+            if (dataLines.length) {
+                try {
+                    onEvent(eventName, JSON.parse(dataLines.join('\n')));
+                } catch (e) {
+                    console.error('Failed to parse stream event:', e);
+                }
+            }
+        }
+    }
 }
 
 // Event Listeners
@@ -130,9 +177,9 @@ document.getElementById('file-input').addEventListener('change', async (e) => {
             const data = await response.json();
             
             if (data.success) {
-                currentImageData = data.image_data;
+                currentImageData = data.image_id; // Handle of the stored image; the bytes stay on the server
                 currentMediaType = data.media_type;
-                document.getElementById('preview-img').src = `data:${data.media_type};base64,${data.image_data}`;
+                document.getElementById('preview-img').src = URL.createObjectURL(file);
                 document.getElementById('image-preview').classList.remove('hidden');
             }
         } catch (error) {
@@ -190,6 +237,7 @@ async function sendChatMessage() {
     const messageInput = document.getElementById('message-input');
     const message = messageInput.value.trim();
     const currentImage = currentImageData;
+    const currentImageType = currentMediaType;
     const currentMode = selectedMode;
 
     if (!message && !currentImage) return;
@@ -223,7 +271,8 @@ async function sendChatMessage() {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 message: message,
-                image: currentImage,
+                image_id: currentImage,
+                media_type: currentImageType,
                 mode: currentMode
             })
         });
@@ -445,6 +494,7 @@ async function sendChatMessage() {
     const messageInput = document.getElementById('message-input');
     const message = messageInput.value.trim();
     const currentImage = currentImageData; // Capture image data
+    const currentImageType = currentMediaType;
 
     if (!message && !currentImage) return;
 
@@ -468,10 +518,50 @@ async function sendChatMessage() {
     try {
         const response = await fetch('/chat', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ message: message, image: currentImage })
+            headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+            body: JSON.stringify({ message: message, image_id: currentImage, media_type: currentImageType, stream: true })
         });
 
+        // --- Streaming response: render tokens as they arrive ---
+        if (response.ok && (response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+            let streamedText = '';
+            let streamProvider = initialProviderSelection;
+            let streamMessage = null;
+            let doneData = null;
+
+            await readServerSentEvents(response, (eventName, eventData) => {
+                if (eventName === 'meta') {
+                    streamProvider = eventData.provider_used || streamProvider;
+                    updateNeuroSwitchIndicator(eventData.neuroswitch_active === true, eventData.fallback_reason);
+                } else if (eventName === 'delta') {
+                    if (!streamMessage) {
+                        document.getElementById('thinking-indicator')?.remove();
+                        streamMessage = appendMessage('', 'ai', streamProvider, null, false);
+                    }
+                    streamedText += eventData.text || '';
+                    updateMessageContent(streamMessage, streamedText);
+                } else if (eventName === 'done' || eventName === 'error') {
+                    // 'error' carries the same fields as 'done', e.g. when the turn could not be saved
+                    doneData = eventData;
+                }
+            });
+
+            document.getElementById('thinking-indicator')?.remove();
+            const finalText = doneData?.response || streamedText || '[No response text]';
+            if (!streamMessage) {
+                appendMessage(finalText, 'ai', doneData?.provider_used || streamProvider, null, false);
+            } else if (finalText !== streamedText) {
+                // e.g. the provider failed mid-stream and the server returned an error message
+                updateMessageContent(streamMessage, finalText);
+            }
+            if (doneData) {
+                const tokenUsage = doneData.token_usage || {};
+                if (tokenUsage.total_tokens !== undefined) { updateTokenUsage(tokenUsage); }
+                updateNeuroSwitchIndicator(doneData.neuroswitch_active === true, doneData.fallback_reason);
+            }
+            return;
+        }
+
         document.getElementById('thinking-indicator')?.remove();
 
         let data = {};
@@ -567,9 +657,9 @@ document.addEventListener('DOMContentLoaded', () => {
                      const response = await fetch('/upload', { method: 'POST', body: formData });
                      const data = await response.json();
                      if (data.success) {
-                         currentImageData = data.image_data;
+                         currentImageData = data.image_id; // Handle of the stored image; the bytes stay on the server
                          currentMediaType = data.media_type;
-                         previewImg.src = `data:${data.media_type};base64,${data.image_data}`;
+                         previewImg.src = URL.createObjectURL(file);
                          imagePreviewDiv.classList.remove('hidden');
                          adjustTokenBarPosition(); // Adjust token bar after image preview shown
                      } else {
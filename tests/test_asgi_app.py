@@ -0,0 +1,132 @@
+import io
+import json
+import unittest
+
+from PIL import Image
+from quart.datastructures import FileStorage
+
+import asgi_app
+import chat_service
+from providers.base_provider import BaseProvider
+from session_store import MemorySessionStore
+
+
+def _png_bytes():
+    output = io.BytesIO()
+    Image.new('RGB', (8, 8), color=(200, 30, 30)).save(output, format='PNG')
+    return output.getvalue()
+
+
+class AsyncEchoProvider(BaseProvider):
+    """Provider stand-in whose achat echoes the last user text; `during_call` runs while the reply is pending."""
+
+    def __init__(self):
+        self.sent = []
+        self.during_call = None
+
+    @property
+    def name(self) -> str:
+        return "claude"
+
+    def chat(self, messages, tools, config):
+        raise AssertionError("The ASGI app must await achat()")
+
+    async def achat(self, messages, tools, config):
+        self.sent.append(messages)
+        if self.during_call:
+            self.during_call()
+        texts = [block['text'] for block in messages[-1]['content'] if block.get('type') == 'text']
+        return {
+            'content': f"echo:{' '.join(texts)}",
+            'usage': {'input_tokens': 3, 'output_tokens': 2, 'runtime': 0.0},
+            'model_used': 'stub',
+        }
+
+
+class TestAsgiApp(unittest.IsolatedAsyncioTestCase):
+    """The Quart app serves /chat, /reset and /health with the same contract as the Flask app."""
+
+    def setUp(self):
+        self.original_store = chat_service.api_client_session_store
+        self.original_get_provider = chat_service.ProviderFactory.get_provider
+        chat_service.api_client_session_store = MemorySessionStore()
+        self.provider = AsyncEchoProvider()
+        chat_service.ProviderFactory.get_provider = staticmethod(lambda *args, **kwargs: self.provider)
+        self.client = asgi_app.app.test_client()
+        self.headers = {'X-Session-ID': 'asgi-session'}
+
+    def tearDown(self):
+        chat_service.api_client_session_store = self.original_store
+        chat_service.ProviderFactory.get_provider = self.original_get_provider
+
+    def _stored_messages(self):
+        return list(chat_service.api_client_session_store.get('asgi-session')['conversation_history'])
+
+    async def _chat(self, message):
+        return await self.client.post('/chat', json={'message': message, 'requested_provider': 'claude'}, headers=self.headers)
+
+    async def test_json_chat(self):
+        response = await self._chat('hello')
+        self.assertEqual(response.status_code, 200)
+        body = await response.get_json()
+        self.assertEqual(body['response'], 'echo:hello')
+        self.assertEqual(body['provider_used'], 'claude')
+        self.assertEqual(body['token_usage']['input_tokens'], 3)
+
+        await self._chat('again')
+        self.assertEqual([m['role'] for m in self._stored_messages()], ['user', 'assistant', 'user', 'assistant'])
+        self.assertIn('echo:hello', str(self.provider.sent[1]))  # The second turn was sent the first
+
+    async def test_multipart_chat_with_image_and_history(self):
+        history = [{'role': 'user', 'content': 'earlier'}, {'role': 'assistant', 'content': 'noted'}]
+        response = await self.client.post(
+            '/chat',
+            form={'message': 'what is this', 'requested_provider': 'claude', 'history': json.dumps(history)},
+            files={'image': FileStorage(io.BytesIO(_png_bytes()), 'red.png')},
+            headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await response.get_json())['response'], 'echo:what is this')
+        stored = self._stored_messages()
+        self.assertEqual(stored[:2], history)
+        image_block = stored[2]['content'][0]
+        self.assertEqual(image_block['type'], 'image')
+        self.assertEqual(image_block['source']['media_type'], 'image/png')
+
+    async def test_multipart_rejects_non_images(self):
+        response = await self.client.post(
+            '/chat',
+            form={'message': 'bad'},
+            files={'image': FileStorage(io.BytesIO(b'not an image'), 'fake.png')},
+            headers=self.headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+    async def test_conflicting_turn_is_rejected(self):
+        await self._chat('first')
+        # Another request on the session records a turn while this one waits for the provider
+        self.provider.during_call = lambda: chat_service.api_client_session_store.append(
+            'asgi-session', [{'role': 'user', 'content': 'other'}, {'role': 'assistant', 'content': 'other reply'}], 10)
+        response = await self._chat('second')
+        self.assertEqual(response.status_code, 409)
+        body = await response.get_json()
+        self.assertEqual(body['error'], 'session_conflict')
+        self.assertEqual(body['discarded_response'], 'echo:second')
+        self.assertNotIn('second', str(self._stored_messages()))
+
+    async def test_reset(self):
+        await self._chat('hello')
+        response = await self.client.post('/reset', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._stored_messages(), [])
+
+    async def test_health(self):
+        response = await self.client.get('/health')
+        self.assertEqual(response.status_code, 200)
+        body = await response.get_json()
+        self.assertEqual(body['status'], 'ok')
+        self.assertIn('neuroswitch', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
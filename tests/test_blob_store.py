@@ -0,0 +1,75 @@
+import base64
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import context_sanitizer
+import message_model
+from blob_store import FileBlobStore, blob_id_for, blob_store
+
+
+class TestFileBlobStore(unittest.TestCase):
+    """Uploaded images are stored once by content hash and read back by id."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = FileBlobStore(self.directory, cache_bytes=1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_round_trip_and_dedupe(self):
+        data = b'\x89PNG\r\n\x1a\n' + b'x' * 4096
+        blob_id = self.store.put(data)
+        self.assertEqual(blob_id, blob_id_for(data))
+        self.assertEqual(self.store.put(data), blob_id)
+        # Larger than the memory cache, so this read comes from disk, also through a fresh instance
+        self.assertEqual(FileBlobStore(self.directory).get(blob_id), data)
+        self.assertTrue(self.store.exists(blob_id))
+
+    def test_put_stream_matches_put(self):
+        data = bytes(range(256)) * 1024  # Several chunks
+        blob_id = self.store.put_stream(io.BytesIO(data))
+        self.assertEqual(blob_id, blob_id_for(data))
+        self.assertEqual(self.store.get(blob_id), data)
+        self.assertEqual(self.store.put_stream(io.BytesIO(data)), blob_id)
+        self.assertEqual(os.listdir(self.directory), [blob_id[:2]])  # No temporary files left behind
+
+    def test_rejects_ids_that_are_not_hashes(self):
+        self.assertIsNone(self.store.get('../../etc/passwd'))
+        self.assertFalse(self.store.exists('0' * 64))
+
+
+class TestBlobImageEncoding(unittest.TestCase):
+    """History keeps the blob handle; the image bytes are only attached when a request is sent."""
+
+    def setUp(self):
+        self.data = b'\x89PNG\r\n\x1a\n' + b'y' * 100
+        self.blob_id = blob_store.put(self.data)
+        self.history = [{'role': 'user', 'content': [
+            {'type': 'image', 'source': {'type': 'blob', 'media_type': 'image/png', 'blob_id': self.blob_id}},
+            {'type': 'text', 'text': 'what is this?'},
+        ]}]
+
+    def test_sanitized_history_references_blob_until_sent(self):
+        encoded = base64.b64encode(self.data).decode('ascii')
+        expected_parts = {
+            'claude': lambda wire: wire[0]['content'][0]['source']['data'] == encoded,
+            'openai': lambda wire: wire[0]['content'][0]['image_url']['url'] == f"data:image/png;base64,{encoded}",
+            'gemini': lambda wire: wire[0]['parts'][0]['inline_data']['data'] == self.data,
+        }
+        for provider, check in expected_parts.items():
+            sanitized = context_sanitizer.sanitize_history(self.history, provider, None)
+            self.assertNotIn(encoded, str(sanitized), provider)
+            self.assertTrue(check(message_model.to_wire(sanitized, provider)), provider)
+
+    def test_missing_blob_becomes_placeholder_text(self):
+        history = [{'role': 'user', 'content': [{'type': 'image', 'source': {'type': 'blob', 'media_type': 'image/png', 'blob_id': 'f' * 64}}]}]
+        wire = message_model.to_wire(history, 'claude')
+        self.assertEqual(wire[0]['content'][0]['type'], 'text')
+
+
+if __name__ == '__main__':
+    unittest.main()
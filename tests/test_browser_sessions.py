@@ -0,0 +1,120 @@
+import unittest
+
+import app as fusion_app
+import chat_service
+import context_sanitizer
+import session_store
+from config import Config
+from providers.base_provider import BaseProvider
+from session_store import MemorySessionStore
+
+
+class EchoProvider(BaseProvider):
+    """Provider stand-in that echoes the last user message and records the history it was sent."""
+
+    def __init__(self):
+        self.sent = []
+
+    @property
+    def name(self) -> str:
+        return "claude"
+
+    def chat(self, messages, tools, config):
+        self.sent.append(messages)
+        return {
+            'content': f"echo:{messages[-1]['content'][0]['text']}",
+            'usage': {'input_tokens': 1, 'output_tokens': 1, 'runtime': 0},
+            'model_used': 'stub',
+        }
+
+
+class TestBrowserSessions(unittest.TestCase):
+    """Browser conversations are keyed by the ID in the Flask cookie and stored server-side."""
+
+    def setUp(self):
+        self.original_store = chat_service.api_client_session_store
+        self.original_get_provider = fusion_app.ProviderFactory.get_provider
+        chat_service.api_client_session_store = MemorySessionStore()
+        self.provider = EchoProvider()
+        fusion_app.ProviderFactory.get_provider = staticmethod(lambda *args, **kwargs: self.provider)
+        self.client = fusion_app.app.test_client()
+        with self.client.session_transaction() as browser_session:
+            browser_session['provider'] = 'claude'
+
+    def tearDown(self):
+        chat_service.api_client_session_store = self.original_store
+        fusion_app.ProviderFactory.get_provider = self.original_get_provider
+
+    def _cookie_session(self):
+        with self.client.session_transaction() as browser_session:
+            return dict(browser_session)
+
+    def test_history_follows_the_cookie_id(self):
+        self.assertEqual(self.client.post('/chat', json={'message': 'first'}).status_code, 200)
+        self.assertEqual(self.client.post('/chat', json={'message': 'second'}).status_code, 200)
+
+        cookie = self._cookie_session()
+        session_id = cookie['neuroswitch_flask_session_id']
+        self.assertNotIn('conversation_history', cookie)
+        stored = list(chat_service.api_client_session_store.get(session_id)['conversation_history'])
+        self.assertEqual([m['role'] for m in stored], ['user', 'assistant', 'user', 'assistant'])
+        # The second turn was sent the first one from the store
+        self.assertIn('echo:first', str(self.provider.sent[1]))
+
+    def test_other_browsers_do_not_share_history(self):
+        self.client.post('/chat', json={'message': 'first'})
+        other = fusion_app.app.test_client()
+        with other.session_transaction() as browser_session:
+            browser_session['provider'] = 'claude'
+        other.post('/chat', json={'message': 'hello'})
+        self.assertNotIn('first', str(self.provider.sent[1]))
+
+    def test_only_stored_histories_are_cached_by_the_sanitizer(self):
+        context_sanitizer.default_cache.clear()
+        client_history = [{'role': 'user', 'content': 'earlier'}, {'role': 'assistant', 'content': 'ok'}]
+        self.client.post('/chat', json={'message': 'hi', 'history': client_history}, headers={'X-Session-ID': 'api-1'})
+        self.assertEqual(context_sanitizer.default_cache.stats()['entries'], 0)
+        self.client.post('/chat', json={'message': 'hi'})
+        self.assertEqual(context_sanitizer.default_cache.stats()['entries'], 1)
+
+    def test_cookie_history_from_older_versions_is_moved_server_side(self):
+        old_history = [
+            {'role': 'user', 'content': [{'type': 'text', 'text': 'from the cookie'}]},
+            {'role': 'assistant', 'content': 'noted'},
+        ]
+        with self.client.session_transaction() as browser_session:
+            browser_session['neuroswitch_flask_session_id'] = 'cookie-id'
+            browser_session['conversation_history'] = old_history
+            browser_session['total_tokens_used'] = 10
+        self.client.post('/chat', json={'message': 'next'})
+
+        self.assertNotIn('conversation_history', self._cookie_session())
+        stored = list(chat_service.api_client_session_store.get('cookie-id')['conversation_history'])
+        self.assertEqual(stored[:2], old_history)
+        self.assertEqual(len(stored), 4)
+
+
+class TestMemoryBackendWithWorkers(unittest.TestCase):
+    """The per-process memory store is flagged when the app runs with several workers."""
+
+    def setUp(self):
+        self.original = (Config.SESSION_BACKEND, Config.SERVER_WORKERS)
+        Config.SESSION_BACKEND = 'memory'
+
+    def tearDown(self):
+        Config.SESSION_BACKEND, Config.SERVER_WORKERS = self.original
+
+    def test_warns_with_several_workers(self):
+        Config.SERVER_WORKERS = 4
+        with self.assertLogs('session_store', level='ERROR') as logs:
+            session_store.create_session_store()
+        self.assertIn('SESSION_BACKEND=sqlite', logs.output[0])
+
+    def test_single_worker_is_quiet(self):
+        Config.SERVER_WORKERS = 1
+        with self.assertNoLogs('session_store', level='ERROR'):
+            session_store.create_session_store()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import asyncio
+import unittest
+
+import anthropic
+from anthropic.types import Message
+
+from config import Config
+from providers.claude_provider import ClaudeProvider
+
+MESSAGES = [{'role': 'user', 'content': [{'type': 'text', 'text': 'hello'}]}]
+
+
+class StubMessageStream:
+    """Stand-in for the SDK's MessageStream: yields `texts`, then raises `error` if one is given."""
+
+    def __init__(self, texts, final_message, error=None):
+        self.texts = texts
+        self.final_message = final_message
+        self.error = error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def text_stream(self):
+        yield from self.texts
+        if self.error:
+            raise self.error
+
+    def get_final_message(self):
+        return self.final_message
+
+
+class StubAnthropicClient:
+    """Local stand-in for anthropic.Anthropic whose messages.stream() replays a canned stream."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.messages = self
+
+    def stream(self, **request_params):
+        return self._stream
+
+
+class TestClaudeWithoutApiKey(unittest.TestCase):
+    """Without an API key every call path answers with the same 'not configured' error response."""
+
+    def setUp(self):
+        self.provider = ClaudeProvider(api_key=None)
+
+    def assert_not_configured(self, response):
+        self.assertEqual(response['stop_reason'], 'error')
+        self.assertIn('not configured', response['content'][0]['text'])
+
+    def test_chat(self):
+        self.assert_not_configured(self.provider.chat(MESSAGES, [], Config))
+
+    def test_achat(self):
+        self.assert_not_configured(asyncio.run(self.provider.achat(MESSAGES, [], Config)))
+        self.assertIsNone(self.provider.async_client)
+
+    def test_stream_chat(self):
+        events = list(self.provider.stream_chat(MESSAGES, [], Config))
+        self.assertEqual([event['type'] for event in events], ['final'])
+        self.assert_not_configured(events[0]['response'])
+
+
+class TestClaudeStreaming(unittest.TestCase):
+    """stream_chat yields the text deltas, then one final response with the message's usage."""
+
+    def setUp(self):
+        self.provider = ClaudeProvider(api_key='key')
+        self.final_message = Message.model_validate({
+            'id': 'msg_1', 'type': 'message', 'role': 'assistant', 'model': 'claude-test',
+            'content': [{'type': 'text', 'text': 'Hello'}], 'stop_reason': 'end_turn', 'stop_sequence': None,
+            'usage': {'input_tokens': 12, 'output_tokens': 7, 'cache_read_input_tokens': 30, 'cache_creation_input_tokens': 4},
+        })
+
+    def stream(self, stream):
+        self.provider.client = StubAnthropicClient(stream)
+        return self.provider.stream_chat(MESSAGES, [], Config)
+
+    def test_deltas_and_final_usage(self):
+        events = list(self.stream(StubMessageStream(['Hel', 'lo'], self.final_message)))
+        self.assertEqual([event['text'] for event in events[:-1]], ['Hel', 'lo'])
+        final = events[-1]
+        self.assertEqual(final['type'], 'final')
+        self.assertEqual(final['response']['content'], 'Hello')
+        self.assertEqual(final['response']['stop_reason'], 'end_turn')
+        usage = final['response']['usage']
+        self.assertEqual((usage['input_tokens'], usage['output_tokens']), (46, 7))  # Cached prompt tokens included
+        self.assertEqual((usage['cache_read_tokens'], usage['cache_write_tokens']), (30, 4))
+
+    def test_error_mid_stream_is_raised_after_the_deltas(self):
+        error = anthropic.APIConnectionError(request=None)
+        events = self.stream(StubMessageStream(['Hel'], self.final_message, error))
+        self.assertEqual(next(events), {'type': 'text_delta', 'text': 'Hel'})
+        with self.assertRaises(ConnectionError):
+            next(events)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import copy
+import unittest
+
+import context_sanitizer
+import message_model
+from context_sanitizer import SanitizationCache
+
+
+def text_turn(i):
+    return [
+        {'role': 'user', 'content': [{'type': 'text', 'text': f"question {i}"}]},
+        {'role': 'assistant', 'content': f"answer {i}"},
+    ]
+
+
+def tool_turn(i):
+    return [
+        {'role': 'user', 'content': [{'type': 'text', 'text': f"look up {i}"}]},
+        {'role': 'assistant', 'content': [
+            {'type': 'text', 'text': 'Let me look that up.'},
+            {'type': 'tool_use', 'id': f"call_{i}", 'name': 'search', 'input': {'query': f"topic {i}"}},
+        ]},
+        {'role': 'user', 'content': [{'type': 'tool_result', 'tool_use_id': f"call_{i}", 'tool_name': 'search', 'content': f"result {i}"}]},
+        {'role': 'assistant', 'content': f"found {i}"},
+    ]
+
+
+class CountingEncoder:
+    """Wraps message_model.encode_message to count how many messages are actually encoded."""
+
+    def __init__(self):
+        self.calls = 0
+        self.original = message_model.encode_message
+
+    def __call__(self, message, provider, state=message_model.OPENAI_INITIAL_STATE):
+        self.calls += 1
+        return self.original(message, provider, state)
+
+
+class TestSanitizationCache(unittest.TestCase):
+    """Cached passes reuse the previous turn's output and always match a full pass."""
+
+    def setUp(self):
+        self.cache = SanitizationCache()
+        self.history = text_turn(0) + tool_turn(1) + text_turn(2)
+        self.encoder = CountingEncoder()
+        message_model.encode_message = self.encoder
+
+    def tearDown(self):
+        message_model.encode_message = self.encoder.original
+
+    def sanitize(self, history, provider='openai', key='session-1'):
+        return context_sanitizer.sanitize_history(history, provider, self.cache, key=key)
+
+    @staticmethod
+    def reference(history, provider='openai'):
+        return context_sanitizer.sanitize_history(copy.deepcopy(history), provider, None)
+
+    def test_prefix_is_reused(self):
+        self.sanitize(self.history)
+        self.encoder.calls = 0
+        history = self.history + text_turn(3)
+        result = self.sanitize(history)
+        self.assertEqual(self.encoder.calls, 2)  # Only the new turn
+        self.assertEqual(result, self.reference(history))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_changed_last_message_is_re_encoded(self):
+        history = self.history + [{'role': 'user', 'content': [{'type': 'text', 'text': 'first draft'}]}]
+        self.sanitize(history)
+        retried = self.history + [{'role': 'user', 'content': [{'type': 'text', 'text': 'second draft'}]}]
+        result = self.sanitize(retried)
+        self.assertEqual(result, self.reference(retried))
+        self.assertEqual(result[-1]['content'][0]['text'], 'second draft')
+
+    def test_providers_are_cached_separately(self):
+        openai_output = self.sanitize(self.history, 'openai')
+        self.encoder.calls = 0
+        claude_output = self.sanitize(self.history, 'claude')
+        self.assertEqual(self.encoder.calls, len(self.history))  # No reuse of OpenAI output
+        self.assertEqual(claude_output, self.reference(self.history, 'claude'))
+        self.assertNotEqual(claude_output, openai_output)
+        self.assertEqual(self.cache.stats()['entries'], 2)
+
+    def test_openai_tool_sequence_resumes_mid_sequence(self):
+        # The checkpoint ends right after the assistant's tool call, before its result
+        before_result = text_turn(0) + tool_turn(1)[:2]
+        self.sanitize(before_result)
+        history = before_result + tool_turn(1)[2:] + text_turn(2)
+        self.encoder.calls = 0
+        result = self.sanitize(history)
+        self.assertEqual(self.encoder.calls, 4)
+        self.assertEqual(result, self.reference(history))
+        self.assertEqual(result[4]['role'], 'tool')
+
+    def test_without_a_key_nothing_is_cached(self):
+        context_sanitizer.sanitize_history(self.history, 'openai', self.cache)
+        self.assertEqual(self.cache.stats(), {'entries': 0, 'bytes': 0, 'hits': 0, 'misses': 0})
+
+    def test_cache_is_bounded_by_bytes(self):
+        self.sanitize(self.history, key='a')
+        one_entry = self.cache.stats()['bytes']
+        self.cache.max_bytes = int(one_entry * 2.5)
+        for key in ['b', 'c', 'd']:
+            self.sanitize(self.history, key=key)
+        stats = self.cache.stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertLessEqual(stats['bytes'], self.cache.max_bytes)
+        self.cache.max_bytes = one_entry - 1  # Too large on its own: not kept
+        self.sanitize(self.history + text_turn(3), key='e')
+        self.assertLessEqual(self.cache.stats()['bytes'], self.cache.max_bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
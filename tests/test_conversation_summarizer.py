@@ -0,0 +1,96 @@
+import unittest
+
+import conversation_summarizer
+from config import Config
+from conversation_summarizer import ConversationSummarizer
+from providers.base_provider import BaseProvider
+from session_store import MemorySessionStore
+
+
+class StubProvider(BaseProvider):
+    """Provider stand-in that returns a fixed response and records how it was created."""
+
+    def __init__(self, response):
+        self.response = response
+        self.created_with = None
+
+    @property
+    def name(self) -> str:
+        return "gemini"
+
+    def chat(self, messages, tools, config):
+        return self.response
+
+
+def conversation(turns: int):
+    history = []
+    for i in range(turns):
+        history.append({'role': 'user', 'content': [{'type': 'text', 'text': f"question {i}"}]})
+        history.append({'role': 'assistant', 'content': f"answer {i}"})
+    return history
+
+
+class TestSummarizerProviderFailures(unittest.TestCase):
+    """A failed or empty summarization response must leave the session's history and summary untouched."""
+
+    def setUp(self):
+        self.original = (Config.SUMMARY_PROVIDER, Config.SUMMARY_MODEL, Config.GEMINI_API_KEY,
+                         conversation_summarizer.ProviderFactory.get_provider)
+        Config.SUMMARY_PROVIDER, Config.SUMMARY_MODEL, Config.GEMINI_API_KEY = 'gemini', None, 'test-gemini-key'
+        self.provider = StubProvider({'content': [{'type': 'text', 'text': 'fresh summary'}], 'usage': {}})
+
+        def get_provider(provider_name, api_key=None, client_model=None):
+            self.provider.created_with = (provider_name, api_key, client_model)
+            return self.provider
+        conversation_summarizer.ProviderFactory.get_provider = staticmethod(get_provider)
+
+        self.store = MemorySessionStore()
+        self.store.save('s1', conversation(40), tokens=0)
+        data = self.store.get('s1')
+        self.store.save_summary('s1', 'earlier summary', 10, data['generation'])
+        self.summarizer = ConversationSummarizer(max_workers=1)
+
+    def tearDown(self):
+        (Config.SUMMARY_PROVIDER, Config.SUMMARY_MODEL, Config.GEMINI_API_KEY,
+         conversation_summarizer.ProviderFactory.get_provider) = self.original
+        self.summarizer._executor.shutdown(wait=True)
+
+    def _snapshot(self):
+        data = self.store.get('s1')
+        return list(data['conversation_history']), data.get('summary')
+
+    def test_provider_gets_the_configured_api_key(self):
+        self.assertTrue(self.summarizer.summarize('s1', self.store, self.store.get('s1')))
+        self.assertEqual(self.provider.created_with, ('gemini', 'test-gemini-key', 'gemini-1.5-flash-latest'))
+        self.assertEqual(self.store.get('s1')['summary']['text'], 'fresh summary')
+
+    def test_error_response_is_not_stored(self):
+        self.provider.response = {
+            'content': [{'type': 'text', 'text': 'Gemini client not configured (check API key?). Cannot process request.'}],
+            'usage': {'input_tokens': 0, 'output_tokens': 0},
+            'stop_reason': 'error'
+        }
+        before = self._snapshot()
+        self.summarizer._run('s1', self.store, self.store.get('s1'))
+        self.assertEqual(self._snapshot(), before)
+        self.assertEqual(before[1], {'text': 'earlier summary', 'covers': 10})
+        self.assertEqual(self.summarizer.stats()['failed'], 1)
+        self.assertEqual(self.summarizer.stats()['stored'], 0)
+
+    def test_empty_response_is_not_stored(self):
+        self.provider.response = {'content': [{'type': 'text', 'text': '  '}], 'usage': {}}
+        before = self._snapshot()
+        with self.assertRaises(RuntimeError):
+            self.summarizer.summarize('s1', self.store, self.store.get('s1'))
+        self.assertEqual(self._snapshot(), before)
+
+    def test_missing_api_key_skips_summarization(self):
+        Config.GEMINI_API_KEY = None
+        before = self._snapshot()
+        self.assertFalse(self.summarizer.summarize('s1', self.store, self.store.get('s1')))
+        self.assertIsNone(self.provider.created_with)
+        self.assertEqual(self._snapshot(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,262 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import google.generativeai as genai
+    from google.ai import generativelanguage as glm
+    from providers import gemini_provider
+    from providers.gemini_provider import GeminiClientCache, GeminiProvider
+    from config import Config
+    GEMINI_AVAILABLE = True
+except ImportError:
+    GEMINI_AVAILABLE = False
+
+
+class StubGenerativeClient:
+    """Local stand-in for GenerativeServiceClient that answers with the API key it was built with."""
+
+    def __init__(self, api_key: str, delay: float = 0.002):
+        self.api_key = api_key
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, request, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)  # Widen the window for any cross-thread key bleed
+        return glm.GenerateContentResponse(candidates=[
+            glm.Candidate(
+                content=glm.Content(role="model", parts=[glm.Part(text=f"served-with:{self.api_key}")]),
+                finish_reason=glm.Candidate.FinishReason.STOP,
+            )
+        ])
+
+    def count_tokens(self, request, **kwargs):
+        return glm.CountTokensResponse(total_tokens=1)
+
+
+class StubStreamingClient:
+    """Local stand-in for GenerativeServiceClient whose stream_generate_content replays `chunks`, then raises `error`."""
+
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+
+    def stream_generate_content(self, request, **kwargs):
+        yield from self.chunks
+        if self.error:
+            raise self.error
+
+    def count_tokens(self, request, **kwargs):
+        return glm.CountTokensResponse(total_tokens=1)
+
+
+def _stream_chunk(text, finish_reason=None, usage=None):
+    return glm.GenerateContentResponse(
+        candidates=[glm.Candidate(content=glm.Content(role="model", parts=[glm.Part(text=text)]), finish_reason=finish_reason)],
+        usage_metadata=usage,
+    )
+
+
+class StubCacheClient:
+    """Local stand-in for CacheServiceClient that records the cached contents it creates."""
+
+    def __init__(self):
+        self.created = []
+
+    def create_cached_content(self, request, **kwargs):
+        self.created.append(request.cached_content)
+        return glm.CachedContent(name=f"cachedContents/{len(self.created)}", model=request.cached_content.model)
+
+
+@unittest.skipUnless(GEMINI_AVAILABLE, "google-generativeai is not installed")
+class TestGeminiClientIsolation(unittest.TestCase):
+    """Per-key Gemini clients must not share state under concurrent load."""
+
+    def setUp(self):
+        self.stub_clients = {}
+        self.factory_lock = threading.Lock()
+
+        def stub_factory(api_key):
+            with self.factory_lock:
+                client = StubGenerativeClient(api_key)
+                self.stub_clients.setdefault(api_key, []).append(client)
+                return client
+
+        self.original_cache = gemini_provider.client_cache
+        gemini_provider.client_cache = GeminiClientCache(client_factory=stub_factory)
+        self.original_configure = genai.configure
+        genai.configure = self._fail_configure
+
+    def tearDown(self):
+        gemini_provider.client_cache = self.original_cache
+        genai.configure = self.original_configure
+
+    @staticmethod
+    def _fail_configure(*args, **kwargs):
+        raise AssertionError("GeminiProvider must not call the process-global genai.configure()")
+
+    def _chat_as(self, api_key: str) -> str:
+        provider = GeminiProvider(api_key=api_key)
+        response = provider.chat([{"role": "user", "content": [{"text": "hello"}]}], [], Config)
+        return response['content'][0]['text']
+
+    def test_concurrent_keys_do_not_bleed(self):
+        """Each request is answered by the client for its own key, even when interleaved."""
+        keys = [f"tenant-key-{i}" for i in range(8)]
+        jobs = keys * 25
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(self._chat_as, jobs))
+        for api_key, text in zip(jobs, results):
+            self.assertEqual(text, f"served-with:{api_key}")
+
+    def test_one_client_per_key(self):
+        """Transports are created once per key and reused across provider instances."""
+        keys = [f"tenant-key-{i}" for i in range(4)]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(self._chat_as, keys * 10))
+        self.assertEqual(sorted(self.stub_clients), keys)
+        for api_key in keys:
+            self.assertEqual(len(self.stub_clients[api_key]), 1)
+            self.assertEqual(self.stub_clients[api_key][0].calls, 10)
+
+    def test_models_cached_per_key_and_model(self):
+        """The same (key, model) pair returns the same GenerativeModel; different keys do not."""
+        cache = gemini_provider.client_cache
+        model_a = cache.get_model("key-a", "gemini-1.5-flash-latest")
+        self.assertIs(model_a, cache.get_model("key-a", "gemini-1.5-flash-latest"))
+        self.assertIsNot(model_a, cache.get_model("key-b", "gemini-1.5-flash-latest"))
+        self.assertIsNot(model_a, cache.get_model("key-a", "gemini-1.5-pro"))
+
+    def test_cache_is_bounded_and_expires_idle_keys(self):
+        """Keys beyond max_size (least recently used first) and idle keys lose their clients and models."""
+        cache = GeminiClientCache(client_factory=lambda key: StubGenerativeClient(key), max_size=2, idle_ttl=60)
+        model_a = cache.get_model("key-a", "gemini-1.5-flash-latest")
+        cache.get_model("key-b", "gemini-1.5-flash-latest")
+        self.assertIs(model_a, cache.get_model("key-a", "gemini-1.5-flash-latest"))
+        cache.get_model("key-c", "gemini-1.5-flash-latest")  # Evicts key-b, the least recently used
+        self.assertEqual(cache.stats(), {'keys': 2, 'max_size': 2, 'evictions': 1})
+        self.assertIs(model_a, cache.get_model("key-a", "gemini-1.5-flash-latest"))
+
+        cache.idle_ttl = 0.01
+        time.sleep(0.02)
+        self.assertIsNot(model_a, cache.get_model("key-a", "gemini-1.5-flash-latest"))
+        self.assertEqual(cache.stats()['keys'], 1)
+
+
+@unittest.skipUnless(GEMINI_AVAILABLE, "google-generativeai is not installed")
+class TestGeminiStreaming(unittest.TestCase):
+    """stream_chat yields the text deltas, then one final response with the usage metadata of the stream."""
+
+    def setUp(self):
+        self.original_cache = gemini_provider.client_cache
+
+    def tearDown(self):
+        gemini_provider.client_cache = self.original_cache
+
+    def _stream(self, client):
+        gemini_provider.client_cache = GeminiClientCache(client_factory=lambda key: client)
+        provider = GeminiProvider(api_key="key")
+        return provider.stream_chat([{"role": "user", "content": [{"text": "hello"}]}], [], Config)
+
+    def test_deltas_and_final_usage(self):
+        usage = glm.GenerateContentResponse.UsageMetadata(prompt_token_count=12, candidates_token_count=3, total_token_count=15)
+        events = list(self._stream(StubStreamingClient([
+            _stream_chunk("Hel"),
+            _stream_chunk("lo", finish_reason=glm.Candidate.FinishReason.STOP, usage=usage),
+        ])))
+        self.assertEqual([event['text'] for event in events[:-1]], ["Hel", "lo"])
+        final = events[-1]
+        self.assertEqual(final['type'], 'final')
+        self.assertEqual(final['response']['content'], [{'type': 'text', 'text': 'Hello'}])
+        self.assertEqual(final['response']['stop_reason'], 'stop')
+        self.assertEqual((final['response']['usage']['input_tokens'], final['response']['usage']['output_tokens']), (12, 3))
+
+    def test_error_mid_stream_is_raised_after_the_deltas(self):
+        events = self._stream(StubStreamingClient([_stream_chunk("Hel")], ConnectionResetError("stream reset")))
+        self.assertEqual(next(events), {'type': 'text_delta', 'text': 'Hel'})
+        with self.assertRaises(RuntimeError) as raised:
+            next(events)
+        self.assertIn("stream reset", str(raised.exception))
+
+
+@unittest.skipUnless(GEMINI_AVAILABLE, "google-generativeai is not installed")
+class TestGeminiContextCache(unittest.TestCase):
+    """Long histories are sent as a cached-content prefix plus the newer messages."""
+
+    def setUp(self):
+        self.generate_client = StubGenerativeClient("key")
+        self.requests = []
+        original_generate = self.generate_client.generate_content
+
+        def recording_generate(request, **kwargs):
+            self.requests.append(request)
+            return original_generate(request, **kwargs)
+
+        self.generate_client.generate_content = recording_generate
+        self.cache_client = StubCacheClient()
+        self.original_cache = gemini_provider.client_cache
+        self.original_context_cache = gemini_provider.context_cache
+        self.original_min_tokens = Config.GEMINI_CACHE_MIN_TOKENS
+        gemini_provider.client_cache = GeminiClientCache(client_factory=lambda key: self.generate_client,
+                                                         cache_client_factory=lambda key: self.cache_client)
+        gemini_provider.context_cache = gemini_provider.GeminiContextCache()
+        Config.GEMINI_CACHE_MIN_TOKENS = 200
+
+    def tearDown(self):
+        gemini_provider.client_cache = self.original_cache
+        gemini_provider.context_cache = self.original_context_cache
+        Config.GEMINI_CACHE_MIN_TOKENS = self.original_min_tokens
+
+    def _turn(self, history, text):
+        history.append({"role": "user", "content": [{"text": text}]})
+        provider = GeminiProvider(api_key="key", client_model="gemini-1.5-flash-001")
+        reply = provider.chat(history, [], Config)['content'][0]['text']
+        history.append({"role": "assistant", "content": [{"text": reply}]})
+
+    def test_prefix_cached_once_and_reused(self):
+        history = []
+        for i in range(6):
+            self._turn(history, f"question {i} " + "detail " * 40)
+
+        # ~90 tokens per turn: the first prefix over 200 tokens is cached, later turns reuse it
+        self.assertEqual(len(self.cache_client.created), 1)
+        covered = len(self.cache_client.created[0].contents)
+        last_request = self.requests[-1]
+        self.assertEqual(last_request.cached_content, "cachedContents/1")
+        self.assertEqual(len(last_request.contents), len(history) - 1 - covered)
+        self.assertEqual(self.requests[0].cached_content, "")
+        self.assertEqual(len(self.requests[0].contents), 1)
+
+    def _failing_cache_client(self, error):
+        attempts = []
+
+        def create_cached_content(request, **kwargs):
+            attempts.append(request)
+            raise error
+        self.cache_client.create_cached_content = create_cached_content
+        return attempts
+
+    def test_transient_failure_only_skips_that_request(self):
+        attempts = self._failing_cache_client(RuntimeError("503 The service is currently unavailable."))
+        history = []
+        for i in range(5):
+            self._turn(history, f"question {i} " + "detail " * 40)
+        self.assertGreater(len(attempts), 1)  # Retried on later turns
+        self.assertEqual(self.requests[-1].cached_content, "")
+
+    def test_unsupported_model_is_not_retried(self):
+        attempts = self._failing_cache_client(RuntimeError(
+            "404 models/gemini-1.5-flash-001 is not found for API version v1beta, or is not supported for createCachedContent."))
+        history = []
+        for i in range(5):
+            self._turn(history, f"question {i} " + "detail " * 40)
+        self.assertEqual(len(attempts), 1)
+        self.assertEqual(len(self.requests[-1].contents), len(history) - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
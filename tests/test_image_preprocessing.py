@@ -0,0 +1,60 @@
+import io
+import unittest
+
+from PIL import Image
+
+import image_preprocessing
+from image_preprocessing import PreparedImageCache, sniff_media_type, store_upload, target_size
+
+
+def _image_bytes(size, format='PNG', mode='RGB'):
+    output = io.BytesIO()
+    Image.new(mode, size, color=(200, 30, 30, 128) if mode == 'RGBA' else (200, 30, 30)).save(output, format=format)
+    return output.getvalue()
+
+
+class TestImagePreprocessing(unittest.TestCase):
+    """Images are identified by content and sized to what each provider actually uses, once per provider."""
+
+    def test_sniffs_format_from_bytes(self):
+        self.assertEqual(sniff_media_type(_image_bytes((4, 4), 'PNG')), 'image/png')
+        self.assertEqual(sniff_media_type(_image_bytes((4, 4), 'JPEG')), 'image/jpeg')
+        self.assertEqual(sniff_media_type(_image_bytes((4, 4), 'GIF')), 'image/gif')
+        self.assertEqual(sniff_media_type(_image_bytes((4, 4), 'WEBP')), 'image/webp')
+        self.assertIsNone(sniff_media_type(b'<svg xmlns="http://www.w3.org/2000/svg"/>'))
+
+    def test_target_size_per_provider(self):
+        limits = image_preprocessing.PROVIDER_IMAGE_LIMITS
+        self.assertEqual(target_size(4000, 3000, limits['openai']), (1024, 768))
+        self.assertEqual(target_size(4000, 1000, limits['claude']), (1568, 392))
+        width, height = target_size(3000, 3000, limits['claude'])
+        self.assertLessEqual(width * height, 1_150_000)
+        self.assertEqual(target_size(800, 600, limits['gemini']), (800, 600))
+
+    def test_upload_rejects_non_images(self):
+        with self.assertRaises(ValueError):
+            store_upload(b'GIF8 not really an image')
+
+    def test_prepared_once_per_provider(self):
+        blob_id, media_type = store_upload(_image_bytes((3000, 2000), 'PNG'))
+        self.assertEqual(media_type, 'image/png')  # Within the upload limit, so kept as uploaded
+        cache = PreparedImageCache(max_bytes=16 * 1024 * 1024)
+
+        claude = cache.get(blob_id, 'claude')
+        self.assertEqual(claude.media_type, 'image/jpeg')
+        self.assertEqual(Image.open(io.BytesIO(claude.data)).size, (1313, 875))
+        self.assertIs(cache.get(blob_id, 'claude'), claude)
+        self.assertEqual(Image.open(io.BytesIO(cache.get(blob_id, 'openai').data)).size, (1152, 768))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertIsNone(cache.get('0' * 64, 'claude'))
+
+    def test_transparency_and_unsupported_formats(self):
+        blob_id, _ = store_upload(_image_bytes((2000, 2000), 'PNG', mode='RGBA'))
+        self.assertEqual(PreparedImageCache(16 * 1024 * 1024).get(blob_id, 'claude').media_type, 'image/png')
+        # Gemini does not take GIF, so even a small one is converted
+        blob_id, _ = store_upload(_image_bytes((16, 16), 'GIF'))
+        self.assertEqual(PreparedImageCache(16 * 1024 * 1024).get(blob_id, 'gemini').media_type, 'image/jpeg')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import neuroswitch_classifier as ns
+from config import Config
+from embedding_router import EmbeddingRouter
+from micro_batcher import MicroBatcher
+from retrieval_memory import HashingEmbedder
+
+
+def fake_pipeline(texts, labels, multi_label=False, batch_size=None):
+    """Zero-shot pipeline stand-in that ranks 'code generation' first, for a text or a list of texts."""
+    ranked = ["code generation"] + [label for label in labels if label != "code generation"]
+    results = [{"sequence": text, "labels": ranked, "scores": [0.9] + [0.1 / (len(ranked) - 1)] * (len(ranked) - 1)}
+               for text in ([texts] if isinstance(texts, str) else texts)]
+    return results[0] if isinstance(texts, str) else results
+
+
+def reset_classifier():
+    """Back to the state before any warm-up."""
+    ns.classifier_pipeline = None
+    ns.classifier_batcher = None
+    ns.classifier_state = ns.CLASSIFIER_NOT_LOADED
+    ns.classifier_error = None
+    ns.classifier_load_seconds = None
+    ns._classifier_loaded = threading.Event()
+    ns.routing_cache.clear()
+
+
+class TestLazyClassifier(unittest.TestCase):
+    """Routing never waits for the model to load; it takes the fallback route until the classifier is ready."""
+
+    def setUp(self):
+        reset_classifier()
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        ns.wait_until_ready(5)
+        reset_classifier()
+
+    def _slow_build(self):
+        self.release.wait(5)
+        return fake_pipeline
+
+    def test_falls_back_while_loading_then_classifies(self):
+        with mock.patch.object(ns, '_build_pipeline', self._slow_build), \
+                mock.patch.object(Config, 'NEUROSWITCH_FALLBACK_PROVIDER', 'gemini'):
+            started = time.perf_counter()
+            status = ns.get_neuroswitch_provider("write a python function")  # Starts the lazy load
+            self.assertLess(time.perf_counter() - started, 1.0)
+            self.assertEqual(status["provider"], "gemini")
+            self.assertFalse(status["neuroswitch_active"])
+            self.assertIn("still loading", status["fallback_reason"])
+            self.assertEqual(ns.classifier_status()["state"], ns.CLASSIFIER_LOADING)
+
+            self.release.set()
+            self.assertTrue(ns.wait_until_ready(5))
+            status = ns.get_neuroswitch_provider("write a python function")
+            self.assertEqual(status["provider"], "openai")
+            self.assertTrue(status["neuroswitch_active"])
+
+    def test_failed_load_uses_fallback(self):
+        def missing_library():
+            raise ImportError("No module named 'transformers'")
+        with mock.patch.object(ns, '_build_pipeline', missing_library):
+            ns.start_warmup(background=False)
+            status = ns.get_neuroswitch_provider("hello")
+        self.assertEqual(status["provider"], Config.NEUROSWITCH_FALLBACK_PROVIDER)
+        self.assertEqual(ns.classifier_status()["state"], ns.CLASSIFIER_FAILED)
+        self.assertIn("transformers", status["fallback_reason"])
+
+
+class TestRoutingDecisionCache(unittest.TestCase):
+    """Repeated prompts reuse the routing decision instead of running the classifier again."""
+
+    def test_normalized_hits_skip_the_classifier(self):
+        calls = []
+
+        def counting_pipeline(text, labels, multi_label=False):
+            calls.append(text)
+            return fake_pipeline(text, labels, multi_label)
+
+        with mock.patch.multiple(ns, classifier_pipeline=counting_pipeline, classifier_batcher=None,
+                                 classifier_state=ns.CLASSIFIER_READY, routing_cache=ns.RoutingDecisionCache(max_entries=10)):
+            first = ns.get_neuroswitch_provider("Write a Python function")
+            first["provider_scores"]["openai"] = 0.0  # Callers' changes must not leak into the cache
+            second = ns.get_neuroswitch_provider("  write a   PYTHON function\n")
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(second["provider"], "openai")
+            self.assertGreater(second["provider_scores"]["openai"], 0.5)
+            self.assertEqual(ns.routing_cache.stats()["hits"], 1)
+            self.assertEqual(ns.routing_cache.stats()["misses"], 1)
+
+    def test_size_bound_and_ttl(self):
+        status = {"provider": "claude", "neuroswitch_active": True, "fallback_reason": None, "provider_scores": {"claude": 1.0}}
+        cache = ns.RoutingDecisionCache(max_entries=2, ttl_seconds=60)
+        for text in ("a", "b", "c"):
+            cache.put(text, status)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+        with mock.patch.object(ns.time, "monotonic", return_value=time.monotonic() + 120):
+            self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.stats()["entries"], 1)
+
+
+class TestMicroBatcher(unittest.TestCase):
+    """Concurrent classifications are coalesced into batches and each caller gets its own result."""
+
+    def test_concurrent_calls_share_batches(self):
+        batch_sizes = []
+
+        def run_batch(texts):
+            batch_sizes.append(len(texts))
+            time.sleep(0.02)  # A forward pass; requests arriving meanwhile form the next batch
+            return fake_pipeline(texts, ns.CANDIDATE_LABELS)
+
+        batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_seconds=0.05)
+        texts = [f"request {i}" for i in range(12)]
+        with ThreadPoolExecutor(max_workers=12) as pool:
+            results = list(pool.map(batcher, texts))
+        self.assertEqual([result["sequence"] for result in results], texts)
+        self.assertEqual(sum(batch_sizes), 12)
+        self.assertLessEqual(max(batch_sizes), 4)
+        self.assertLess(len(batch_sizes), 12)
+        self.assertEqual(batcher.stats()["items"], 12)
+
+    def test_batch_errors_reach_every_caller(self):
+        def failing_batch(texts):
+            raise RuntimeError("model crashed")
+
+        batcher = MicroBatcher(failing_batch, max_batch_size=4, max_wait_seconds=0.01)
+        with self.assertRaises(RuntimeError):
+            batcher("hello", timeout=5)
+
+    def test_classifier_uses_batcher_when_loaded(self):
+        with mock.patch.object(ns, '_build_pipeline', lambda: fake_pipeline), \
+                mock.patch.object(Config, 'NEUROSWITCH_BATCH_MAX_SIZE', 4):
+            reset_classifier()
+            try:
+                ns.start_warmup(background=False)
+                self.assertIsNotNone(ns.classifier_batcher)
+                self.assertEqual(ns.get_neuroswitch_provider("write a python function")["provider"], "openai")
+                self.assertEqual(ns.classifier_status()["batching"]["items"], 1)
+            finally:
+                reset_classifier()
+
+    def test_stuck_batch_falls_back_to_default_provider(self):
+        release = threading.Event()
+
+        def stuck_pipeline(texts, labels, multi_label=False, batch_size=None):
+            release.wait(5)
+            return fake_pipeline(texts, labels)
+
+        with mock.patch.object(ns, '_build_pipeline', lambda: stuck_pipeline), \
+                mock.patch.object(Config, 'NEUROSWITCH_BATCH_MAX_SIZE', 4), \
+                mock.patch.object(Config, 'NEUROSWITCH_BATCH_TIMEOUT_SECONDS', 0.05):
+            reset_classifier()
+            try:
+                ns.start_warmup(background=False)
+                status = ns.get_neuroswitch_provider("write a python function")
+                self.assertEqual(status["provider"], ns.DEFAULT_PROVIDER)
+                self.assertFalse(status["neuroswitch_active"])
+                self.assertIn("timed out", status["fallback_reason"])
+            finally:
+                release.set()
+                reset_classifier()
+
+
+class TestEmbeddingRouter(unittest.TestCase):
+    """The embedding engine answers like the zero-shot pipeline and persists its label embeddings."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_pipeline_compatible_result(self):
+        router = EmbeddingRouter(HashingEmbedder(), ns.CANDIDATE_LABELS, cache_dir=self.cache_dir)
+        result = router("Please translate this paragraph into Spanish", ns.CANDIDATE_LABELS, multi_label=False)
+        self.assertEqual(result["labels"][0], "translation")
+        self.assertEqual(sorted(result["labels"]), sorted(ns.CANDIDATE_LABELS))
+        self.assertAlmostEqual(sum(result["scores"]), 1.0, places=5)
+        self.assertEqual(result["scores"], sorted(result["scores"], reverse=True))
+        batch = router(["Please translate this paragraph into Spanish", "Solve the equation 2x = 4"], ns.CANDIDATE_LABELS)
+        self.assertEqual(batch[0], result)
+        self.assertEqual(batch[1]["labels"][0], "math problem solving")
+
+    def test_label_embeddings_are_persisted(self):
+        first = EmbeddingRouter(HashingEmbedder(), ns.CANDIDATE_LABELS, cache_dir=self.cache_dir)
+        with mock.patch.object(EmbeddingRouter, '_build', side_effect=AssertionError("recomputed")):
+            second = EmbeddingRouter(HashingEmbedder(), ns.CANDIDATE_LABELS, cache_dir=self.cache_dir)
+        self.assertTrue((first.label_vectors == second.label_vectors).all())
+        # Different examples are a different fingerprint, so they are not served stale vectors
+        third = EmbeddingRouter(HashingEmbedder(), ns.CANDIDATE_LABELS, examples={}, cache_dir=self.cache_dir)
+        self.assertNotEqual(third.fingerprint(), first.fingerprint())
+
+
+if __name__ == '__main__':
+    unittest.main()
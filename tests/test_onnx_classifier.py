@@ -0,0 +1,186 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import neuroswitch_classifier as ns
+from config import Config
+from embedding_router import LABEL_EXAMPLES
+import onnx_classifier
+from onnx_classifier import ONNXRUNTIME_AVAILABLE, OnnxZeroShotClassifier, parity_check
+
+try:
+    import torch  # noqa: F401
+    from transformers import pipeline
+    TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    TRANSFORMERS_AVAILABLE = False
+
+TEXTS = ["write some code", "plan my trip"]
+LABELS = ["code generation", "travel planning", "general question"]
+# Entailment logit per (text, label)
+ENTAILMENT = np.array([[3.0, -1.0, 0.5], [-2.0, 2.5, 1.0]], dtype=np.float32)
+
+
+class FakeTokenizer:
+    """Encodes each (premise, hypothesis) pair as the [text index, label index] it stands for."""
+
+    def __call__(self, premises, hypotheses, **kwargs):
+        hypothesis_labels = ["This example is {}.".format(label) for label in LABELS]
+        ids = np.array([[TEXTS.index(p), hypothesis_labels.index(h)] for p, h in zip(premises, hypotheses)])
+        return {"input_ids": ids, "attention_mask": np.ones_like(ids)}
+
+
+class FakeInput:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeSession:
+    """ONNX Runtime session stand-in returning [contradiction, neutral, entailment] logits."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_inputs(self):
+        return [FakeInput("input_ids"), FakeInput("attention_mask")]
+
+    def run(self, output_names, feed):
+        self.calls += 1
+        pairs = feed["input_ids"]
+        return [np.array([[0.0, 0.0, ENTAILMENT[t, l]] for t, l in pairs], dtype=np.float32)]
+
+
+class TestOnnxZeroShotScoring(unittest.TestCase):
+    """The ONNX classifier turns NLI logits into label scores the way the transformers pipeline does."""
+
+    def setUp(self):
+        self.session = FakeSession()
+        self.classifier = OnnxZeroShotClassifier(self.session, FakeTokenizer(), entailment_id=2)
+
+    def test_single_label_softmax_over_entailment(self):
+        result = self.classifier(TEXTS[0], LABELS)
+        expected = np.exp(ENTAILMENT[0]) / np.exp(ENTAILMENT[0]).sum()
+        self.assertEqual(result["labels"], ["code generation", "general question", "travel planning"])
+        np.testing.assert_allclose(result["scores"], sorted(expected, reverse=True), rtol=1e-5)
+
+    def test_batches_match_single_calls(self):
+        results = self.classifier(TEXTS, LABELS, batch_size=2)  # 6 pairs in three forward passes
+        self.assertEqual(self.session.calls, 3)
+        self.assertEqual(results, [self.classifier(text, LABELS) for text in TEXTS])
+        self.assertEqual(results[1]["labels"][0], "travel planning")
+
+    def test_multi_label_scores_each_label_alone(self):
+        result = self.classifier(TEXTS[1], LABELS, multi_label=True)
+        scores = dict(zip(result["labels"], result["scores"]))
+        self.assertAlmostEqual(scores["travel planning"], 1 / (1 + np.exp(-2.5)), places=5)
+
+    def test_parity_report(self):
+        def reversed_classifier(texts, labels, multi_label=False):
+            return [dict(result, labels=result["labels"][::-1]) for result in self.classifier(texts, labels)]
+
+        report = parity_check(self.classifier, self.classifier, TEXTS, LABELS, ns.LABEL_PROVIDER_MAP)
+        self.assertEqual((report["label_agreement"], report["provider_agreement"], report["max_score_diff"]), (1.0, 1.0, 0.0))
+        report = parity_check(self.classifier, reversed_classifier, TEXTS, LABELS)
+        self.assertEqual(report["label_agreement"], 0.0)
+        self.assertEqual(len(report["disagreements"]), 2)
+
+
+class TestExportPublishing(unittest.TestCase):
+    """Concurrent exports of the same model leave one complete export in place."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.directory = os.path.join(self.root, "model")
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _export(self, name, model="model", format_version=onnx_classifier.EXPORT_FORMAT_VERSION):
+        path = tempfile.mkdtemp(dir=self.root, prefix=".export-")
+        metadata = {"model": model, "format_version": format_version, "entailment_id": 2, "by": name}
+        with open(os.path.join(path, onnx_classifier.QUANTIZED_MODEL_FILE), "w") as model_file:
+            model_file.write(name)
+        with open(os.path.join(path, onnx_classifier.METADATA_FILE), "w") as metadata_file:
+            json.dump(metadata, metadata_file)
+        return path, metadata
+
+    def _publish(self, name, **kwargs):
+        staging, metadata = self._export(name, **kwargs)
+        published = onnx_classifier._publish_export(staging, self.directory, "model", metadata)
+        self.assertFalse(os.path.exists(staging))
+        return published
+
+    def test_first_export_wins(self):
+        self.assertEqual(self._publish("first")["by"], "first")
+        self.assertEqual(self._publish("second")["by"], "first")
+        self.assertEqual(onnx_classifier._valid_export(self.directory, "model")["by"], "first")
+        self.assertEqual(sorted(os.listdir(self.root)), ["model"])
+
+    def test_concurrent_workers_export_once(self):
+        exports = []
+
+        def worker(name):
+            # create_onnx_classifier's check-lock-check around export_quantized_model
+            if onnx_classifier._valid_export(self.directory, "model") is None:
+                with onnx_classifier._export_lock(self.directory):
+                    if onnx_classifier._valid_export(self.directory, "model") is None:
+                        exports.append(name)
+                        self._publish(name)
+            return onnx_classifier._valid_export(self.directory, "model")["by"]
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            used = list(pool.map(worker, [f"worker-{i}" for i in range(8)]))
+        self.assertEqual(len(exports), 1)
+        self.assertEqual(used, exports * 8)
+
+    def test_stale_export_is_replaced(self):
+        self._publish("old", format_version=onnx_classifier.EXPORT_FORMAT_VERSION - 1)
+        self.assertIsNone(onnx_classifier._valid_export(self.directory, "model"))
+        self.assertEqual(self._publish("new")["by"], "new")
+        self.assertEqual(onnx_classifier._valid_export(self.directory, "model")["by"], "new")
+        self.assertEqual(sorted(os.listdir(self.root)), ["model"])
+
+    def test_incomplete_export_is_not_valid(self):
+        self._publish("partial")
+        os.remove(os.path.join(self.directory, onnx_classifier.QUANTIZED_MODEL_FILE))
+        self.assertIsNone(onnx_classifier._valid_export(self.directory, "model"))
+        self.assertEqual(self._publish("complete")["by"], "complete")
+
+
+@unittest.skipUnless(ONNXRUNTIME_AVAILABLE and TRANSFORMERS_AVAILABLE and os.getenv("NEUROSWITCH_ONNX_PARITY_TEST"),
+                     "Needs onnxruntime, torch and transformers and downloads BART-large; set NEUROSWITCH_ONNX_PARITY_TEST=1")
+class TestOnnxAccuracyParity(unittest.TestCase):
+    """The int8 ONNX model routes like full-precision PyTorch BART on prompts it was not checked against at export."""
+
+    PROMPTS = [
+        "Can you write a Python script that renames all files in a folder?",
+        "What's the weather going to be like in Berlin this weekend?",
+        "Summarize the key points of this quarterly earnings call transcript.",
+        "Translate 'where is the train station' into Italian.",
+        "Is this clause in my employment contract enforceable?",
+        "Give me a recipe for a quick weeknight pasta.",
+        "Which noise-cancelling headphones are worth buying?",
+        "Help me plan a week in Iceland in October.",
+        "Why does my React component re-render on every keystroke?",
+        "What year did the Berlin Wall fall?",
+        "Solve for x: 2x^2 - 8 = 0",
+        "Write a catchy product description for handmade candles.",
+    ]
+
+    def test_parity_with_pytorch(self):
+        from onnx_classifier import create_onnx_classifier
+        parity_texts = [example for examples in LABEL_EXAMPLES.values() for example in examples]
+        candidate = create_onnx_classifier(ns.MODEL_NAME, ns.CANDIDATE_LABELS, parity_texts, ns.LABEL_PROVIDER_MAP)
+        reference = pipeline("zero-shot-classification", model=ns.MODEL_NAME)
+        report = parity_check(reference, candidate, self.PROMPTS, ns.CANDIDATE_LABELS, ns.LABEL_PROVIDER_MAP)
+        self.assertGreaterEqual(report["label_agreement"], Config.NEUROSWITCH_ONNX_MIN_AGREEMENT, report["disagreements"])
+        self.assertGreaterEqual(report["provider_agreement"], Config.NEUROSWITCH_ONNX_MIN_AGREEMENT, report["disagreements"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+import openai
+from openai.types.chat import ChatCompletionChunk
+
+from config import Config
+from providers.openai_provider import OpenAIProvider
+
+MESSAGES = [{'role': 'user', 'content': [{'type': 'text', 'text': 'hello'}]}]
+
+
+def chunk(content=None, finish_reason=None, usage=None):
+    """A chat.completion.chunk as the SDK parses it; the include_usage chunk has no choices."""
+    choices = [] if usage else [{'index': 0, 'delta': {'content': content}, 'finish_reason': finish_reason}]
+    return ChatCompletionChunk.model_validate({
+        'id': 'chunk', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'gpt-test',
+        'choices': choices, 'usage': usage,
+    })
+
+
+class StubOpenAIClient:
+    """Local stand-in for openai.OpenAI whose chat.completions.create() replays `chunks`, then raises `error`."""
+
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+        self.requests = []
+        self.chat = self.completions = self
+
+    def create(self, **request_params):
+        self.requests.append(request_params)
+        return self._replay()
+
+    def _replay(self):
+        yield from self.chunks
+        if self.error:
+            raise self.error
+
+
+class TestOpenAIStreaming(unittest.TestCase):
+    """stream_chat yields the text deltas, then one final response with the include_usage figures."""
+
+    def setUp(self):
+        self.provider = OpenAIProvider(api_key='key')
+
+    def stream(self, client):
+        self.provider.client = client
+        return self.provider.stream_chat(MESSAGES, [], Config)
+
+    def test_deltas_and_final_usage(self):
+        client = StubOpenAIClient([
+            chunk('Hel'),
+            chunk('lo'),
+            chunk(finish_reason='stop'),
+            chunk(usage={'prompt_tokens': 1500, 'completion_tokens': 2, 'total_tokens': 1502,
+                         'prompt_tokens_details': {'cached_tokens': 1024}}),
+        ])
+        events = list(self.stream(client))
+        self.assertEqual(client.requests[0]['stream_options'], {'include_usage': True})
+        self.assertEqual([event['text'] for event in events[:-1]], ['Hel', 'lo'])
+        final = events[-1]
+        self.assertEqual(final['type'], 'final')
+        self.assertEqual(final['response']['content'], [{'type': 'text', 'text': 'Hello'}])
+        self.assertEqual(final['response']['stop_reason'], 'stop')
+        usage = final['response']['usage']
+        self.assertEqual((usage['input_tokens'], usage['output_tokens'], usage['cache_read_tokens']), (1500, 2, 1024))
+
+    def test_error_mid_stream_is_raised_after_the_deltas(self):
+        events = self.stream(StubOpenAIClient([chunk('Hel')], openai.APIConnectionError(request=None)))
+        self.assertEqual(next(events), {'type': 'text_delta', 'text': 'Hel'})
+        with self.assertRaises(ConnectionError):
+            next(events)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,233 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import app as fusion_app
+import chat_service
+from providers.base_provider import BaseProvider
+from session_store import MemorySessionStore, SQLiteSessionStore, SessionConflictError
+
+
+class StubProvider(BaseProvider):
+    """Provider stand-in that takes `delay` seconds to answer and echoes the last user message."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    @property
+    def name(self) -> str:
+        return "claude"
+
+    def chat(self, messages, tools, config):
+        time.sleep(self.delay)
+        last_user = messages[-1]['content'][0]['text']
+        return {
+            'content': f"echo:{last_user}",
+            'usage': {'input_tokens': 1, 'output_tokens': 1, 'runtime': self.delay},
+            'model_used': 'stub',
+        }
+
+
+class TestChatSessionConcurrency(unittest.TestCase):
+    """Concurrent /chat requests on one session must never silently drop a turn."""
+
+    def setUp(self):
+        self.original_store = chat_service.api_client_session_store
+        self.original_get_provider = fusion_app.ProviderFactory.get_provider
+        chat_service.api_client_session_store = MemorySessionStore()
+        self.provider = StubProvider(delay=0.05)
+        fusion_app.ProviderFactory.get_provider = staticmethod(lambda *args, **kwargs: self.provider)
+
+    def tearDown(self):
+        chat_service.api_client_session_store = self.original_store
+        fusion_app.ProviderFactory.get_provider = self.original_get_provider
+
+    def _post(self, session_id: str, message: str):
+        client = fusion_app.app.test_client()
+        return client.post(
+            '/chat',
+            json={'message': message, 'requested_provider': 'claude'},
+            headers={'X-Session-ID': session_id}
+        )
+
+    def _stored_messages(self, session_id: str):
+        return list(chat_service.api_client_session_store.get(session_id)['conversation_history'])
+
+    def test_conflicting_turns_are_rejected_not_lost(self):
+        """Every turn is either saved (200) or reported as a conflict (409); none vanish."""
+        messages = [f"turn-{i}" for i in range(16)]
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            responses = list(pool.map(lambda m: self._post("shared", m), messages))
+
+        statuses = [r.status_code for r in responses]
+        self.assertTrue(all(status in (200, 409) for status in statuses), statuses)
+        saved = [m for m, r in zip(messages, responses) if r.status_code == 200]
+        self.assertGreaterEqual(len(saved), 1)
+
+        history = self._stored_messages("shared")
+        self.assertEqual(len(history), 2 * len(saved))
+        stored_user_texts = [m['content'][0]['text'] for m in history if m['role'] == 'user']
+        self.assertCountEqual(stored_user_texts, saved)
+        for r in responses:
+            if r.status_code == 409:
+                self.assertEqual(r.json['error'], 'session_conflict')
+
+    def test_retrying_on_conflict_keeps_every_turn(self):
+        """Clients that retry on 409 end up with all their turns stored exactly once."""
+        messages = [f"turn-{i}" for i in range(12)]
+
+        def send_until_saved(message):
+            while True:
+                response = self._post("retrying", message)
+                if response.status_code != 409:
+                    return response.status_code
+
+        with ThreadPoolExecutor(max_workers=12) as pool:
+            statuses = list(pool.map(send_until_saved, messages))
+
+        self.assertEqual(statuses, [200] * len(messages))
+        history = self._stored_messages("retrying")
+        self.assertEqual(len(history), 2 * len(messages))
+        stored_user_texts = [m['content'][0]['text'] for m in history if m['role'] == 'user']
+        self.assertCountEqual(stored_user_texts, messages)
+        # Turns stay paired: each assistant reply directly follows its user message
+        for user_message, assistant_message in zip(history[::2], history[1::2]):
+            self.assertEqual(assistant_message['content'], f"echo:{user_message['content'][0]['text']}")
+
+    def test_unrelated_sessions_run_in_parallel(self):
+        """Requests on different sessions do not wait for each other."""
+        self.provider.delay = 0.3
+        session_ids = [f"session-{i}" for i in range(8)]
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(lambda sid: self._post(sid, "hello"), session_ids))
+        elapsed = time.monotonic() - started
+
+        self.assertEqual([r.status_code for r in responses], [200] * len(session_ids))
+        # Serialized, 8 calls would take at least 2.4s
+        self.assertLess(elapsed, 8 * self.provider.delay / 2)
+        for session_id in session_ids:
+            self.assertEqual(len(self._stored_messages(session_id)), 2)
+
+    def test_streamed_turn_reports_failed_save(self):
+        """A stream whose turn cannot be stored ends with an 'error' event, not a silent close."""
+        def failing_append(*args, **kwargs):
+            raise OSError("disk I/O error")
+        chat_service.api_client_session_store.append = failing_append
+        client = fusion_app.app.test_client()
+        response = client.post('/chat', json={'message': 'hello', 'requested_provider': 'claude', 'stream': True},
+                               headers={'X-Session-ID': 'stream-session'})
+        body = response.get_data(as_text=True)
+        self.assertIn('event: delta', body)
+        self.assertIn('event: error', body)
+        self.assertIn('disk I/O error', body)
+        self.assertNotIn('event: done', body)
+
+    def test_streamed_provider_failure_is_an_error_event(self):
+        """A provider that fails mid-stream ends the stream with an 'error' event and stores nothing."""
+        def failing_stream(messages, tools, config):
+            yield {'type': 'text_delta', 'text': 'partial'}
+            raise ConnectionError("connection reset")
+        self.provider.stream_chat = failing_stream
+        client = fusion_app.app.test_client()
+        response = client.post('/chat', json={'message': 'hello', 'requested_provider': 'claude', 'stream': True},
+                               headers={'X-Session-ID': 'failing-stream'})
+        body = response.get_data(as_text=True)
+        self.assertIn('event: delta', body)
+        self.assertIn('event: error', body)
+        self.assertIn('provider_error', body)
+        self.assertIn('connection reset', body)
+        self.assertNotIn('event: done', body)
+        self.assertEqual(self._stored_messages('failing-stream'), [])
+
+
+class TestSessionStoreVersioning(unittest.TestCase):
+    """Conditional writes on both store backends."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.stores = {
+            'memory': MemorySessionStore(),
+            'sqlite': SQLiteSessionStore(os.path.join(self.tmp_dir, 'sessions.db')),
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_stale_write_raises_conflict(self):
+        for backend, store in self.stores.items():
+            with self.subTest(backend=backend):
+                first = store.get("s")
+                second = store.get("s")
+                store.append("s", [{'role': 'user', 'content': 'a'}], 1, expected_version=first['version'])
+                with self.assertRaises(SessionConflictError):
+                    store.append("s", [{'role': 'user', 'content': 'b'}], 1, expected_version=second['version'])
+                with self.assertRaises(SessionConflictError):
+                    store.save("s", [], 0, expected_version=second['version'])
+                self.assertEqual(len(store.get("s")['conversation_history']), 1)
+
+    def test_snapshot_does_not_see_later_appends(self):
+        for backend, store in self.stores.items():
+            with self.subTest(backend=backend):
+                store.append("snap", [{'role': 'user', 'content': 'a'}], 1)
+                snapshot = store.get("snap")['conversation_history']
+                store.append("snap", [{'role': 'user', 'content': 'b'}], 2)
+                self.assertEqual([m['content'] for m in snapshot], ['a'])
+
+    def test_eviction_during_a_request_is_not_a_conflict(self):
+        store = MemorySessionStore(max_sessions=1)
+        store.append("a", [{'role': 'user', 'content': 'old'}], 1)
+        first = store.get("a")
+        second = store.get("a")
+        store.get("b")  # Evicts "a" while both requests on it are in flight
+        self.assertFalse(store.exists("a"))
+
+        store.append("a", [{'role': 'user', 'content': 'new'}], 2, expected_version=first['version'])
+        self.assertEqual([m['content'] for m in store.get("a")['conversation_history']], ['new'])
+        # The other request read the same version, so it still conflicts with the first one's write
+        with self.assertRaises(SessionConflictError):
+            store.append("a", [{'role': 'user', 'content': 'other'}], 2, expected_version=second['version'])
+
+    def test_session_read_again_after_eviction_accepts_earlier_readers(self):
+        store = MemorySessionStore(max_sessions=1)
+        store.append("a", [{'role': 'user', 'content': 'old'}], 1)
+        before = store.get("a")
+        store.get("b")
+        after = store.get("a")  # Recreated empty; a new generation, since the history is gone
+        self.assertEqual(after['version'], before['version'])
+        self.assertNotEqual(after['generation'], before['generation'])
+        store.append("a", [{'role': 'user', 'content': 'new'}], 2, expected_version=before['version'])
+        self.assertEqual(store.get("a")['version'], before['version'] + 1)
+
+    def test_concurrent_conditional_appends(self):
+        """Read-modify-write with retry from many threads stores every turn exactly once."""
+        for backend, store in self.stores.items():
+            with self.subTest(backend=backend):
+                session_id = f"stress-{backend}"
+
+                def record_turn(i):
+                    while True:
+                        data = store.get(session_id)
+                        time.sleep(0.001)  # Simulated provider call
+                        try:
+                            store.append(session_id, [{'role': 'user', 'content': str(i)}, {'role': 'assistant', 'content': str(i)}],
+                                         data['total_tokens_used'] + 2, expected_version=data['version'])
+                            return
+                        except SessionConflictError:
+                            continue
+
+                with ThreadPoolExecutor(max_workers=8) as pool:
+                    list(pool.map(record_turn, range(40)))
+
+                data = store.get(session_id)
+                history = list(data['conversation_history'])
+                self.assertEqual(len(history), 80)
+                self.assertEqual(data['total_tokens_used'], 80)
+                self.assertCountEqual([m['content'] for m in history[::2]], [str(i) for i in range(40)])
+
+
+if __name__ == "__main__":
+    unittest.main()
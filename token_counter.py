@@ -0,0 +1,203 @@
+import json
+import logging
+import math
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import Config
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Rough cost of one image in a request; vendors bill images by resolution, not by base64 length
+IMAGE_TOKEN_ESTIMATE = 1600
+# Per-message framing overhead (role markers, separators)
+MESSAGE_TOKEN_OVERHEAD = 4
+
+# List prices in USD per million (input, output) tokens, matched by longest model-name prefix
+MODEL_PRICES_PER_MILLION = {
+    'claude-3-5-sonnet': (3.00, 15.00),
+    'claude-3-7-sonnet': (3.00, 15.00),
+    'claude-sonnet-4': (3.00, 15.00),
+    'claude-3-5-haiku': (0.80, 4.00),
+    'claude-3-haiku': (0.25, 1.25),
+    'claude-3-opus': (15.00, 75.00),
+    'claude-opus-4': (15.00, 75.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4-turbo': (10.00, 30.00),
+    'gpt-3.5-turbo': (0.50, 1.50),
+    'gemini-1.5-flash': (0.075, 0.30),
+    'gemini-1.5-pro': (1.25, 5.00),
+    'gemini-2.0-flash': (0.10, 0.40),
+}
+
+class Tokenizer(ABC):
+    """Counts tokens in text for one model family. `name` identifies the tokenizer in count caches."""
+
+    name: str
+
+    @abstractmethod
+    def count_text(self, text: str) -> int:
+        pass
+
+class ApproximateTokenizer(Tokenizer):
+    """Character-ratio estimate for vendors without a public local tokenizer."""
+
+    def __init__(self, name: str, chars_per_token: float):
+        self.name = name
+        self.chars_per_token = chars_per_token
+
+    def count_text(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+class TiktokenTokenizer(Tokenizer):
+    """Exact BPE counts for OpenAI models using tiktoken."""
+
+    def __init__(self, model: str):
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            # Models newer than the installed tiktoken release; current OpenAI models use o200k_base
+            self.encoding = tiktoken.get_encoding('o200k_base')
+        self.name = f"tiktoken:{self.encoding.name}"
+
+    def count_text(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+def _openai_tokenizer(model: str) -> Tokenizer:
+    if TIKTOKEN_AVAILABLE:
+        try:
+            return TiktokenTokenizer(model)
+        except Exception as e:
+            # tiktoken downloads its BPE files on first use; offline hosts fall back to the estimate
+            logger.warning(f"tiktoken encoding for '{model}' unavailable ({e}); using approximate OpenAI token counts.")
+    return ApproximateTokenizer('openai-approx', 4.0)
+
+# Provider name -> factory(model) -> Tokenizer. Replace or extend with register_tokenizer().
+TOKENIZER_FACTORIES: Dict[str, Callable[[str], Tokenizer]] = {
+    'openai': _openai_tokenizer,
+    'claude': lambda model: ApproximateTokenizer('claude-approx', 3.5),
+    'gemini': lambda model: ApproximateTokenizer('gemini-approx', 4.0),
+}
+
+_tokenizers: Dict[Tuple[str, str], Tokenizer] = {}
+_tokenizers_lock = threading.Lock()
+
+def register_tokenizer(provider_name: str, factory: Callable[[str], Tokenizer]):
+    """Use `factory(model)` to build tokenizers for a provider (e.g. a vendor's own tokenizer library)."""
+    with _tokenizers_lock:
+        TOKENIZER_FACTORIES[provider_name] = factory
+        for key in [key for key in _tokenizers if key[0] == provider_name]:
+            del _tokenizers[key]
+
+def get_tokenizer(provider_name: str, model: str) -> Tokenizer:
+    """Return the (shared) tokenizer for a provider and model."""
+    key = (provider_name, model or '')
+    tokenizer = _tokenizers.get(key)
+    if tokenizer is None:
+        factory = TOKENIZER_FACTORIES.get(provider_name, lambda model: ApproximateTokenizer('default-approx', 4.0))
+        tokenizer = factory(model or '')
+        with _tokenizers_lock:
+            tokenizer = _tokenizers.setdefault(key, tokenizer)
+    return tokenizer
+
+class TokenCountCache:
+    """
+    Thread-safe LRU of per-message token counts, keyed by (tokenizer name, message identity).
+
+    Sanitized history messages are reused unchanged from turn to turn (see
+    context_sanitizer.SanitizationCache), so each message is tokenized once per tokenizer rather
+    than once per turn. Entries hold the message itself so its id cannot be reused while cached.
+    """
+
+    def __init__(self, max_entries: int = 50000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tokenizer_name: str, message: Dict[str, Any]) -> Optional[int]:
+        key = (tokenizer_name, id(message))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not message:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, tokenizer_name: str, message: Dict[str, Any], count: int):
+        with self._lock:
+            self._entries[(tokenizer_name, id(message))] = (message, count)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+default_cache = TokenCountCache(max_entries=Config.TOKEN_COUNT_CACHE_MAX_ENTRIES)
+
+def count_message_tokens(message: Dict[str, Any], tokenizer: Tokenizer, cache: Optional[TokenCountCache] = default_cache) -> int:
+    """Token count of one sanitized message (any provider's format), cached per message and tokenizer."""
+    if cache is not None:
+        cached = cache.get(tokenizer.name, message)
+        if cached is not None:
+            return cached
+    count = MESSAGE_TOKEN_OVERHEAD + count_content_tokens(message.get('content'), tokenizer)
+    # Gemini messages carry their content as 'parts'; OpenAI tool calls sit beside the content
+    for key in ('parts', 'tool_calls'):
+        if key in message:
+            count += count_content_tokens(message[key], tokenizer)
+    if cache is not None:
+        cache.put(tokenizer.name, message, count)
+    return count
+
+def count_messages_tokens(messages: List[Dict[str, Any]], provider_name: str, model: str) -> int:
+    """Token count of a provider-ready message list."""
+    tokenizer = get_tokenizer(provider_name, model)
+    return sum(count_message_tokens(message, tokenizer) for message in messages)
+
+def count_content_tokens(content: Any, tokenizer: Tokenizer) -> int:
+    """Token count of message content: strings, content-part lists, or single parts."""
+    if content is None:
+        return 0
+    if isinstance(content, str):
+        return tokenizer.count_text(content)
+    if isinstance(content, list):
+        return sum(count_content_tokens(part, tokenizer) for part in content)
+    if isinstance(content, dict):
+        part_type = content.get('type')
+        if part_type in ('image', 'image_url') or 'inline_data' in content:
+            return IMAGE_TOKEN_ESTIMATE
+        if part_type == 'text' or (part_type is None and 'text' in content):
+            return tokenizer.count_text(str(content.get('text', '')))
+        if part_type == 'tool_result':
+            return count_content_tokens(content.get('content', ''), tokenizer)
+    try:
+        return tokenizer.count_text(json.dumps(content, default=str))
+    except (TypeError, ValueError):
+        return tokenizer.count_text(str(content))
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int = 0) -> Optional[float]:
+    """Estimated USD cost at list prices, or None for models without a known price."""
+    model = (model or '').lower()
+    matches = [prefix for prefix in MODEL_PRICES_PER_MILLION if model.startswith(prefix)]
+    if not matches:
+        return None
+    input_price, output_price = MODEL_PRICES_PER_MILLION[max(matches, key=len)]
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000